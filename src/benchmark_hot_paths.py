@@ -0,0 +1,222 @@
+"""
+Benchmark the parse, score, render, and analysis hot paths on the real question bank and sessions
+and on synthetically scaled copies of them.
+
+For each benchmark and scale we record the best and median wall time over several repeats and
+the peak traced memory of one extra run under tracemalloc.  Results are written as JSON under
+results/benchmarks/ with the current git commit so that runs can be compared across commits:
+    python benchmark_hot_paths.py                      # run and save
+    python benchmark_hot_paths.py <baseline.json> <current.json>  # compare two saved runs
+"""
+
+# imports
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+# packages
+import pandas
+
+# project imports
+from bootstrap import bootstrap_confidence_intervals
+from export_session_html import session_to_html
+from question_data import parse_question_source
+from results_cube import build_results_cube, rollup_cube
+from score_exam import parse_gpt_response, score_exam, score_exam_records
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+RESULTS_PATH = Path(__file__).parent.parent / "results"
+BENCHMARK_PATH = RESULTS_PATH / "benchmarks"
+
+# real sessions used as benchmark inputs
+SESSION_PATHS = [
+    RESULTS_PATH / "questions-02" / "sessions-01" / "cpa-exam-020" / "exam_data.json",
+    RESULTS_PATH / "questions-02" / "sessions-01" / "cpa-exam-180" / "exam_data.json",
+]
+
+# synthetic scale factors applied to the real inputs
+SCALE_FACTORS = [1, 10, 100]
+
+# timed repeats per benchmark
+NUM_REPEATS = 5
+
+# ratio of current to baseline time above which a comparison is flagged as a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+def measure(function: Callable[[], object], num_repeats: int = NUM_REPEATS) -> dict:
+    """Time a function over several repeats and trace its peak memory in one extra run."""
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_seconds": min(times),
+        "median_seconds": statistics.median(times),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def get_git_commit() -> str | None:
+    """Return the current git commit hash, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scale_session(exam_data: dict, scale: int) -> dict:
+    """Return a copy of a session with its questions repeated scale times."""
+    return {**exam_data, "questions": exam_data["questions"] * scale}
+
+
+def run_benchmarks() -> list[dict]:
+    """Run all benchmarks at all scales and return the list of results."""
+    question_file = DATA_PATH / "questions_02.txt"
+    question_text = question_file.read_text()
+    session_list = [json.loads(path.read_text()) for path in SESSION_PATHS]
+
+    # score the real sessions once for the analysis benchmarks
+    exam_df = pandas.concat(
+        [score_exam(exam_data) for exam_data in session_list], ignore_index=True
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_path:
+        for scale in SCALE_FACTORS:
+            # scaled question bank written to a temporary file
+            scaled_question_file = Path(temp_path) / f"questions_{scale}.txt"
+            scaled_question_file.write_text(question_text * scale)
+
+            # scaled sessions and scored dataframe
+            scaled_session_list = [
+                scale_session(exam_data, scale) for exam_data in session_list
+            ]
+            response_text_list = [
+                question["model_response"]["choices"][0]["text"]
+                for exam_data in scaled_session_list
+                for question in exam_data["questions"]
+            ]
+            scaled_exam_df = pandas.concat([exam_df] * scale, ignore_index=True)
+            scaled_cube = build_results_cube(scaled_exam_df)
+
+            benchmark_functions = {
+                "parse_question_source": lambda: parse_question_source(
+                    scaled_question_file
+                ),
+                "parse_gpt_response": lambda: [
+                    parse_gpt_response(text) for text in response_text_list
+                ],
+                "score_exam_records": lambda: [
+                    score_exam_records(exam_data) for exam_data in scaled_session_list
+                ],
+                "score_exam": lambda: [
+                    score_exam(exam_data) for exam_data in scaled_session_list
+                ],
+                "session_to_html": lambda: [
+                    session_to_html(
+                        {**exam_data, "session_id": "benchmark", "duration": None}
+                    )
+                    for exam_data in scaled_session_list
+                ],
+                "build_results_cube": lambda: build_results_cube(scaled_exam_df),
+                "rollup_cube": lambda: [
+                    rollup_cube(scaled_cube, dimensions)
+                    for dimensions in [
+                        ["prompt_method"],
+                        ["prompt_method", "temperature"],
+                        ["question_section"],
+                        ["model_name"],
+                    ]
+                ],
+                "bootstrap_confidence_intervals": lambda: bootstrap_confidence_intervals(
+                    scaled_cube, ["question_section"]
+                ),
+            }
+
+            for benchmark_name, benchmark_function in benchmark_functions.items():
+                result = {
+                    "benchmark": benchmark_name,
+                    "scale": scale,
+                    **measure(benchmark_function),
+                }
+                print(
+                    f"{benchmark_name:32s} x{scale:<4d} "
+                    f"{result['min_seconds'] * 1000:10.2f} ms "
+                    f"{result['peak_memory_bytes'] / 2**20:9.2f} MiB"
+                )
+                results.append(result)
+
+    return results
+
+
+def compare_benchmarks(baseline_path: Path, current_path: Path) -> None:
+    """Print the ratio of current to baseline times and memory for every shared benchmark,
+    flagging regressions."""
+    baseline = json.loads(baseline_path.read_text())
+    current = json.loads(current_path.read_text())
+    baseline_results = {(r["benchmark"], r["scale"]): r for r in baseline["results"]}
+
+    print(f"Baseline: {baseline['git_commit']}  Current: {current['git_commit']}")
+    for result in current["results"]:
+        key = (result["benchmark"], result["scale"])
+        if key not in baseline_results:
+            continue
+        time_ratio = result["min_seconds"] / baseline_results[key]["min_seconds"]
+        memory_ratio = result["peak_memory_bytes"] / max(
+            baseline_results[key]["peak_memory_bytes"], 1
+        )
+        flag = "REGRESSION" if time_ratio > REGRESSION_THRESHOLD else ""
+        print(
+            f"{key[0]:32s} x{key[1]:<4d} time {time_ratio:6.2f}x  "
+            f"memory {memory_ratio:6.2f}x  {flag}"
+        )
+
+
+def main():
+    # compare two saved runs if given
+    if len(sys.argv) == 3:
+        compare_benchmarks(Path(sys.argv[1]), Path(sys.argv[2]))
+        return
+
+    git_commit = get_git_commit()
+    benchmark_data = {
+        "git_commit": git_commit,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "results": run_benchmarks(),
+    }
+
+    # save the results keyed on the commit
+    BENCHMARK_PATH.mkdir(parents=True, exist_ok=True)
+    output_path = BENCHMARK_PATH / (
+        f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{(git_commit or 'unknown')[:12]}.json"
+    )
+    output_path.write_text(json.dumps(benchmark_data, indent=2))
+    print(f"Saved benchmark results to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark the import time of the project modules.
+
+Each module is imported in a fresh interpreter with `-X importtime` so that cached modules from
+earlier imports do not hide the cost.  For every module we report the wall time of the import,
+which heavy packages (pandas, numpy, matplotlib) were loaded as a side effect, and whether the
+module stays within its startup budget.  The parsing and scoring modules should not load any
+heavy package and should import in milliseconds.
+"""
+
+# imports
+import subprocess
+import sys
+from pathlib import Path
+
+# modules to benchmark and their import-time budget in milliseconds, or None for no budget
+MODULE_BUDGETS = {
+    "question_data": 50.0,
+    "prompts": 50.0,
+    "score_exam": 50.0,
+    "export_session_html": None,
+    "results_cube": None,
+    "results_assessment_2": None,
+}
+
+# packages that should only be loaded when they are actually used
+HEAVY_PACKAGES = ["pandas", "numpy", "matplotlib"]
+
+# number of fresh interpreters to run per module; we report the fastest
+NUM_REPEATS = 5
+
+
+def measure_import(module_name: str) -> dict:
+    """Import a module in a fresh interpreter and return the import time in milliseconds
+    along with the list of heavy packages it loaded.
+    """
+    check_code = (
+        f"import sys; import {module_name}; "
+        f"print(','.join(p for p in {HEAVY_PACKAGES!r} if p in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check_code],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    import_time_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.split("|")
+        if fields[-1].strip() == module_name:
+            import_time_us = int(fields[1].strip())
+
+    loaded_packages = [p for p in result.stdout.strip().split(",") if len(p) > 0]
+    return {
+        "module": module_name,
+        "import_ms": import_time_us / 1000.0,
+        "heavy_packages": loaded_packages,
+    }
+
+
+def main():
+    failures = []
+    for module_name, budget_ms in MODULE_BUDGETS.items():
+        # take the fastest of several runs to reduce noise from the disk cache
+        results = [measure_import(module_name) for _ in range(NUM_REPEATS)]
+        result = min(results, key=lambda r: r["import_ms"])
+
+        status = "ok"
+        if budget_ms is not None:
+            if result["import_ms"] > budget_ms or len(result["heavy_packages"]) > 0:
+                status = "OVER BUDGET"
+                failures.append(module_name)
+
+        print(
+            f"{module_name:24s} {result['import_ms']:9.1f} ms  "
+            f"budget={budget_ms if budget_ms is not None else '-'}  "
+            f"heavy={','.join(result['heavy_packages']) or '-'}  {status}"
+        )
+
+    if len(failures) > 0:
+        print(f"Modules over budget: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
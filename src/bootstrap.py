@@ -0,0 +1,155 @@
+"""
+Vectorized bootstrap confidence intervals for accuracy rates computed from the results cube.
+
+All groups (e.g., prompts, sections, or models) are resampled together by drawing the same
+bootstrap samples of questions for every group.  The draws are stored as an index matrix of
+shape (num_resamples, num_questions), converted to per-question weights, and applied to the
+group-by-question correct and count matrices with a single matrix product, so there is no
+Python loop over resamples or groups.  Because every group sees the same resampled questions,
+the bootstrap distributions are paired and can be differenced directly to compare prompts.
+"""
+
+# packages
+import numpy
+import pandas
+
+# project imports
+from results_cube import CUBE_MEASURES
+
+# default number of bootstrap resamples
+DEFAULT_NUM_RESAMPLES = 10000
+
+# default seed so that tables and figures are reproducible
+DEFAULT_SEED = 42
+
+
+def get_question_matrices(
+    cube: pandas.DataFrame, dimensions: list[str], measure: str = "is_correct"
+) -> tuple[pandas.Index, numpy.ndarray, numpy.ndarray]:
+    """Return the group index and the (num_groups, num_questions) correct sum and count
+    matrices for the given group dimensions, aligned on (question_section, question_number)
+    so that questions with the same number in different sections stay separate.
+    """
+    if measure not in CUBE_MEASURES:
+        raise ValueError(f"Unknown measure {measure}")
+
+    question_dimensions = [
+        dimension
+        for dimension in ["question_section", "question_number"]
+        if dimension not in dimensions
+    ]
+    question_df = cube.groupby(dimensions + question_dimensions, dropna=False)[
+        ["count", f"{measure}_sum"]
+    ].sum()
+    count_df = question_df["count"].unstack(question_dimensions, fill_value=0)
+    correct_df = question_df[f"{measure}_sum"].unstack(question_dimensions, fill_value=0)
+
+    return (
+        count_df.index,
+        correct_df.to_numpy(dtype=float),
+        count_df.to_numpy(dtype=float),
+    )
+
+
+def get_resample_weights(
+    num_questions: int, num_resamples: int, seed: int = DEFAULT_SEED
+) -> numpy.ndarray:
+    """Draw a (num_resamples, num_questions) index matrix of questions sampled with
+    replacement and return the matching matrix of how many times each question was drawn
+    in each resample.
+    """
+    rng = numpy.random.default_rng(seed)
+    index_matrix = rng.integers(0, num_questions, size=(num_resamples, num_questions))
+
+    # offset each row so that a single bincount counts the draws per (resample, question)
+    offsets = numpy.arange(num_resamples)[:, None] * num_questions
+    weights = numpy.bincount(
+        (index_matrix + offsets).ravel(), minlength=num_resamples * num_questions
+    )
+
+    return weights.reshape(num_resamples, num_questions).astype(float)
+
+
+def bootstrap_rates(
+    correct: numpy.ndarray, count: numpy.ndarray, weights: numpy.ndarray
+) -> numpy.ndarray:
+    """Return the (num_groups, num_resamples) matrix of resampled rates for each group."""
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return (correct @ weights.T) / (count @ weights.T)
+
+
+def bootstrap_confidence_intervals(
+    cube: pandas.DataFrame,
+    dimensions: list[str],
+    measure: str = "is_correct",
+    confidence: float = 0.95,
+    num_resamples: int = DEFAULT_NUM_RESAMPLES,
+    seed: int = DEFAULT_SEED,
+) -> pandas.DataFrame:
+    """Return a dataframe indexed by the group dimensions with the observed rate for the
+    measure and its percentile bootstrap confidence interval:
+        - <measure>: observed rate
+        - <measure>_ci_low: lower bound
+        - <measure>_ci_high: upper bound
+    """
+    group_index, correct, count = get_question_matrices(cube, dimensions, measure)
+    weights = get_resample_weights(correct.shape[1], num_resamples, seed)
+    resampled_rates = bootstrap_rates(correct, count, weights)
+
+    alpha = (1.0 - confidence) / 2.0
+    ci_low, ci_high = numpy.nanquantile(resampled_rates, [alpha, 1.0 - alpha], axis=1)
+
+    return pandas.DataFrame(
+        {
+            measure: correct.sum(axis=1) / count.sum(axis=1),
+            f"{measure}_ci_low": ci_low,
+            f"{measure}_ci_high": ci_high,
+        },
+        index=group_index,
+    )
+
+
+def bootstrap_paired_differences(
+    cube: pandas.DataFrame,
+    dimensions: list[str],
+    measure: str = "is_correct",
+    confidence: float = 0.95,
+    num_resamples: int = DEFAULT_NUM_RESAMPLES,
+    seed: int = DEFAULT_SEED,
+) -> pandas.DataFrame:
+    """Compare every pair of groups on the same resampled questions and return one row per
+    pair (group_a, group_b), with group_a before group_b in the group index:
+        - difference: observed rate of group_a minus rate of group_b
+        - ci_low, ci_high: percentile bootstrap interval of the difference
+        - p_value: two-sided bootstrap p-value that the difference is zero
+    """
+    group_index, correct, count = get_question_matrices(cube, dimensions, measure)
+    weights = get_resample_weights(correct.shape[1], num_resamples, seed)
+    resampled_rates = bootstrap_rates(correct, count, weights)
+    observed_rates = correct.sum(axis=1) / count.sum(axis=1)
+
+    # compare each pair of groups once with a < b
+    group_a, group_b = numpy.triu_indices(len(group_index), k=1)
+    resampled_differences = resampled_rates[group_a] - resampled_rates[group_b]
+
+    alpha = (1.0 - confidence) / 2.0
+    ci_low, ci_high = numpy.nanquantile(
+        resampled_differences, [alpha, 1.0 - alpha], axis=1
+    )
+
+    # two-sided p-value from the share of resamples on either side of zero
+    num_valid = numpy.sum(~numpy.isnan(resampled_differences), axis=1)
+    share_below = numpy.sum(resampled_differences <= 0, axis=1) / num_valid
+    share_above = numpy.sum(resampled_differences >= 0, axis=1) / num_valid
+    p_value = numpy.minimum(1.0, 2.0 * numpy.minimum(share_below, share_above))
+
+    return pandas.DataFrame(
+        {
+            "group_a": group_index[group_a],
+            "group_b": group_index[group_b],
+            "difference": observed_rates[group_a] - observed_rates[group_b],
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "p_value": p_value,
+        }
+    )
@@ -0,0 +1,425 @@
+"""
+A completion API client with a persistent keep-alive connection pool and explicit timeouts.
+
+openai.Completion.create in the pinned openai 0.25 sends each request through a requests session
+private to the calling thread, with a fixed adapter and no way to share or bound the
+connections across the session pipeline's workers, and a request cannot be interrupted from
+another thread.  The runners therefore send completion requests through this client instead.
+It posts to <api_base>/completions with the standard library's http.client and keeps up to
+pool_size HTTP/1.1 connections open for reuse, so concurrent requests do not each pay for a new
+TCP and TLS handshake.  Like the openai package, it sends the organization header, defaults to
+openai.api_base and openai.organization, and raises the openai.error types: APIError,
+RateLimitError, InvalidRequestError, and so on for error responses, Timeout for connect and
+read timeouts, and APIConnectionError when the connection fails.  Responses are returned as
+plain dictionaries in the same shape as the openai package's, and streamed responses as an
+iterator of chunk dictionaries.
+
+A request can be cancelled from another thread through a RequestHandle, which shuts down the
+socket of its connection, e.g., to drop the slower of two hedged requests.
+
+An idle connection the server has closed is noticed before it is reused, and a request is only
+sent again on a new connection if writing it to a reused connection failed; once a request has
+been written, the server may already be running it, so a failure to read the response is
+raised rather than risking a second, billed completion.
+
+Pool statistics, e.g., the connection reuse rate and open sockets, are available from
+get_pool_stats() and are stored with each session.  Pointing api_base at a local server, e.g.,
+local_completion_server.py, exercises the client without calling the API.
+"""
+
+# imports
+import collections
+import http.client
+import json
+import select
+import socket
+import ssl
+import threading
+import urllib.parse
+from typing import Iterator
+
+# packages
+import openai
+import openai.error
+
+# default maximum number of open connections
+DEFAULT_POOL_SIZE = 8
+
+# default seconds to wait to connect and for each read of the response
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+
+# errors writing a request to a reused keep-alive connection that the server closed while idle;
+# the request was not written in full, so the server cannot have run it
+STALE_CONNECTION_ERRORS = (
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+# openai error types by HTTP status, as raised by the openai package; others are APIError
+API_ERROR_TYPES = {
+    400: openai.error.InvalidRequestError,
+    401: openai.error.AuthenticationError,
+    403: openai.error.PermissionError,
+    404: openai.error.InvalidRequestError,
+    409: openai.error.TryAgain,
+    415: openai.error.InvalidRequestError,
+    429: openai.error.RateLimitError,
+}
+
+
+def get_api_error(
+    status: int, response_body: bytes, headers: dict
+) -> openai.error.OpenAIError:
+    """Return the openai error for an error response, as the openai package would raise it."""
+    try:
+        error_data = json.loads(response_body)["error"]
+        message = error_data.get("message")
+    except (KeyError, TypeError, ValueError):
+        return openai.error.APIError(
+            f"Invalid response object from API: {response_body!r} (HTTP response code was "
+            f"{status})",
+            response_body,
+            status,
+            None,
+            headers,
+        )
+    error_type = API_ERROR_TYPES.get(status, openai.error.APIError)
+    if error_type is openai.error.InvalidRequestError:
+        return error_type(
+            message,
+            error_data.get("param"),
+            error_data.get("code"),
+            response_body,
+            status,
+            {"error": error_data},
+            headers,
+        )
+    return error_type(message, response_body, status, {"error": error_data}, headers)
+
+
+def is_connection_dropped(connection: http.client.HTTPConnection) -> bool:
+    """Return whether an idle connection was closed by the server: an idle socket that is
+    readable has either reached end of file or has data no request asked for."""
+    if connection.sock is None:
+        return True
+    try:
+        return len(select.select([connection.sock], [], [], 0.0)[0]) > 0
+    except (OSError, ValueError):
+        return True
+
+
+class CompletionCancelled(Exception):
+    """A request that was cancelled through its RequestHandle."""
+
+
+class RequestHandle:
+    """Cancel an in-flight request from another thread by shutting down its connection's
+    socket; the connection is then discarded instead of going back to the pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.cancelled = False
+
+    def attach(self, connection: http.client.HTTPConnection) -> None:
+        """Record the connection the request is sent on, failing if already cancelled."""
+        with self.lock:
+            if self.cancelled:
+                raise CompletionCancelled()
+            self.connection = connection
+
+    def detach(self) -> bool:
+        """Stop tracking the connection once the request is done, so that a later cancel does
+        not touch it, and return whether the connection is still usable."""
+        with self.lock:
+            self.connection = None
+            return not self.cancelled
+
+    def cancel(self) -> None:
+        """Cancel the request, interrupting any blocking read of its response."""
+        with self.lock:
+            self.cancelled = True
+            if self.connection is not None and self.connection.sock is not None:
+                try:
+                    self.connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class ConnectionPool:
+    """A thread-safe pool of keep-alive connections to one host, with at most pool_size
+    connections open at a time; callers wait for a free connection when all are in use."""
+
+    def __init__(
+        self,
+        api_base: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ):
+        url = urllib.parse.urlsplit(api_base)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.base_path = url.path.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.lock = threading.Lock()
+        self.available = threading.Semaphore(pool_size)
+        self.idle_connections = collections.deque()
+        self.num_open_connections = 0
+        self.num_requests = 0
+        self.num_connections_opened = 0
+        self.num_connections_reused = 0
+        self.num_connections_discarded = 0
+
+    def open_connection(self) -> http.client.HTTPConnection:
+        """Open a new connection with the connect timeout, then switch to the read timeout."""
+        if self.scheme == "https":
+            connection = http.client.HTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.connect_timeout,
+                context=ssl.create_default_context(),
+            )
+        else:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.connect_timeout
+            )
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection
+
+    def acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """Return an idle connection, or a new one if there is none, and whether it was
+        reused.  Idle connections the server has closed are discarded.  Blocks while
+        pool_size connections are in use."""
+        self.available.acquire()
+        with self.lock:
+            self.num_requests += 1
+            while len(self.idle_connections) > 0:
+                connection = self.idle_connections.pop()
+                if is_connection_dropped(connection):
+                    connection.close()
+                    self.num_open_connections -= 1
+                    self.num_connections_discarded += 1
+                    continue
+                self.num_connections_reused += 1
+                return connection, True
+
+        try:
+            connection = self.open_connection()
+        except BaseException:
+            self.available.release()
+            raise
+        with self.lock:
+            self.num_open_connections += 1
+            self.num_connections_opened += 1
+        return connection, False
+
+    def release(self, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        """Return a connection to the pool, or close it if it cannot be reused."""
+        with self.lock:
+            if reusable:
+                self.idle_connections.append(connection)
+            else:
+                connection.close()
+                self.num_open_connections -= 1
+                self.num_connections_discarded += 1
+        self.available.release()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self.lock:
+            while len(self.idle_connections) > 0:
+                self.idle_connections.pop().close()
+                self.num_open_connections -= 1
+
+    def get_stats(self) -> dict:
+        """Return the pool size, request and connection counts, and reuse rate."""
+        with self.lock:
+            return {
+                "pool_size": self.pool_size,
+                "num_requests": self.num_requests,
+                "connections_opened": self.num_connections_opened,
+                "connections_reused": self.num_connections_reused,
+                "connections_discarded": self.num_connections_discarded,
+                "reuse_rate": self.num_connections_reused / self.num_requests
+                if self.num_requests > 0
+                else None,
+                "open_connections": self.num_open_connections,
+                "idle_connections": len(self.idle_connections),
+            }
+
+
+class CompletionStream:
+    """Iterate over the chunks of a streamed completion sent as server-sent events.  The
+    connection goes back to the pool if the stream is read to the end, and is closed if the
+    stream is closed early."""
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        connection: http.client.HTTPConnection,
+        response: http.client.HTTPResponse,
+        handle: RequestHandle | None = None,
+    ):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.handle = handle
+        self.finished = False
+        self.closed = False
+
+    def __iter__(self) -> Iterator[dict]:
+        for line in self.response:
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                self.finished = True
+                break
+            yield json.loads(data)
+        else:
+            self.finished = True
+
+    def close(self) -> None:
+        """Release the connection, closing it unless the stream was read to the end."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.handle is not None and not self.handle.detach():
+            self.finished = False
+        if self.finished:
+            # read any trailing bytes so the connection is ready for the next request
+            self.response.read()
+        self.pool.release(self.connection, reusable=self.finished)
+
+
+class CompletionClient:
+    """Send completion requests through a keep-alive connection pool."""
+
+    def __init__(
+        self,
+        api_key: str,
+        api_base: str | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        organization: str | None = None,
+    ):
+        self.api_key = api_key.strip()
+        self.organization = organization or openai.organization
+        self.pool = ConnectionPool(
+            api_base or openai.api_base, pool_size, connect_timeout, read_timeout
+        )
+
+    def send_request(
+        self, body: dict, handle: RequestHandle | None = None
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """Post a request body to the completions endpoint and return the connection and
+        response.  If writing the request to a reused connection fails, the server closed
+        the connection before the request reached it, and the request is written to a new
+        connection instead, unless it was cancelled through its handle."""
+        body_bytes = json.dumps(body).encode("utf-8")
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive",
+        }
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        while True:
+            connection, reused = self.pool.acquire()
+            try:
+                if handle is not None:
+                    handle.attach(connection)
+                try:
+                    connection.request(
+                        "POST",
+                        f"{self.pool.base_path}/completions",
+                        body=body_bytes,
+                        headers=headers,
+                    )
+                    written = True
+                except STALE_CONNECTION_ERRORS:
+                    if not reused or (handle is not None and handle.cancelled):
+                        raise
+                    written = False
+                if written:
+                    return connection, connection.getresponse()
+            except BaseException:
+                self.release(connection, False, handle)
+                raise
+            self.release(connection, False, handle)
+
+    def create(
+        self,
+        model: str,
+        prompt: str,
+        stream: bool = False,
+        handle: RequestHandle | None = None,
+        **parameters,
+    ) -> dict | CompletionStream:
+        """Create a completion and return the response dictionary, or a CompletionStream of
+        chunk dictionaries if stream is set.  Errors are raised as the openai package raises
+        them (see get_api_error), and cancelling the request through its handle raises
+        CompletionCancelled."""
+        body = {"model": model, "prompt": prompt, **parameters}
+        if stream:
+            body["stream"] = True
+        try:
+            connection, response = self.send_request(body, handle)
+            if response.status >= 400:
+                try:
+                    response_body = response.read()
+                except BaseException:
+                    self.release(connection, False, handle)
+                    raise
+                self.release(connection, not response.will_close, handle)
+                raise get_api_error(response.status, response_body, dict(response.getheaders()))
+
+            if stream:
+                return CompletionStream(self.pool, connection, response, handle)
+
+            try:
+                response_data = json.loads(response.read())
+            except BaseException:
+                self.release(connection, False, handle)
+                raise
+        except (OSError, http.client.HTTPException) as error:
+            if handle is not None and handle.cancelled:
+                raise CompletionCancelled() from error
+            if isinstance(error, socket.timeout):
+                raise openai.error.Timeout("Request timed out") from error
+            raise openai.error.APIConnectionError(
+                f"Error communicating with {self.pool.host}: {error!r}"
+            ) from error
+        self.release(connection, not response.will_close, handle)
+        return response_data
+
+    def release(
+        self,
+        connection: http.client.HTTPConnection,
+        reusable: bool,
+        handle: RequestHandle | None,
+    ) -> None:
+        """Detach a finished request's handle and return its connection to the pool, which
+        discards it if the request was cancelled."""
+        if handle is not None:
+            reusable = handle.detach() and reusable
+        self.pool.release(connection, reusable=reusable)
+
+    def get_pool_stats(self) -> dict:
+        """Return the connection pool statistics."""
+        return self.pool.get_stats()
+
+    def close(self) -> None:
+        """Close the idle connections in the pool."""
+        self.pool.close()
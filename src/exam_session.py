@@ -0,0 +1,635 @@
+"""
+Run a single CPA exam session: generate the prompt for each question, query the completion API
+with retries, record per-request metrics, and write the session JSON as it progresses.
+
+Sessions run in one of the following scoring modes:
+    - completion: generate a full completion and parse the answer fields from its text
+    - logprob: generate a single answer token with logprobs and rank the choices from its
+      distribution, which needs a prompt ending right before the answer, e.g., prompt style 021
+    - two_phase: generate only the ranked choices with a stop sequence and a small token
+      budget, then request explanations in a second pass for a subset of questions selected by
+      the explanation policy; meant for the rank order prompts with explanations, e.g., 017-020
+
+Completion mode can also stream responses through an incremental parser and cancel the stream
+once the answer fields are parsed, so that latency reflects time-to-answer.
+
+Questions run through a pipeline of render, request, parse, and write stages connected by
+bounded queues, so prompts are rendered and responses parsed and saved while other requests
+are in flight.  The worker count of each stage is configurable, except that a single writer
+keeps the questions in order; the writer only rewrites the session JSON when it has caught up,
+so a slow disk does not hold up requests.
+
+Requests go through a CompletionClient with a keep-alive connection pool; its statistics are
+stored with the session's request metrics.  With a HedgePolicy, slow requests are duplicated
+and the first response kept (see hedging.py), for greedy, non-streamed sessions only; the hedge
+rate and the tokens spent on hedges are part of the request metrics.
+
+A request aborted by a circuit breaker or token budget (see request_guards.py) is not retried;
+it stops the session, which is saved without an end time and with the abort reason.  Running
+the session again with resume set keeps the answered questions and only asks the rest.
+
+With a SweepMetrics, requests and live scores are reported as they happen (see live_metrics.py).
+
+This is shared by run_exam.py and run_exam_old_models.py, along with the setup both runners use
+for their sessions: the question list with its near-duplicate report, the session settings and
+completion client, the hedge policy, and the live metrics server.
+"""
+
+# imports
+import datetime
+import json
+import random
+import time
+from pathlib import Path
+from typing import Callable
+
+# packages
+import openai
+import tqdm
+
+# project imports
+from completion_client import CompletionClient
+from hedging import HedgePolicy, create_hedged_completion, is_hedging_safe
+from live_metrics import SweepMetrics, get_metrics_port, start_metrics_server
+from pipeline import DEFAULT_QUEUE_SIZE, Pipeline
+from question_data import parse_question_source
+from question_duplicates import (
+    find_duplicate_clusters,
+    print_duplicate_report,
+    remove_duplicate_questions,
+)
+from request_guards import RequestAborted
+from request_metrics import RequestTimer, summarize_request_metrics
+from score_exam import (
+    IncrementalResponseParser,
+    normalize_answer_letter,
+    parse_gpt_response,
+    rank_answer_logprobs,
+)
+
+# seconds to wait before each retry after a failed request
+RETRY_DELAYS = [5, 10]
+
+# supported scoring modes
+SCORING_MODES = ["completion", "logprob", "two_phase"]
+
+# parameters overridden in logprob mode: one token with the top five alternatives
+LOGPROB_PARAMETERS = {
+    "max_tokens": 1,
+    "logprobs": 5,
+    "best_of": 1,
+}
+
+# parameters overridden in the first pass of two_phase mode: stop before the explanation
+ANSWER_PHASE_PARAMETERS = {
+    "max_tokens": 24,
+    "stop": ["Explanation:"],
+}
+
+# policies for selecting which questions get an explanation in the second pass of two_phase mode
+EXPLANATION_POLICIES = ["none", "wrong", "sample", "all"]
+
+# default worker threads for each stage of the question pipeline
+PIPELINE_STAGE_WORKERS = {
+    "render": 1,
+    "request": 1,
+    "parse": 1,
+    "write": 1,
+}
+
+
+def get_required_fields(prompt: str) -> tuple[str, ...]:
+    """Return the answer fields a prompt asks for, used to decide when a streamed response
+    has answered."""
+    if "Third Choice:" in prompt:
+        return ("answer", "second_answer", "third_answer")
+    elif "Second Choice:" in prompt:
+        return ("answer", "second_answer")
+    return ("answer",)
+
+
+def stream_completion(
+    client: CompletionClient,
+    model_name: str,
+    prompt: str,
+    parameter_kwargs: dict,
+    timer: RequestTimer,
+    keep_explanations: bool,
+) -> dict:
+    """Stream a completion through the incremental response parser and return a response
+    dictionary in the same shape as a non-streamed completion.  Unless explanations are kept,
+    the stream is cancelled as soon as the required answer fields are parsed and the choice
+    finish_reason is set to "cancelled"; a stream that ends without a finish reason keeps
+    None.  The usage reported by the server, on the final chunk, is kept if present."""
+    parser = IncrementalResponseParser(get_required_fields(prompt))
+    response = None
+    finish_reason = None
+    usage = None
+    num_chunks = 0
+
+    stream = client.create(
+        model=model_name,
+        prompt=prompt,
+        stream=True,
+        **parameter_kwargs,
+    )
+    try:
+        for chunk in stream:
+            timer.mark_first_token()
+            num_chunks += 1
+            if response is None:
+                response = {
+                    "id": chunk["id"],
+                    "object": "text_completion",
+                    "created": chunk["created"],
+                    "model": chunk["model"],
+                }
+            parser.feed(chunk["choices"][0]["text"])
+            if chunk["choices"][0].get("finish_reason") is not None:
+                finish_reason = chunk["choices"][0]["finish_reason"]
+            if chunk.get("usage") is not None:
+                usage = chunk["usage"]
+
+            # stop reading once the answer is in unless we want the explanation too
+            if parser.is_complete():
+                timer.mark_answer()
+                if not keep_explanations and finish_reason is None:
+                    finish_reason = "cancelled"
+                    break
+    finally:
+        stream.close()
+
+    if response is None:
+        response = {"id": None, "object": "text_completion", "model": model_name}
+    response["choices"] = [
+        {
+            "text": parser.text,
+            "index": 0,
+            "logprobs": None,
+            "finish_reason": finish_reason,
+        }
+    ]
+    # without usage from the server, e.g., for a cancelled stream, estimate one token per chunk
+    response["usage"] = usage or {
+        "prompt_tokens": None,
+        "completion_tokens": num_chunks,
+        "total_tokens": None,
+        "estimated": True,
+    }
+
+    return response
+
+
+def create_completion(
+    client: CompletionClient,
+    model_name: str,
+    prompt: str,
+    parameter_kwargs: dict,
+    timer: RequestTimer,
+    question_prog_bar: tqdm.tqdm,
+    stream: bool = False,
+    keep_explanations: bool = True,
+    hedge_policy: HedgePolicy | None = None,
+) -> dict | None:
+    """Query the completion API, retrying on failure after each delay in RETRY_DELAYS,
+    and return the response or None if every attempt failed.  Non-streamed requests are
+    hedged if a hedge policy is given.  Aborted requests are raised without retrying."""
+    for attempt_number in range(len(RETRY_DELAYS) + 1):
+        timer.start_attempt()
+        try:
+            if stream:
+                response = stream_completion(
+                    client, model_name, prompt, parameter_kwargs, timer, keep_explanations
+                )
+            elif hedge_policy is not None:
+                response, hedge_metrics = create_hedged_completion(
+                    client, hedge_policy, model_name, prompt, parameter_kwargs
+                )
+                timer.record_hedge(hedge_metrics)
+            else:
+                response = client.create(
+                    model=model_name,
+                    prompt=prompt,
+                    **parameter_kwargs,
+                )
+            timer.end_attempt(success=True)
+            return response
+        except RequestAborted:
+            timer.end_attempt(success=False)
+            raise
+        except Exception as e:
+            timer.end_attempt(success=False)
+            if attempt_number == len(RETRY_DELAYS):
+                print(f"Error after {attempt_number + 1} attempts, skipping: {e}")
+                return None
+
+            # sleep and retry
+            question_prog_bar.set_description(
+                f"Error {attempt_number + 1}, retrying in {RETRY_DELAYS[attempt_number]}: {e}"
+            )
+            time.sleep(RETRY_DELAYS[attempt_number])
+
+
+def write_session(exam_data: dict, session_path: Path) -> None:
+    """Write the current state of the exam session to disk."""
+    with open(session_path / "exam_data.json", "wt", encoding="utf-8") as output_file:
+        json.dump(exam_data, output_file)
+
+
+def select_for_explanation(
+    question_data: dict,
+    explanation_policy: str,
+    explanation_rng: random.Random,
+    explanation_sample_rate: float,
+) -> bool:
+    """Return whether a question answered in the first pass should get an explanation."""
+    if explanation_policy == "all":
+        return True
+    elif explanation_policy == "wrong":
+        try:
+            answer_text = question_data["model_response"]["choices"][0]["text"]
+        except (KeyError, TypeError):
+            return False
+        # compare normalized letters as score_exam does, so "a." is not treated as wrong
+        answer = normalize_answer_letter(parse_gpt_response(answer_text)["answer"])
+        return answer != normalize_answer_letter(question_data["question_input"]["answer"])
+    elif explanation_policy == "sample":
+        return explanation_rng.random() < explanation_sample_rate
+    return False
+
+
+def run_explanation_phase(
+    exam_data: dict,
+    client: CompletionClient,
+    model_name: str,
+    parameter_kwargs: dict,
+    session_path: Path,
+    explanation_policy: str,
+    explanation_sample_rate: float,
+) -> None:
+    """Request explanations for the selected questions by continuing each first pass
+    completion after "Explanation:", storing them on the question as explanation_response."""
+    explanation_rng = random.Random(0)
+
+    question_prog_bar = tqdm.tqdm(exam_data["questions"], desc="Explanations")
+    for question_data in question_prog_bar:
+        if question_data["model_response"] is None or not select_for_explanation(
+            question_data, explanation_policy, explanation_rng, explanation_sample_rate
+        ):
+            continue
+
+        # continue the answer with the explanation using the original token budget
+        answer_text = question_data["model_response"]["choices"][0]["text"]
+        prompt = question_data["model_prompt"] + answer_text.rstrip() + "\nExplanation:"
+        timer = RequestTimer()
+        try:
+            question_data["explanation_response"] = create_completion(
+                client, model_name, prompt, parameter_kwargs, timer, question_prog_bar
+            )
+        finally:
+            question_data["explanation_metrics"] = timer.get_metrics(
+                question_data.get("explanation_response")
+            )
+            write_session(exam_data, session_path)
+
+    exam_data["explanation_request_metrics"] = summarize_request_metrics(
+        [
+            question_data["explanation_metrics"]
+            for question_data in exam_data["questions"]
+            if "explanation_metrics" in question_data
+        ]
+    )
+
+
+def run_exam_session(
+    model_name: str,
+    prompt_method: Callable[[dict], str],
+    parameter_kwargs: dict,
+    question_list: list[dict],
+    question_set_name: str,
+    session_path: Path,
+    scoring_mode: str = "completion",
+    explanation_policy: str = "wrong",
+    explanation_sample_rate: float = 0.1,
+    stream_responses: bool = False,
+    keep_explanations: bool = True,
+    num_samples: int = 1,
+    stage_workers: dict | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    client: CompletionClient | None = None,
+    hedge_policy: HedgePolicy | None = None,
+    resume: bool = False,
+    live_metrics: SweepMetrics | None = None,
+) -> dict:
+    """Run one exam session over the question list and return the session data.  The
+    explanation policy and sample rate only apply in two_phase mode.  With stream_responses,
+    completions are streamed and, unless keep_explanations is set, cancelled as soon as the
+    answer fields are parsed; streaming is only used in completion mode with best_of=1 since
+    the API cannot stream best_of completions.  With num_samples > 1, each request asks for n
+    completions so the prompt is only sent once per question, and every choice is stored as a
+    sample of the same session; this does not apply in logprob mode, where the ranking comes
+    from a single token distribution.  stage_workers overrides the worker count of any of the
+    pipeline stages in PIPELINE_STAGE_WORKERS, and queue_size bounds the queue in front of
+    each stage.  Requests go through the given client, or a default client for the API key
+    set on the openai module.  The hedge policy applies to the first pass only, and is ignored
+    for streamed sessions and for parameters that sample, where duplicates could return
+    different answers.  With resume, the answered questions of an unfinished session already
+    saved at the session path are kept and only the rest are asked.  Requests and scores are
+    reported to live_metrics if given."""
+    if scoring_mode not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode {scoring_mode}")
+    if explanation_policy not in EXPLANATION_POLICIES:
+        raise ValueError(f"Unknown explanation policy {explanation_policy}")
+    stage_workers = {**PIPELINE_STAGE_WORKERS, **(stage_workers or {})}
+    client = client or CompletionClient(openai.api_key)
+    if stage_workers["write"] != 1:
+        raise ValueError("The write stage must have exactly one worker")
+
+    # keep the parameters for the second pass before overriding them for the first
+    explanation_parameter_kwargs = parameter_kwargs
+    if scoring_mode == "logprob":
+        parameter_kwargs = {**parameter_kwargs, **LOGPROB_PARAMETERS}
+    elif scoring_mode == "two_phase":
+        parameter_kwargs = {**parameter_kwargs, **ANSWER_PHASE_PARAMETERS}
+
+    # request all samples at once with n; the API requires best_of to be at least n, and
+    # best_of == n returns all candidates, so best_of is only raised in the request, and the
+    # session keeps the caller's best_of in its parameters and n as num_samples
+    request_parameter_kwargs = parameter_kwargs
+    if num_samples > 1 and scoring_mode != "logprob":
+        request_parameter_kwargs = {**parameter_kwargs, "n": num_samples}
+        if parameter_kwargs.get("best_of", 1) < num_samples:
+            request_parameter_kwargs["best_of"] = num_samples
+    else:
+        num_samples = 1
+
+    stream_responses = (
+        stream_responses
+        and scoring_mode == "completion"
+        and request_parameter_kwargs.get("best_of", 1) == 1
+    )
+
+    if stream_responses or not is_hedging_safe(request_parameter_kwargs):
+        hedge_policy = None
+
+    # generate the prompts
+    exam_data = {
+        "model_name": model_name,
+        "question_set": question_set_name,
+        "prompt_method": str(prompt_method.__name__),
+        "scoring_mode": scoring_mode,
+        "stream_responses": stream_responses,
+        "keep_explanations": keep_explanations,
+        "num_samples": num_samples,
+        "parameter_set": explanation_parameter_kwargs,
+        "parameters": parameter_kwargs,
+        "hedge_policy": hedge_policy.get_settings() if hedge_policy is not None else None,
+        "start_time": datetime.datetime.now().isoformat(),
+        "end_time": None,
+        "questions": [],
+        "request_metrics": None,
+        "pipeline_stats": None,
+        "abort_reason": None,
+    }
+
+    # keep the answered questions of an unfinished session
+    answered_questions = {}
+    if resume and (session_path / "exam_data.json").exists():
+        with open(session_path / "exam_data.json", "rt", encoding="utf-8") as input_file:
+            previous_exam_data = json.load(input_file)
+        if (
+            previous_exam_data["model_name"] != model_name
+            or previous_exam_data["prompt_method"] != exam_data["prompt_method"]
+            or previous_exam_data["question_set"] != question_set_name
+        ):
+            raise ValueError(f"Cannot resume a different session at {session_path}")
+        answered_questions = {
+            question_index: question_data
+            for question_index, question_data in enumerate(previous_exam_data["questions"])
+            if question_data["model_response"] is not None
+        }
+        exam_data["start_time"] = previous_exam_data["start_time"]
+
+    if live_metrics is not None:
+        metric_labels = SweepMetrics.get_labels(exam_data)
+
+    question_prog_bar = tqdm.tqdm(total=len(question_list), desc="Questions")
+    question_prog_bar.set_description(
+        f"Prompt method {str(prompt_method.__name__)}, parameters: {parameter_kwargs}"
+    )
+
+    def render_question(indexed_question: tuple[int, dict]) -> tuple[int, dict, RequestTimer]:
+        """Generate the prompt and start timing once it is ready to send."""
+        question_index, question = indexed_question
+        question_data = {
+            "question_input": question,
+            "model_prompt": prompt_method(question),
+            "model_response": None,
+            "request_metrics": None,
+        }
+        return question_index, question_data, RequestTimer()
+
+    def request_question(
+        rendered_question: tuple[int, dict, RequestTimer]
+    ) -> tuple[int, dict, RequestTimer]:
+        """Query the API with retries, leaving the response as None if every attempt failed."""
+        question_index, question_data, timer = rendered_question
+        if live_metrics is not None:
+            live_metrics.start_request(metric_labels)
+        question_data["model_response"] = create_completion(
+            client,
+            model_name,
+            question_data["model_prompt"],
+            request_parameter_kwargs,
+            timer,
+            question_prog_bar,
+            stream=stream_responses,
+            keep_explanations=keep_explanations,
+            hedge_policy=hedge_policy,
+        )
+        if live_metrics is not None:
+            live_metrics.finish_request(
+                metric_labels, timer.get_metrics(question_data["model_response"])
+            )
+        return question_index, question_data, timer
+
+    def parse_question(
+        requested_question: tuple[int, dict, RequestTimer]
+    ) -> tuple[int, dict]:
+        """Rank the choices in logprob mode, record the request metrics, and score the
+        question for the live metrics."""
+        question_index, question_data, timer = requested_question
+        if scoring_mode == "logprob":
+            answer_logprobs = rank_answer_logprobs(
+                question_data["model_response"],
+                question_data["question_input"]["choices"],
+            )
+            question_data["answer_ranking"] = answer_logprobs["ranking"]
+            question_data["answer_logprobs"] = answer_logprobs["logprobs"]
+        question_data["request_metrics"] = timer.get_metrics(
+            question_data["model_response"]
+        )
+        if live_metrics is not None:
+            live_metrics.score_question(metric_labels, exam_data, question_data)
+        return question_index, question_data
+
+    # questions finish out of order with several request workers, so hold them until the
+    # questions before them are in; resumed questions start out waiting
+    pending_questions = dict(answered_questions)
+
+    def write_question(parsed_question: tuple[int, dict]) -> None:
+        """Add questions to the session in order and save it once the writer has caught up."""
+        question_index, question_data = parsed_question
+        pending_questions[question_index] = question_data
+        while len(exam_data["questions"]) in pending_questions:
+            exam_data["questions"].append(
+                pending_questions.pop(len(exam_data["questions"]))
+            )
+            question_prog_bar.update(1)
+        question_prog_bar.set_postfix(question_pipeline.get_queue_depths())
+        if question_pipeline.stages[-1].input_queue.empty():
+            write_session(exam_data, session_path)
+
+    question_pipeline = Pipeline(
+        [
+            ("render", render_question, stage_workers["render"]),
+            ("request", request_question, stage_workers["request"]),
+            ("parse", parse_question, stage_workers["parse"]),
+            ("write", write_question, stage_workers["write"]),
+        ],
+        queue_size=queue_size,
+    )
+    try:
+        question_pipeline.run(
+            (question_index, question)
+            for question_index, question in enumerate(question_list)
+            if question_index not in answered_questions
+        )
+        # add any answered questions left at the end of a resumed session
+        while len(exam_data["questions"]) in pending_questions:
+            exam_data["questions"].append(
+                pending_questions.pop(len(exam_data["questions"]))
+            )
+            question_prog_bar.update(1)
+    except RequestAborted as error:
+        exam_data["abort_reason"] = str(error)
+        raise
+    finally:
+        # keep questions answered past the point where a stopped session got to, with the
+        # questions in between unanswered so that positions still match the question list
+        if len(pending_questions) > 0:
+            for question_index in range(len(exam_data["questions"]), max(pending_questions) + 1):
+                exam_data["questions"].append(
+                    pending_questions.pop(
+                        question_index,
+                        {
+                            "question_input": question_list[question_index],
+                            "model_prompt": None,
+                            "model_response": None,
+                            "request_metrics": None,
+                        },
+                    )
+                )
+
+        # log the current state of the exam
+        question_prog_bar.close()
+        exam_data["pipeline_stats"] = question_pipeline.get_stats()
+        write_session(exam_data, session_path)
+
+    # request explanations for the selected questions in a second pass
+    if scoring_mode == "two_phase":
+        exam_data["explanation_policy"] = explanation_policy
+        exam_data["explanation_parameters"] = explanation_parameter_kwargs
+        run_explanation_phase(
+            exam_data,
+            client,
+            model_name,
+            explanation_parameter_kwargs,
+            session_path,
+            explanation_policy,
+            explanation_sample_rate,
+        )
+
+    # save final state with the session metrics rollup
+    exam_data["end_time"] = datetime.datetime.now().isoformat()
+    exam_data["request_metrics"] = summarize_request_metrics(
+        [question["request_metrics"] for question in exam_data["questions"]]
+    )
+    exam_data["request_metrics"]["connection_pool"] = client.get_pool_stats()
+    write_session(exam_data, session_path)
+
+    return exam_data
+
+
+def load_runner_questions(question_file: Path) -> tuple[list[dict], str]:
+    """Parse a runner's question file, report its near-duplicate questions, and return the
+    question list and the question set name stored with each session."""
+    question_list = parse_question_source(question_file)
+    question_set_name = question_file.name
+
+    # report near-duplicate questions, and ask only the first question of each cluster if set
+    deduplicate_questions = False
+    duplicate_clusters = find_duplicate_clusters(question_list)
+    print_duplicate_report(question_list, duplicate_clusters)
+    if deduplicate_questions and len(duplicate_clusters) > 0:
+        question_list = remove_duplicate_questions(question_list, duplicate_clusters)
+        question_set_name = f"{question_file.name} (deduplicated)"
+
+    return question_list, question_set_name
+
+
+def get_runner_session_kwargs() -> dict:
+    """Return the run_exam_session keyword arguments shared by every session of the runners,
+    including the completion client, and start the live metrics server if
+    CPA_EXAM_METRICS_PORT is set."""
+    # set samples per request; these are requested with n in one call and stored as samples
+    # of the same session, which score_exam also majority votes
+    num_samples_per_request = 1
+
+    # set the scoring mode; "logprob" ranks choices from one answer token and should be
+    # used with generate_prompt_021, and "two_phase" requests the ranked choices first and
+    # then explanations only for the questions selected by the explanation policy
+    scoring_mode = "completion"
+    explanation_policy = "wrong"
+
+    # stream completions and cancel them once the answer is parsed unless explanations are kept
+    stream_responses = False
+    keep_explanations = True
+
+    # set the worker threads for each stage of the question pipeline; more request workers
+    # send requests for a session concurrently, so only raise it with rate limit to spare
+    stage_workers = {"render": 1, "request": 1, "parse": 1, "write": 1}
+
+    # send requests through a keep-alive connection pool with at least one connection per
+    # request worker, and explicit connect and read timeouts in seconds
+    client = CompletionClient(
+        openai.api_key, pool_size=4, connect_timeout=10.0, read_timeout=120.0
+    )
+
+    # serve live request counts, throughput, and accuracy at http://127.0.0.1:<port>/metrics
+    # if CPA_EXAM_METRICS_PORT is set to a port
+    live_metrics = None
+    metrics_port = get_metrics_port()
+    if metrics_port is not None:
+        live_metrics = SweepMetrics()
+        start_metrics_server(live_metrics, port=metrics_port)
+
+    return {
+        "scoring_mode": scoring_mode,
+        "explanation_policy": explanation_policy,
+        "stream_responses": stream_responses,
+        "keep_explanations": keep_explanations,
+        "num_samples": num_samples_per_request,
+        "stage_workers": stage_workers,
+        "client": client,
+        "live_metrics": live_metrics,
+    }
+
+
+def create_runner_hedge_policy() -> HedgePolicy | None:
+    """Return a hedge policy for the sessions of one model, or None if hedging is off."""
+    # optionally duplicate requests outstanding past the 95th percentile latency and keep the
+    # first response; only applies to temperature 0 sessions that are not streamed, and each
+    # hedge pays for a second request, so it is off unless hedge_requests is set
+    hedge_requests = False
+    return HedgePolicy(percentile=95) if hedge_requests else None
@@ -4,14 +4,15 @@ export a session from JSON to HTML
 
 # imports
 import datetime
-import json
 from pathlib import Path
 
 # packages
 import jinja2
 
 # project
-from score_exam import score_exam
+from profiling import Profiler
+from score_exam import score_exam_records
+from session_archive import iter_sessions
 
 
 def session_to_html(json_data: dict) -> str:
@@ -36,17 +37,12 @@ if __name__ == "__main__":
         Path(__file__).parent.parent / "results" / "questions-02" / "sessions-002"
     )
 
-    # get the list of json files under here
-    json_file_list = list(data_path.rglob("*.json"))
+    # profile the run if CPA_EXAM_PROFILE is set
+    profiler = Profiler("export_session_html", data_path).start()
 
-    # iterate through the files
-    for json_file in json_file_list:
-        # load the data
-        with open(json_file, "r") as input_file:
-            data = json.load(input_file)
-
-        # set the session ID as the folder name above
-        session_id = json_file.parent.name
+    # iterate through the sessions, stored as directories or archives
+    for session_id, data in profiler.time_iterator("load", iter_sessions(data_path)):
+        # set the session ID as the folder name
         data["session_id"] = session_id
 
         # populate the duration variable by subtracting iso format end_time and start_time
@@ -57,24 +53,34 @@ if __name__ == "__main__":
         except:
             data["duration"] = None
 
-        # merge the correct answer and correct/incorrect scoring onto the data dict
-        exam_scored = score_exam(data)
+        # merge the correct answer and the scoring of each question's first sample onto the
+        # data dict; sessions run with n > 1 have one scored record per sample
+        with profiler.stage("score"):
+            exam_scored = {
+                record["question_number"]: record
+                for record in score_exam_records(data)
+                if record["sample_index"] == 0
+            }
         for i in range(len(data["questions"])):
-            data["questions"][i]["correct_answer"] = exam_scored["correct_answer"][i]
-            data["questions"][i]["is_correct"] = exam_scored["is_correct"][i]
-            data["questions"][i]["question_section"] = exam_scored["question_section"][
-                i
-            ]
-            data["questions"][i]["question_number"] = exam_scored["question_number"][i]
+            question_record = exam_scored[i + 1]
+            data["questions"][i]["correct_answer"] = question_record["correct_answer"]
+            data["questions"][i]["is_correct"] = question_record["is_correct"]
+            data["questions"][i]["question_section"] = question_record["question_section"]
+            data["questions"][i]["question_number"] = question_record["question_number"]
 
         # convert to HTML
         try:
-            html = session_to_html(data)
+            with profiler.stage("render"):
+                html = session_to_html(data)
         except Exception as error:
-            print(f"Error: {error} with {json_file}")
+            print(f"Error: {error} with {session_id}")
             continue
 
-        # write it back out into the same directory
-        html_file = json_file.parent / f"session.html"
+        # write it out into the session directory
+        html_file = data_path / session_id / f"session.html"
+        html_file.parent.mkdir(exist_ok=True)
         print(html_file)
-        html_file.write_text(html)
+        with profiler.stage("write"):
+            html_file.write_text(html)
+
+    profiler.stop()
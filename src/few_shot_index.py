@@ -0,0 +1,226 @@
+"""
+A BM25 retrieval index over the question bank for choosing few-shot exemplars.
+
+Few-shot prompts show the model the k most similar solved questions before the one it answers.
+Scoring the whole bank for every prompt would repeat the same quadratic work in every session,
+so FewShotIndex scores every question against every other once, the first time exemplars are
+looked up, so that building the index for a sweep that never renders a few-shot prompt is free:
+    1. each question's normalized text and choices (see question_duplicates) are split into
+       words, and the postings of each word hold the BM25 weight of the word in each question
+    2. blocks of questions are scored at once by adding up the postings of their words with
+       NumPy, bounded by MAX_BLOCK_SCORES scores and MAX_BLOCK_POSTINGS postings per block
+    3. the question itself, questions of another type, and optionally questions of the same
+       section are excluded, and the top num_neighbors are kept in a neighbor table
+Building a prompt is then a dictionary lookup of the question's row, e.g.:
+    few_shot_index = FewShotIndex(question_list, num_neighbors=3, exclude_same_section=True)
+    prompt_method = get_few_shot_prompt_method(few_shot_index)
+    prompt_method(question_list[0])
+
+Exemplars include their answers, so a near-duplicate of the question in its own section would
+give the answer away; exclude_same_section avoids that and any section-specific hints.
+"""
+
+# imports
+import itertools
+import threading
+from typing import Callable
+
+# packages
+import numpy
+
+# project imports
+from prompts import generate_prompt_022
+from question_duplicates import get_question_id, normalize_question_text
+
+# default number of exemplars per question
+DEFAULT_NUM_NEIGHBORS = 3
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# maximum question pair scores and expanded postings held in memory for one block of questions
+MAX_BLOCK_SCORES = 10_000_000
+MAX_BLOCK_POSTINGS = 20_000_000
+
+
+class FewShotIndex:
+    """The top num_neighbors most similar questions of each question in a bank by BM25 score,
+    computed once on the first lookup."""
+
+    def __init__(
+        self,
+        question_list: list[dict],
+        num_neighbors: int = DEFAULT_NUM_NEIGHBORS,
+        exclude_same_section: bool = False,
+    ):
+        self.question_list = question_list
+        self.num_neighbors = num_neighbors
+        self.exclude_same_section = exclude_same_section
+        self.question_indexes = {}
+        for question_index, question in enumerate(question_list):
+            question_id = get_question_id(question)
+            if question_id in self.question_indexes:
+                raise ValueError(f"Question {question_id} appears more than once in the bank")
+            self.question_indexes[question_id] = question_index
+        self.lock = threading.Lock()
+        self.neighbor_table = None
+
+    def get_neighbor_table(self) -> numpy.ndarray:
+        """Return the neighbor table, computing it on the first call."""
+        with self.lock:
+            if self.neighbor_table is None:
+                self.neighbor_table = self.compute_neighbor_table()
+            return self.neighbor_table
+
+    def get_postings(self) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Return the question, word, and BM25 weight of each posting, sorted by word and then
+        question, and the start offset of each word's postings with a final end offset."""
+        question_words = [
+            normalize_question_text(question).split() for question in self.question_list
+        ]
+        all_words = list(itertools.chain.from_iterable(question_words))
+        word_ids = dict.fromkeys(all_words)
+        for word_id, word in enumerate(word_ids):
+            word_ids[word] = word_id
+        num_questions, num_words = len(self.question_list), len(word_ids)
+
+        # count each word in each question; the keys sort by word and then question
+        question_lengths = numpy.fromiter(map(len, question_words), dtype=numpy.int64)
+        word_question_ids = numpy.repeat(numpy.arange(num_questions), question_lengths)
+        all_word_ids = numpy.fromiter(
+            map(word_ids.__getitem__, all_words), dtype=numpy.int64, count=len(all_words)
+        )
+        posting_keys, term_counts = numpy.unique(
+            all_word_ids * num_questions + word_question_ids, return_counts=True
+        )
+        posting_words = posting_keys // num_questions
+        posting_questions = posting_keys % num_questions
+
+        # BM25 weights, with the non-negative inverse document frequency
+        document_frequencies = numpy.bincount(posting_words, minlength=num_words)
+        inverse_frequencies = numpy.log(
+            1.0 + (num_questions - document_frequencies + 0.5) / (document_frequencies + 0.5)
+        )
+        length_norms = BM25_K1 * (
+            1.0 - BM25_B + BM25_B * question_lengths / max(question_lengths.mean(), 1.0)
+        )
+        posting_weights = (
+            inverse_frequencies[posting_words]
+            * term_counts
+            * (BM25_K1 + 1.0)
+            / (term_counts + length_norms[posting_questions])
+        )
+        word_offsets = numpy.concatenate([[0], numpy.cumsum(document_frequencies)])
+        return posting_questions, posting_words, posting_weights, word_offsets
+
+    def compute_neighbor_table(self) -> numpy.ndarray:
+        """Return a questions x num_neighbors table of the most similar questions in order,
+        padded with -1 when fewer questions are eligible."""
+        num_questions = len(self.question_list)
+        neighbor_table = numpy.full((num_questions, self.num_neighbors), -1, dtype=numpy.int64)
+        num_neighbors = min(self.num_neighbors, num_questions - 1)
+        if num_neighbors <= 0:
+            return neighbor_table
+
+        posting_questions, posting_words, posting_weights, word_offsets = self.get_postings()
+        document_frequencies = numpy.diff(word_offsets)
+
+        # the words of each question, and the postings scored for each question
+        by_question = numpy.argsort(posting_questions, kind="stable")
+        query_words = posting_words[by_question]
+        query_offsets = numpy.searchsorted(
+            posting_questions[by_question], numpy.arange(num_questions + 1)
+        )
+        query_costs = numpy.concatenate(
+            [[0], numpy.cumsum(document_frequencies[query_words])]
+        )[query_offsets]
+
+        section_ids = numpy.unique(
+            [str(question.get("question_section")) for question in self.question_list],
+            return_inverse=True,
+        )[1].ravel()
+        type_ids = numpy.unique(
+            [str(question.get("question_type")) for question in self.question_list],
+            return_inverse=True,
+        )[1].ravel()
+
+        max_block_questions = max(MAX_BLOCK_SCORES // num_questions, 1)
+        block_start = 0
+        while block_start < num_questions:
+            block_end = int(
+                numpy.searchsorted(
+                    query_costs, query_costs[block_start] + MAX_BLOCK_POSTINGS, "right"
+                )
+            ) - 1
+            block_end = min(
+                max(block_end, block_start + 1), block_start + max_block_questions, num_questions
+            )
+            block_size = block_end - block_start
+
+            # expand the postings of every word of every question in the block
+            block_words = query_words[query_offsets[block_start] : query_offsets[block_end]]
+            block_queries = numpy.repeat(
+                numpy.arange(block_size), numpy.diff(query_offsets[block_start : block_end + 1])
+            )
+            expanded_lengths = document_frequencies[block_words]
+            expanded_starts = numpy.repeat(word_offsets[block_words], expanded_lengths)
+            expanded_positions = numpy.arange(expanded_lengths.sum()) - numpy.repeat(
+                numpy.cumsum(expanded_lengths) - expanded_lengths, expanded_lengths
+            )
+            expanded_postings = expanded_starts + expanded_positions
+            scores = numpy.bincount(
+                numpy.repeat(block_queries, expanded_lengths) * num_questions
+                + posting_questions[expanded_postings],
+                weights=posting_weights[expanded_postings],
+                minlength=block_size * num_questions,
+            ).reshape(block_size, num_questions)
+
+            # exclude the question itself, other question types, and optionally its section
+            block_indexes = numpy.arange(block_start, block_end)
+            excluded = type_ids[None, :] != type_ids[block_indexes, None]
+            if self.exclude_same_section:
+                excluded |= section_ids[None, :] == section_ids[block_indexes, None]
+            excluded[numpy.arange(block_size), block_indexes] = True
+            scores[excluded] = -numpy.inf
+
+            # keep the top scores in order, breaking ties by question order
+            top_indexes = numpy.argpartition(-scores, num_neighbors - 1, axis=1)[:, :num_neighbors]
+            top_scores = numpy.take_along_axis(scores, top_indexes, axis=1)
+            order = numpy.lexsort((top_indexes, -top_scores), axis=1)
+            top_indexes = numpy.take_along_axis(top_indexes, order, axis=1)
+            top_scores = numpy.take_along_axis(top_scores, order, axis=1)
+            neighbor_table[block_start:block_end, :num_neighbors] = numpy.where(
+                numpy.isfinite(top_scores), top_indexes, -1
+            )
+            block_start = block_end
+
+        return neighbor_table
+
+    def get_exemplars(self, question_data: dict) -> list[dict]:
+        """Return the most similar questions to a question of the bank, most similar first."""
+        question_id = get_question_id(question_data)
+        if question_id not in self.question_indexes:
+            raise ValueError(f"Question {question_id} is not in the few-shot index")
+        return [
+            self.question_list[neighbor_index]
+            for neighbor_index in self.get_neighbor_table()[
+                self.question_indexes[question_id]
+            ].tolist()
+            if neighbor_index >= 0
+        ]
+
+
+def get_few_shot_prompt_method(
+    few_shot_index: FewShotIndex,
+    prompt_method: Callable[[dict, list[dict]], str] = generate_prompt_022,
+) -> Callable[[dict], str]:
+    """Return a prompt method with the exemplars of the index filled in, named after the few-shot
+    prompt style so that sessions record it like any other prompt method."""
+
+    def generate_few_shot_prompt(question_data: dict) -> str:
+        return prompt_method(question_data, few_shot_index.get_exemplars(question_data))
+
+    generate_few_shot_prompt.__name__ = prompt_method.__name__
+    generate_few_shot_prompt.__doc__ = prompt_method.__doc__
+    return generate_few_shot_prompt
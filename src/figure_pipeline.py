@@ -0,0 +1,186 @@
+"""
+Render analysis figures in parallel worker processes and skip figures whose inputs have not changed.
+
+Each figure is described by a spec dictionary:
+    {
+        "name": "model_progression",
+        "function": "results_assessment_2.plot_accuracy_bar_chart_progression",
+        "data": <aggregate dataframe passed to the function>,
+    }
+
+Every (figure, format) pair is keyed on a hash of the input aggregate, the source of the plot
+function's module and of every project module it uses directly or indirectly (e.g.,
+results_cube or bootstrap), FIGURE_KEY_VERSION, the style parameters, and the output format.
+The keys of the last render are kept in a manifest file in the output directory, and pairs
+whose key and output file are unchanged are skipped.  The remaining pairs are rendered in a
+process pool using the non-interactive Agg backend, one output file per task, so PDF and PNG
+for the same figure render concurrently.
+"""
+
+# imports
+import concurrent.futures
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+from pathlib import Path
+
+# packages
+import pandas
+
+# default style parameters applied when saving every figure
+DEFAULT_FIGURE_STYLE = {
+    "dpi": 300,
+}
+
+# default output formats for every figure
+DEFAULT_FIGURE_FORMATS = ("pdf", "png")
+
+# manifest file name with the keys of the last render
+FIGURE_MANIFEST_NAME = ".figure_manifest.json"
+
+# bump to re-render every figure, e.g., after a change outside the project modules
+FIGURE_KEY_VERSION = 1
+
+
+def load_plot_function(function_path: str):
+    """Return the plot function for a "module.function" path."""
+    module_name, function_name = function_path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_dependency_source_hash(function_path: str) -> str:
+    """Return a hash of the source files of the plot function's module and of the project
+    modules, i.e., those in the same directory, that it references directly or indirectly."""
+    plot_module = inspect.getmodule(load_plot_function(function_path))
+    project_path = Path(plot_module.__file__).resolve().parent
+
+    source_paths = set()
+    pending_modules = [plot_module]
+    while len(pending_modules) > 0:
+        module = pending_modules.pop()
+        module_file = getattr(module, "__file__", None)
+        if module_file is None or Path(module_file).resolve().parent != project_path:
+            continue
+        module_path = Path(module_file).resolve()
+        if module_path in source_paths:
+            continue
+        source_paths.add(module_path)
+        for value in list(vars(module).values()):
+            referenced_module = (
+                value if inspect.ismodule(value) else inspect.getmodule(value)
+            )
+            if referenced_module is not None:
+                pending_modules.append(referenced_module)
+
+    source_hash = hashlib.sha256()
+    for source_path in sorted(source_paths):
+        source_hash.update(source_path.name.encode("utf-8"))
+        source_hash.update(source_path.read_bytes())
+    return source_hash.hexdigest()
+
+
+def get_figure_key(
+    function_path: str, data: pandas.DataFrame, style: dict, file_format: str
+) -> str:
+    """Return a hash key for a figure from its input aggregate, the source of the plot
+    function and the project modules it depends on, the key version, the style parameters,
+    and the output format."""
+    key_hash = hashlib.sha256()
+    key_hash.update(f"{function_path}:{FIGURE_KEY_VERSION}".encode("utf-8"))
+    key_hash.update(get_dependency_source_hash(function_path).encode("utf-8"))
+    key_hash.update(
+        pandas.util.hash_pandas_object(data, index=True).to_numpy().tobytes()
+    )
+    key_hash.update(",".join(map(str, data.columns)).encode("utf-8"))
+    key_hash.update(json.dumps(style, sort_keys=True).encode("utf-8"))
+    key_hash.update(file_format.encode("utf-8"))
+    return key_hash.hexdigest()
+
+
+def initialize_worker() -> None:
+    """Select the Agg backend before any worker imports pyplot."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def render_figure(
+    function_path: str, data: pandas.DataFrame, style: dict, output_file: Path
+) -> Path:
+    """Render one figure to one output file in a worker process."""
+    import matplotlib.pyplot
+
+    figure = load_plot_function(function_path)(data)
+    figure.savefig(output_file, **style)
+    matplotlib.pyplot.close(figure)
+
+    return output_file
+
+
+def render_figures(
+    figure_specs: list[dict],
+    output_path: Path,
+    formats: tuple[str, ...] = DEFAULT_FIGURE_FORMATS,
+    style: dict | None = None,
+    max_workers: int | None = None,
+) -> list[Path]:
+    """Render all figures in all formats to the output path, skipping unchanged outputs,
+    and return the list of files that were rendered.
+    """
+    style = {**DEFAULT_FIGURE_STYLE, **(style or {})}
+
+    # load the keys from the last render
+    manifest_path = output_path / FIGURE_MANIFEST_NAME
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+    else:
+        manifest = {}
+
+    # determine which outputs need to be rendered
+    pending_tasks = []
+    for figure_spec in figure_specs:
+        for file_format in formats:
+            output_file = output_path / f"{figure_spec['name']}.{file_format}"
+            figure_key = get_figure_key(
+                figure_spec["function"], figure_spec["data"], style, file_format
+            )
+            if output_file.exists() and manifest.get(output_file.name) == figure_key:
+                continue
+            pending_tasks.append((figure_spec, output_file, figure_key))
+
+    if len(pending_tasks) == 0:
+        return []
+
+    # render the outputs in parallel
+    rendered_files = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, initializer=initialize_worker
+    ) as executor:
+        future_map = {
+            executor.submit(
+                render_figure,
+                figure_spec["function"],
+                figure_spec["data"],
+                style,
+                output_file,
+            ): (output_file, figure_key)
+            for figure_spec, output_file, figure_key in pending_tasks
+        }
+        for future in concurrent.futures.as_completed(future_map):
+            output_file, figure_key = future_map[future]
+            try:
+                future.result()
+            except Exception as error:
+                print(f"Error rendering {output_file}: {error}")
+                manifest.pop(output_file.name, None)
+                continue
+            manifest[output_file.name] = figure_key
+            rendered_files.append(output_file)
+
+    # save the keys for the next render
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    return rendered_files
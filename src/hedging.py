@@ -0,0 +1,172 @@
+"""
+Hedged completion requests to cut the tail latency of sessions.
+
+With several requests in flight, the slowest few percent of requests still decide when a
+session ends.  A HedgePolicy tracks the latency of recent requests, and once a request has been
+outstanding for longer than a percentile of those latencies, create_hedged_completion sends a
+duplicate of it.  The first successful response wins and the other request is cancelled
+through its RequestHandle, which closes its connection.
+
+Duplicates are only safe when both requests would return the same completion, so hedging only
+applies to parameter sets with temperature 0 (the API default is 1); with sampling, keeping
+whichever response came back first would favor shorter completions.  Each hedge costs the
+other request's prompt tokens, plus its completion tokens if it finished before being
+cancelled.  The API reports no usage for a cancelled request, so its prompt tokens are
+estimated from the winner's, which had the same prompt, and hedge_tokens_estimated is set; the
+completion tokens it generated before the cancellation are not counted.
+
+The latency recorded for the policy is always measured from the first request's launch, since
+that is how long the caller waited, even when the hedge wins.
+"""
+
+# imports
+import collections
+import queue
+import threading
+import time
+
+# project imports
+from completion_client import RequestHandle
+from request_metrics import get_percentile, get_usage_tokens
+
+# default latency percentile after which a request is hedged
+DEFAULT_HEDGE_PERCENTILE = 95
+
+# default number of recent latencies the percentile is taken over
+DEFAULT_LATENCY_WINDOW = 200
+
+# default number of latencies needed before requests are hedged
+DEFAULT_MIN_SAMPLES = 20
+
+# default minimum seconds to wait before hedging, so that fast requests are never duplicated
+DEFAULT_MIN_HEDGE_DELAY = 0.5
+
+
+class HedgePolicy:
+    """Decide when to hedge a request from a percentile of recent request latencies.  One
+    policy should be shared by the requests to a single model, since models differ in speed."""
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        latency_window: int = DEFAULT_LATENCY_WINDOW,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        min_hedge_delay: float = DEFAULT_MIN_HEDGE_DELAY,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_hedge_delay = min_hedge_delay
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    def get_settings(self) -> dict:
+        """Return the policy settings for storing with a session."""
+        return {
+            "percentile": self.percentile,
+            "latency_window": self.latencies.maxlen,
+            "min_samples": self.min_samples,
+            "min_hedge_delay": self.min_hedge_delay,
+        }
+
+    def record_latency(self, latency: float) -> None:
+        """Record the latency of a successful request."""
+        with self.lock:
+            self.latencies.append(latency)
+
+    def get_hedge_delay(self) -> float | None:
+        """Return the seconds to wait before hedging a request, or None until enough
+        latencies have been recorded."""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            sorted_latencies = sorted(self.latencies)
+        return max(get_percentile(sorted_latencies, self.percentile), self.min_hedge_delay)
+
+
+def is_hedging_safe(parameter_kwargs: dict) -> bool:
+    """Return whether duplicate requests with these parameters return the same completion,
+    i.e., whether sampling is greedy."""
+    return parameter_kwargs.get("temperature", 1.0) == 0
+
+
+def create_hedged_completion(
+    client, hedge_policy: HedgePolicy, model_name: str, prompt: str, parameter_kwargs: dict
+) -> tuple[dict, dict]:
+    """Create a completion, sending a duplicate request if the first one is still outstanding
+    after the policy's hedge delay, and return the first successful response with the hedge
+    metrics.  If every request fails, the first error is raised."""
+    results = queue.Queue()
+
+    def send_request(request_index: int, handle: RequestHandle) -> None:
+        try:
+            response = client.create(
+                model=model_name, prompt=prompt, handle=handle, **parameter_kwargs
+            )
+            results.put((request_index, response, time.perf_counter() - start_time, None))
+        except Exception as error:
+            results.put((request_index, None, None, error))
+
+    def start_request() -> RequestHandle:
+        handle = RequestHandle()
+        threading.Thread(
+            target=send_request, args=(len(handles), handle), daemon=True
+        ).start()
+        return handle
+
+    # latencies are measured from the first launch, whichever request wins
+    start_time = time.perf_counter()
+    handles = []
+    handles.append(start_request())
+    hedge_delay = hedge_policy.get_hedge_delay()
+    try:
+        first_result = results.get(timeout=hedge_delay)
+    except queue.Empty:
+        first_result = None
+
+    hedge_metrics = {
+        "hedged": False,
+        "hedge_won": False,
+        "hedge_prompt_tokens": 0,
+        "hedge_completion_tokens": 0,
+        "hedge_tokens_estimated": False,
+    }
+
+    # the first request finished, or failed, before the hedge delay
+    if first_result is not None:
+        _, response, latency, error = first_result
+        if error is not None:
+            raise error
+        hedge_policy.record_latency(latency)
+        return response, hedge_metrics
+
+    # send the duplicate and take the first success
+    hedge_metrics["hedged"] = True
+    handles.append(start_request())
+    first_error = None
+    for _ in range(len(handles)):
+        request_index, response, latency, error = results.get()
+        if error is None:
+            break
+        first_error = first_error or error
+    else:
+        raise first_error
+
+    # cancel the other request, counting its tokens if it already finished and estimating its
+    # prompt tokens from the winner's otherwise
+    for handle in handles:
+        handle.cancel()
+    hedge_policy.record_latency(latency)
+    hedge_metrics["hedge_won"] = request_index > 0
+    try:
+        _, other_response, _, _ = results.get_nowait()
+    except queue.Empty:
+        other_response = None
+    if other_response is not None:
+        other_usage = get_usage_tokens(other_response)
+        hedge_metrics["hedge_prompt_tokens"] = other_usage["prompt_tokens"] or 0
+        hedge_metrics["hedge_completion_tokens"] = other_usage["completion_tokens"] or 0
+    else:
+        hedge_metrics["hedge_prompt_tokens"] = get_usage_tokens(response)["prompt_tokens"] or 0
+        hedge_metrics["hedge_tokens_estimated"] = True
+
+    return response, hedge_metrics
@@ -0,0 +1,264 @@
+"""
+Live metrics for watching a sweep while it runs, in the Prometheus text exposition format.
+
+Exam sessions given a SweepMetrics report each request as it starts and finishes, and score each
+response as soon as it is parsed with the same logic as score_exam (score_exam_records, which
+parses completions with parse_gpt_response).  Every metric is labeled with the session's model,
+prompt method, and parameters, e.g.:
+    exam_requests_in_flight{model="text-davinci-003",prompt_method="generate_prompt_020",...} 2
+    exam_accuracy{model="text-davinci-003",prompt_method="generate_prompt_020",...} 0.61
+
+The metrics are served at http://<host>:<port>/metrics by start_metrics_server, for a Prometheus
+scrape or a browser, or rewritten to a file every few seconds by start_metrics_file_writer, e.g.,
+for the node exporter's textfile collector.  The runners only serve them when the
+CPA_EXAM_METRICS_PORT environment variable is set to a port, e.g.,
+CPA_EXAM_METRICS_PORT=8001 python run_exam.py.  Counters are cumulative over the sweep, while the
+completion and token rates are taken over the last RATE_WINDOW_SECONDS.
+"""
+
+# imports
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# project imports
+from request_metrics import LATENCY_BUCKETS
+from score_exam import score_exam_records
+
+# default address to serve metrics on
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 8001
+
+# environment variable with the port the runners serve metrics on
+METRICS_PORT_ENV_VAR = "CPA_EXAM_METRICS_PORT"
+
+# default seconds between rewrites of the metrics file
+DEFAULT_WRITE_INTERVAL = 15.0
+
+# seconds of recent completions the rates are taken over
+RATE_WINDOW_SECONDS = 60.0
+
+# counter names, types, and help text, in output order
+METRIC_DEFINITIONS = [
+    ("exam_requests_in_flight", "gauge", "Questions with a request in flight."),
+    ("exam_requests_total", "counter", "Questions whose request finished."),
+    ("exam_request_errors_total", "counter", "Questions without a response after retries."),
+    ("exam_request_retries_total", "counter", "Failed attempts that were retried."),
+    ("exam_hedged_requests_total", "counter", "Questions whose request was hedged."),
+    ("exam_prompt_tokens_total", "counter", "Prompt tokens of the responses."),
+    ("exam_completion_tokens_total", "counter", "Completion tokens of the responses."),
+    ("exam_completions_per_second", "gauge", "Responses per second over the rate window."),
+    (
+        "exam_completion_tokens_per_second",
+        "gauge",
+        "Completion tokens per second over the rate window.",
+    ),
+    ("exam_questions_scored_total", "counter", "Questions scored."),
+    ("exam_questions_correct_total", "counter", "Questions answered correctly."),
+    ("exam_questions_unparsed_total", "counter", "Questions without a parsed answer."),
+    ("exam_accuracy", "gauge", "Share of scored questions answered correctly."),
+]
+
+
+def get_label_text(labels: tuple[tuple[str, str], ...], **extra_labels: str) -> str:
+    """Return the label set of a sample, escaping backslashes, quotes, and newlines."""
+    label_items = list(labels) + list(extra_labels.items())
+    escaped_items = [
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in label_items
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped_items) + "}"
+
+
+class SweepMetrics:
+    """Thread-safe counters for the sessions of a sweep, keyed by their labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(lambda: collections.Counter())
+        self.latency_buckets = collections.defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.latency_sums = collections.Counter()
+        self.recent_completions = collections.defaultdict(collections.deque)
+
+    @staticmethod
+    def get_labels(exam_data: dict) -> tuple[tuple[str, str], ...]:
+        """Return the labels of a session: its model, prompt method, and parameters."""
+        return (
+            ("model", exam_data["model_name"]),
+            ("prompt_method", exam_data["prompt_method"]),
+            ("parameters", json.dumps(exam_data["parameters"], sort_keys=True)),
+        )
+
+    def start_request(self, labels: tuple) -> None:
+        """Count a request in flight."""
+        with self.lock:
+            self.values[labels]["exam_requests_in_flight"] += 1
+
+    def finish_request(self, labels: tuple, request_metrics: dict) -> None:
+        """Count a finished request from its request metrics (see request_metrics.py)."""
+        now = time.monotonic()
+        with self.lock:
+            values = self.values[labels]
+            values["exam_requests_in_flight"] -= 1
+            values["exam_requests_total"] += 1
+            values["exam_request_retries_total"] += request_metrics["retries"]
+            values["exam_hedged_requests_total"] += int(request_metrics.get("hedged", False))
+            if request_metrics["http_latency"] is None:
+                values["exam_request_errors_total"] += 1
+                return
+
+            values["exam_prompt_tokens_total"] += request_metrics["prompt_tokens"] or 0
+            values["exam_completion_tokens_total"] += request_metrics["completion_tokens"] or 0
+            self.recent_completions[labels].append(
+                (now, request_metrics["completion_tokens"] or 0)
+            )
+
+            # cumulative latency histogram
+            self.latency_sums[labels] += request_metrics["http_latency"]
+            for bucket_index, bound in enumerate(LATENCY_BUCKETS):
+                if request_metrics["http_latency"] <= bound:
+                    self.latency_buckets[labels][bucket_index] += 1
+
+    def score_question(self, labels: tuple, exam_data: dict, question_data: dict) -> None:
+        """Score a question's response as score_exam would and count the result, using the
+        majority vote for sessions with several samples."""
+        score_record = score_exam_records({**exam_data, "questions": [question_data]})[0]
+        with self.lock:
+            values = self.values[labels]
+            values["exam_questions_scored_total"] += 1
+            values["exam_questions_correct_total"] += int(score_record["is_majority_correct"])
+            values["exam_questions_unparsed_total"] += int(
+                score_record["model_answer"] is None
+            )
+
+    def get_rates(self, labels: tuple, now: float) -> tuple[float, float]:
+        """Return the completions and completion tokens per second over the rate window;
+        called with the lock held."""
+        recent_completions = self.recent_completions[labels]
+        window_start = now - RATE_WINDOW_SECONDS
+        while len(recent_completions) > 0 and recent_completions[0][0] < window_start:
+            recent_completions.popleft()
+        return (
+            len(recent_completions) / RATE_WINDOW_SECONDS,
+            sum(tokens for _, tokens in recent_completions) / RATE_WINDOW_SECONDS,
+        )
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        now = time.monotonic()
+        with self.lock:
+            samples = {name: [] for name, _, _ in METRIC_DEFINITIONS}
+            for labels, values in self.values.items():
+                completions_per_second, tokens_per_second = self.get_rates(labels, now)
+                derived_values = {
+                    **values,
+                    "exam_completions_per_second": completions_per_second,
+                    "exam_completion_tokens_per_second": tokens_per_second,
+                }
+                if values["exam_questions_scored_total"] > 0:
+                    derived_values["exam_accuracy"] = (
+                        values["exam_questions_correct_total"]
+                        / values["exam_questions_scored_total"]
+                    )
+                for name in samples:
+                    if name != "exam_accuracy" or name in derived_values:
+                        samples[name].append(
+                            (get_label_text(labels), derived_values.get(name, 0))
+                        )
+
+            lines = []
+            for name, metric_type, help_text in METRIC_DEFINITIONS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for label_text, value in samples[name]:
+                    lines.append(f"{name}{label_text} {value}")
+
+            lines.append("# HELP exam_http_latency_seconds HTTP latency of successful requests.")
+            lines.append("# TYPE exam_http_latency_seconds histogram")
+            for labels, bucket_counts in self.latency_buckets.items():
+                for bound, count in zip(LATENCY_BUCKETS, bucket_counts):
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(
+                        f"exam_http_latency_seconds_bucket{get_label_text(labels, le=le)} {count}"
+                    )
+                lines.append(
+                    f"exam_http_latency_seconds_sum{get_label_text(labels)} "
+                    f"{self.latency_sums[labels]}"
+                )
+                lines.append(
+                    f"exam_http_latency_seconds_count{get_label_text(labels)} {bucket_counts[-1]}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the sweep metrics at /metrics."""
+
+    def log_message(self, format: str, *args) -> None:
+        """Do not log every scrape."""
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.sweep_metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def get_metrics_port() -> int | None:
+    """Return the port set in the metrics port environment variable, or None if it is unset
+    or empty, in which case metrics are not served."""
+    port = os.environ.get(METRICS_PORT_ENV_VAR, "").strip()
+    if port == "":
+        return None
+    if not port.isdigit():
+        raise ValueError(f"{METRICS_PORT_ENV_VAR} must be a port number, not {port!r}")
+    return int(port)
+
+
+def start_metrics_server(
+    sweep_metrics: SweepMetrics,
+    host: str = DEFAULT_METRICS_HOST,
+    port: int = DEFAULT_METRICS_PORT,
+) -> http.server.ThreadingHTTPServer:
+    """Serve the metrics in a background thread and return the server; port 0 picks a free
+    port."""
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.sweep_metrics = sweep_metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_metrics_file(sweep_metrics: SweepMetrics, metrics_path: Path) -> None:
+    """Write the metrics to a file, replacing it atomically so readers never see a partial
+    file."""
+    temporary_path = metrics_path.with_name(metrics_path.name + ".tmp")
+    temporary_path.write_text(sweep_metrics.render(), encoding="utf-8")
+    temporary_path.replace(metrics_path)
+
+
+def start_metrics_file_writer(
+    sweep_metrics: SweepMetrics,
+    metrics_path: Path,
+    interval: float = DEFAULT_WRITE_INTERVAL,
+) -> threading.Event:
+    """Rewrite the metrics file every interval seconds in a background thread until the
+    returned event is set."""
+    stop_event = threading.Event()
+
+    def write_periodically() -> None:
+        while not stop_event.wait(interval):
+            write_metrics_file(sweep_metrics, metrics_path)
+
+    threading.Thread(target=write_periodically, daemon=True).start()
+    return stop_event
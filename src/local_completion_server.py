@@ -0,0 +1,235 @@
+"""
+A local stand-in for the completions endpoint, for exercising the runners and the completion
+client without calling the API.
+
+The server answers POST /v1/completions over keep-alive HTTP/1.1 with synthetic responses in the
+answer format requested by each prompt (see synthetic_data.fill_answer_format), including n
+samples, single-token logprobs, stop sequences, and server-sent event streams.  Latency, the
+share of slow requests that take tail_latency_seconds instead, the share of requests that fail
+with a rate limit error, and the seconds an idle keep-alive connection is kept open are
+configurable, and the server counts the connections it accepts and the requests it answers so
+that connection reuse and duplicate requests can be checked from both ends.
+
+For example, to run a session against it:
+    server = start_local_server(latency_seconds=0.05)
+    client = CompletionClient("test", api_base=get_local_api_base(server))
+"""
+
+# imports
+import http.server
+import json
+import random
+import threading
+import time
+
+# project imports
+from synthetic_data import CHOICE_LETTERS, fill_answer_format, load_vocabulary
+
+# default address to serve on
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+# characters per streamed chunk
+STREAM_CHUNK_SIZE = 4
+
+
+class LocalCompletionServer(http.server.ThreadingHTTPServer):
+    """A threaded HTTP server with the response settings and counters shared by handlers."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        latency_seconds: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+        tail_rate: float = 0.0,
+        tail_latency_seconds: float = 0.0,
+        idle_timeout_seconds: float | None = None,
+    ):
+        super().__init__(address, LocalCompletionHandler)
+        self.latency_seconds = latency_seconds
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.tail_rate = tail_rate
+        self.tail_latency_seconds = tail_latency_seconds
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.vocabulary = load_vocabulary()
+        self.lock = threading.Lock()
+        self.num_connections = 0
+        self.num_requests = 0
+
+    def handle_error(self, request, client_address) -> None:
+        """Ignore clients that close their connection, e.g., by cancelling a stream."""
+
+
+class LocalCompletionHandler(http.server.BaseHTTPRequestHandler):
+    """Answer completion requests with synthetic responses."""
+
+    protocol_version = "HTTP/1.1"
+
+    # headers and body are written separately, so do not let them wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        # close connections that stay idle for longer than the idle timeout, if any
+        self.timeout = self.server.idle_timeout_seconds
+        super().setup()
+        with self.server.lock:
+            self.server.num_connections += 1
+
+    def log_message(self, format: str, *args) -> None:
+        """Do not log every request."""
+
+    def send_json(self, status: int, data: dict) -> None:
+        """Send a JSON response with a content length so the connection can be kept alive."""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data: bytes) -> None:
+        """Send one chunk of a chunked transfer-encoded response."""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self.path.endswith("/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        with self.server.lock:
+            self.server.num_requests += 1
+            failed = self.server.rng.random() < self.server.failure_rate
+            slow = self.server.rng.random() < self.server.tail_rate
+            rng = random.Random(self.server.rng.random())
+        time.sleep(
+            self.server.tail_latency_seconds if slow else self.server.latency_seconds
+        )
+        if failed:
+            self.send_json(429, {"error": {"message": "Rate limit reached"}})
+            return
+
+        # rank the letters at random and answer in the prompt's format, up to any stop sequence
+        stop_sequences = body.get("stop") or []
+        if isinstance(stop_sequences, str):
+            stop_sequences = [stop_sequences]
+        choices = []
+        for index in range(body.get("n", 1)):
+            ranking = rng.sample(CHOICE_LETTERS, k=len(CHOICE_LETTERS))
+            text = fill_answer_format(rng, self.server.vocabulary, body["prompt"], ranking)
+            logprobs = None
+            if text is None or body.get("logprobs") is not None:
+                text = f" {ranking[0]}"
+                logprobs = {
+                    "tokens": [text],
+                    "top_logprobs": [
+                        {
+                            f" {letter}": -float(rank) - rng.random()
+                            for rank, letter in enumerate(ranking)
+                        }
+                    ],
+                }
+            stop_indexes = [text.find(stop) for stop in stop_sequences if stop in text]
+            if len(stop_indexes) > 0:
+                text = text[: min(stop_indexes)]
+            choices.append(
+                {
+                    "text": text,
+                    "index": index,
+                    "logprobs": logprobs,
+                    "finish_reason": "stop",
+                }
+            )
+
+        response = {
+            "id": f"cmpl-local-{rng.getrandbits(64):016x}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": len(body["prompt"].split()),
+                "completion_tokens": sum(len(c["text"].split()) for c in choices),
+                "total_tokens": len(body["prompt"].split())
+                + sum(len(c["text"].split()) for c in choices),
+            },
+        }
+
+        if not body.get("stream"):
+            self.send_json(200, response)
+            return
+
+        # stream the first choice as server-sent events
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        text = choices[0]["text"]
+        for start in range(0, len(text), STREAM_CHUNK_SIZE):
+            is_last = start + STREAM_CHUNK_SIZE >= len(text)
+            chunk = {
+                "id": response["id"],
+                "object": "text_completion",
+                "created": response["created"],
+                "model": response["model"],
+                "choices": [
+                    {
+                        "text": text[start : start + STREAM_CHUNK_SIZE],
+                        "index": 0,
+                        "logprobs": None,
+                        "finish_reason": "stop" if is_last else None,
+                    }
+                ],
+            }
+            # like servers that report streaming usage, send it with the final chunk
+            if is_last:
+                chunk["usage"] = response["usage"]
+            try:
+                self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            except (BrokenPipeError, ConnectionResetError):
+                # the client cancelled the stream
+                self.close_connection = True
+                return
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+
+def start_local_server(
+    host: str = DEFAULT_HOST,
+    port: int = 0,
+    latency_seconds: float = 0.0,
+    failure_rate: float = 0.0,
+    seed: int = 0,
+    tail_rate: float = 0.0,
+    tail_latency_seconds: float = 0.0,
+    idle_timeout_seconds: float | None = None,
+) -> LocalCompletionServer:
+    """Start a local server in a background thread and return it; port 0 picks a free port."""
+    server = LocalCompletionServer(
+        (host, port),
+        latency_seconds,
+        failure_rate,
+        seed,
+        tail_rate,
+        tail_latency_seconds,
+        idle_timeout_seconds,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_local_api_base(server: LocalCompletionServer) -> str:
+    """Return the API base URL for a local server."""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    local_server = LocalCompletionServer((DEFAULT_HOST, DEFAULT_PORT), latency_seconds=0.5)
+    print(f"Serving completions at {get_local_api_base(local_server)}")
+    local_server.serve_forever()
@@ -0,0 +1,192 @@
+"""
+Run exam sessions for several models concurrently, with an independent rate limiter for each
+model and fair queuing of sessions across models.
+
+Each model has its own rate limit budget, so running models one after another leaves most of
+the available quota idle.  Sessions are submitted per model, and a fixed number of worker threads
+take the next session from the models in round-robin order, skipping models that already have
+their maximum number of sessions running.  Every model's requests go through a RateLimitedClient
+that shares the connection pool but waits on that model's own token bucket, so a model at its
+limit only slows down its own sessions.
+
+With a token budget, or circuit breakers for each model (see request_guards.py), the requests
+go through a GuardedClient first.  A model whose breaker gives up has its remaining sessions
+dropped, and once the budget is used up no further sessions are started.
+"""
+
+# imports
+import threading
+import time
+from typing import Callable
+
+# project imports
+from completion_client import CompletionClient
+from request_guards import (
+    BudgetExceededError,
+    CircuitBreaker,
+    CircuitOpenError,
+    GuardedClient,
+    TokenBudget,
+)
+
+
+class RateLimiter:
+    """A token bucket allowing requests_per_minute on average with bursts of up to burst."""
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.wait_seconds = 0.0
+
+    def acquire(self) -> None:
+        """Wait until a request is allowed and take its token."""
+        start_time = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.last_time) * self.rate
+                )
+                self.last_time = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.wait_seconds += now - start_time
+                    return
+                wait_time = (1.0 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class RateLimitedClient:
+    """A completion client that waits on a rate limiter before every request."""
+
+    def __init__(self, client: CompletionClient, rate_limiter: RateLimiter):
+        self.client = client
+        self.rate_limiter = rate_limiter
+
+    def create(self, *args, **kwargs):
+        """Wait for the rate limiter, then create the completion with the shared client."""
+        self.rate_limiter.acquire()
+        return self.client.create(*args, **kwargs)
+
+    def get_pool_stats(self) -> dict:
+        """Return the shared connection pool statistics with this model's rate limit wait."""
+        return {
+            **self.client.get_pool_stats(),
+            "rate_limit_wait_seconds": self.rate_limiter.wait_seconds,
+        }
+
+
+class ModelScheduler:
+    """Run submitted sessions for several models on a fixed number of worker threads, taking
+    sessions from the models in round-robin order with at most max_sessions_per_model
+    running for any one model."""
+
+    def __init__(
+        self,
+        client: CompletionClient,
+        model_requests_per_minute: dict[str, float],
+        num_workers: int | None = None,
+        max_sessions_per_model: int = 1,
+        circuit_breakers: dict[str, CircuitBreaker] | None = None,
+        budget: TokenBudget | None = None,
+    ):
+        self.model_names = list(model_requests_per_minute)
+        self.model_clients = {}
+        for model_name, requests_per_minute in model_requests_per_minute.items():
+            model_client = RateLimitedClient(client, RateLimiter(requests_per_minute))
+            circuit_breaker = (circuit_breakers or {}).get(model_name)
+            if circuit_breaker is not None or budget is not None:
+                model_client = GuardedClient(model_client, circuit_breaker, budget)
+            self.model_clients[model_name] = model_client
+        self.num_workers = num_workers or len(self.model_names) * max_sessions_per_model
+        self.max_sessions_per_model = max_sessions_per_model
+
+        self.condition = threading.Condition()
+        self.pending_jobs = {model_name: [] for model_name in self.model_names}
+        self.running_counts = {model_name: 0 for model_name in self.model_names}
+        self.next_model_index = 0
+        self.errors = []
+        self.num_dropped_jobs = 0
+        self.model_seconds = {model_name: 0.0 for model_name in self.model_names}
+
+    def submit(self, model_name: str, job: Callable[..., object]) -> None:
+        """Queue a job for a model; the job is called with the model's rate-limited client as
+        the client keyword argument, e.g., a functools.partial of run_exam_session."""
+        with self.condition:
+            self.pending_jobs[model_name].append(job)
+
+    def take_next_job(self) -> tuple[str, Callable] | None:
+        """Return the next model and job in round-robin order, waiting while every model with
+        pending jobs is at its session limit, or None once there are no jobs left."""
+        with self.condition:
+            while True:
+                if all(len(jobs) == 0 for jobs in self.pending_jobs.values()):
+                    return None
+                for offset in range(len(self.model_names)):
+                    model_name = self.model_names[
+                        (self.next_model_index + offset) % len(self.model_names)
+                    ]
+                    if (
+                        len(self.pending_jobs[model_name]) > 0
+                        and self.running_counts[model_name] < self.max_sessions_per_model
+                    ):
+                        self.next_model_index = (
+                            self.next_model_index + offset + 1
+                        ) % len(self.model_names)
+                        self.running_counts[model_name] += 1
+                        return model_name, self.pending_jobs[model_name].pop(0)
+                self.condition.wait()
+
+    def drop_jobs(self, model_names: list[str]) -> None:
+        """Drop the pending jobs of the given models."""
+        with self.condition:
+            for model_name in model_names:
+                self.num_dropped_jobs += len(self.pending_jobs[model_name])
+                self.pending_jobs[model_name].clear()
+            self.condition.notify_all()
+
+    def run_worker(self) -> None:
+        """Run jobs until there are none left."""
+        while True:
+            next_job = self.take_next_job()
+            if next_job is None:
+                return
+            model_name, job = next_job
+            start_time = time.perf_counter()
+            try:
+                job(client=self.model_clients[model_name])
+            except Exception as error:
+                print(f"Error in {model_name} session: {error}")
+                self.errors.append((model_name, error))
+                if isinstance(error, CircuitOpenError):
+                    self.drop_jobs([model_name])
+                elif isinstance(error, BudgetExceededError):
+                    self.drop_jobs(self.model_names)
+            finally:
+                with self.condition:
+                    self.running_counts[model_name] -= 1
+                    self.model_seconds[model_name] += time.perf_counter() - start_time
+                    self.condition.notify_all()
+
+    def run(self) -> dict:
+        """Run all submitted jobs and return the wall time, the time spent in each model's
+        sessions, the errors raised by jobs, and the number of jobs dropped."""
+        start_time = time.perf_counter()
+        worker_threads = [
+            threading.Thread(target=self.run_worker, name=f"scheduler-{i}", daemon=True)
+            for i in range(self.num_workers)
+        ]
+        for thread in worker_threads:
+            thread.start()
+        for thread in worker_threads:
+            thread.join()
+
+        return {
+            "wall_seconds": time.perf_counter() - start_time,
+            "model_seconds": dict(self.model_seconds),
+            "errors": list(self.errors),
+            "num_dropped_jobs": self.num_dropped_jobs,
+        }
@@ -0,0 +1,158 @@
+"""
+A staged pipeline of worker threads connected by bounded queues.
+
+Each stage has a function applied to every item and a number of worker threads.  Items flow
+from one stage to the next through a queue of limited size, so a slow stage blocks the stages
+before it instead of letting items pile up in memory (backpressure), while the other stages keep
+working, e.g., prompts are rendered and responses parsed while requests are in flight, and a slow
+disk write does not delay the next request.
+
+Every stage records how many items it handled, how long its workers were busy, and the depth
+of its input queue, which get_stats() reports as utilization and queue depth per stage.
+"""
+
+# imports
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+# default size of the queue in front of each stage
+DEFAULT_QUEUE_SIZE = 16
+
+# marker passed down the queues after the last item
+END_OF_ITEMS = object()
+
+
+class PipelineStage:
+    """One stage of a pipeline: a function, its worker threads, and its input queue."""
+
+    def __init__(self, name: str, function: Callable, num_workers: int, queue_size: int):
+        self.name = name
+        self.function = function
+        self.num_workers = num_workers
+        self.input_queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.num_items = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.queue_depth_total = 0
+
+    def record_item(self, busy_seconds: float, queue_depth: int) -> None:
+        """Record one handled item with the time spent on it and the queue depth it saw."""
+        with self.lock:
+            self.num_items += 1
+            self.busy_seconds += busy_seconds
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            self.queue_depth_total += queue_depth
+
+
+class Pipeline:
+    """Run items through a sequence of stages, given as (name, function, num_workers) tuples.
+    The last stage's return values are collected in the order they finish."""
+
+    def __init__(
+        self,
+        stages: list[tuple[str, Callable, int]],
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self.stages = [
+            PipelineStage(name, function, num_workers, queue_size)
+            for name, function, num_workers in stages
+        ]
+        self.results = []
+        self.error = None
+        self.stop_event = threading.Event()
+        self.wall_seconds = 0.0
+
+    def run_worker(self, stage_index: int) -> None:
+        """Handle items from a stage's queue until the end marker, passing results on."""
+        stage = self.stages[stage_index]
+        next_stage = (
+            self.stages[stage_index + 1] if stage_index + 1 < len(self.stages) else None
+        )
+        while True:
+            queue_depth = stage.input_queue.qsize()
+            item = stage.input_queue.get()
+            if item is END_OF_ITEMS:
+                break
+            # after an error, drain the queues without doing any more work
+            if self.stop_event.is_set():
+                continue
+
+            start_time = time.perf_counter()
+            try:
+                result = stage.function(item)
+            except BaseException as error:
+                self.error = self.error or error
+                self.stop_event.set()
+                continue
+            stage.record_item(time.perf_counter() - start_time, queue_depth)
+
+            if next_stage is not None:
+                next_stage.input_queue.put(result)
+            else:
+                self.results.append(result)
+
+    def run(self, items: Iterable) -> list:
+        """Feed the items into the first stage, wait for every stage to finish, and return
+        the results of the last stage.  The first error raised by a stage is re-raised."""
+        start_time = time.perf_counter()
+
+        stage_threads = []
+        for stage_index, stage in enumerate(self.stages):
+            threads = [
+                threading.Thread(
+                    target=self.run_worker,
+                    args=(stage_index,),
+                    name=f"{stage.name}-{worker_index}",
+                    daemon=True,
+                )
+                for worker_index in range(stage.num_workers)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        # blocks while the first queue is full
+        for item in items:
+            if self.stop_event.is_set():
+                break
+            self.stages[0].input_queue.put(item)
+
+        # close each stage once the stage before it has finished
+        for stage, threads in zip(self.stages, stage_threads):
+            for _ in threads:
+                stage.input_queue.put(END_OF_ITEMS)
+            for thread in threads:
+                thread.join()
+
+        self.wall_seconds = time.perf_counter() - start_time
+        if self.error is not None:
+            raise self.error
+
+        return self.results
+
+    def get_queue_depths(self) -> dict:
+        """Return the current input queue depth of each stage."""
+        return {stage.name: stage.input_queue.qsize() for stage in self.stages}
+
+    def get_stats(self) -> dict:
+        """Return the workers, items, busy time, utilization, and queue depths of each stage;
+        utilization is the share of the run's wall time that the stage's workers were busy."""
+        stats = {}
+        for stage in self.stages:
+            worker_seconds = self.wall_seconds * stage.num_workers
+            stats[stage.name] = {
+                "num_workers": stage.num_workers,
+                "num_items": stage.num_items,
+                "busy_seconds": stage.busy_seconds,
+                "utilization": stage.busy_seconds / worker_seconds
+                if worker_seconds > 0
+                else None,
+                "max_queue_depth": stage.max_queue_depth,
+                "mean_queue_depth": stage.queue_depth_total / stage.num_items
+                if stage.num_items > 0
+                else None,
+            }
+        return stats
@@ -0,0 +1,291 @@
+"""
+Optional profiling for the runners, scorer, exporter, and analysis scripts.
+
+Setting the CPA_EXAM_PROFILE environment variable to 1 turns profiling on for every entry point,
+e.g., CPA_EXAM_PROFILE=1 python score_exam.py.  Each run then records:
+    - cProfile stats for the main thread and, by default, every thread it starts, e.g., the
+      question pipeline workers of the runners
+    - wall and CPU seconds and the tracemalloc peak for each named stage, e.g., load, parse,
+      score, concat, render, and write, and for the whole run
+and writes them as <output path>/profiles/<name>-<timestamp>.json with the raw cProfile stats in
+a .pstats file alongside, for pstats or snakeviz.  Without the variable, the profiler methods do
+nothing, so the entry points call them unconditionally.
+
+Stages are either sequential, started with start_stage() and ended by the next one or stop(), or
+nested blocks using "with profiler.stage(...)"; repeated stages accumulate, and
+time_iterator() charges the time spent producing each item of an iterator, e.g., loading
+sessions lazily, to a stage.  CPU seconds are process-wide, so they include other threads.
+
+To show the stages and the top hot spots of the latest profile under results/, or of a given one:
+    python profiling.py
+    python profiling.py <profile.json>
+"""
+
+# imports
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+# cProfile, pstats, and tracemalloc are imported when profiling starts, so that the entry points,
+# which import this module unconditionally, do not pay for them when profiling is off
+if TYPE_CHECKING:
+    import pstats
+
+# environment variable that turns profiling on
+PROFILE_ENV_VAR = "CPA_EXAM_PROFILE"
+
+# directory name for profile artifacts within an output path
+PROFILE_DIRECTORY_NAME = "profiles"
+
+# number of functions stored and reported for each sort order
+NUM_TOP_FUNCTIONS = 25
+
+# where the report looks for the latest profile
+RESULTS_PATH = Path(__file__).parent.parent / "results"
+
+
+def is_profiling_enabled() -> bool:
+    """Return whether the profiling environment variable is set to a true value."""
+    return os.environ.get(PROFILE_ENV_VAR, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_top_functions(stats: "pstats.Stats", sort_key: str) -> list[dict]:
+    """Return the top functions of profile stats for a sort key, "tottime" or "cumtime"."""
+    stat_index = {"tottime": 2, "cumtime": 3}[sort_key]
+    top_functions = sorted(
+        stats.stats.items(), key=lambda item: item[1][stat_index], reverse=True
+    )[:NUM_TOP_FUNCTIONS]
+    return [
+        {
+            "function": function_name,
+            "location": f"{file_name}:{line_number}",
+            "num_calls": num_calls,
+            "tottime": total_time,
+            "cumtime": cumulative_time,
+        }
+        for (file_name, line_number, function_name), (
+            _,
+            num_calls,
+            total_time,
+            cumulative_time,
+            _,
+        ) in top_functions
+    ]
+
+
+class Profiler:
+    """Profile one run of an entry point, writing the profile to output_path/profiles when
+    stopped.  Enabled by the environment variable unless enabled is given."""
+
+    def __init__(
+        self,
+        name: str,
+        output_path: Path,
+        enabled: bool | None = None,
+        profile_threads: bool = True,
+    ):
+        self.name = name
+        self.output_path = output_path
+        self.enabled = is_profiling_enabled() if enabled is None else enabled
+        self.profile_threads = profile_threads
+        self.stages = {}
+        self.current_stage = None
+        self.thread_profiles = []
+        self.thread_lock = threading.Lock()
+        self.profile = None
+        self.running = False
+
+    def start(self) -> "Profiler":
+        """Start profiling and return the profiler."""
+        if not self.enabled or self.running:
+            return self
+        import cProfile
+        import tracemalloc
+
+        self.running = True
+        self.start_time = datetime.datetime.now()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        tracemalloc.start()
+        # the running peak memory of the whole run and of each open stage
+        self.peak_stack = [0]
+        if self.profile_threads:
+            threading.setprofile(self.start_thread_profile)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def start_thread_profile(self, *args) -> None:
+        """Start a profile in a new thread; cProfile then replaces this hook for the thread."""
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self.thread_lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def begin_stage(self, stage_name: str) -> tuple:
+        """Begin timing a stage and return its start state."""
+        import tracemalloc
+
+        self.peak_stack[-1] = max(self.peak_stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.peak_stack.append(0)
+        return stage_name, time.perf_counter(), time.process_time()
+
+    def end_stage(self, stage_state: tuple) -> None:
+        """End a stage, adding its times and peak memory to the stage's totals."""
+        import tracemalloc
+
+        stage_name, start_wall, start_cpu = stage_state
+        peak_memory = max(self.peak_stack.pop(), tracemalloc.get_traced_memory()[1])
+        self.peak_stack[-1] = max(self.peak_stack[-1], peak_memory)
+        stage = self.stages.setdefault(
+            stage_name,
+            {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_memory_bytes": 0},
+        )
+        stage["count"] += 1
+        stage["wall_seconds"] += time.perf_counter() - start_wall
+        stage["cpu_seconds"] += time.process_time() - start_cpu
+        stage["peak_memory_bytes"] = max(stage["peak_memory_bytes"], peak_memory)
+
+    @contextlib.contextmanager
+    def stage(self, stage_name: str) -> Iterator[None]:
+        """Time a block as a stage."""
+        if not self.running:
+            yield
+            return
+        stage_state = self.begin_stage(stage_name)
+        try:
+            yield
+        finally:
+            self.end_stage(stage_state)
+
+    def start_stage(self, stage_name: str) -> None:
+        """End the current sequential stage, if any, and start the next one."""
+        if not self.running:
+            return
+        if self.current_stage is not None:
+            self.end_stage(self.current_stage)
+        self.current_stage = self.begin_stage(stage_name)
+
+    def time_iterator(self, stage_name: str, items: Iterable) -> Iterator:
+        """Yield the items of an iterable, charging the time to produce each one to a stage."""
+        iterator = iter(items)
+        while True:
+            with self.stage(stage_name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def stop(self) -> Path | None:
+        """Stop profiling, write the profile, and return the path of its JSON file."""
+        if not self.running:
+            return None
+        import pstats
+        import tracemalloc
+
+        self.profile.disable()
+        if self.profile_threads:
+            threading.setprofile(None)
+        if self.current_stage is not None:
+            self.end_stage(self.current_stage)
+            self.current_stage = None
+        peak_memory = max(self.peak_stack[0], tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        self.running = False
+
+        stats = pstats.Stats(self.profile)
+        with self.thread_lock:
+            for thread_profile in self.thread_profiles:
+                stats.add(thread_profile)
+
+        profile_path = self.output_path / PROFILE_DIRECTORY_NAME
+        profile_path.mkdir(parents=True, exist_ok=True)
+        file_stem = f"{self.name}-{self.start_time.strftime('%Y%m%d-%H%M%S')}"
+        stats.dump_stats(profile_path / f"{file_stem}.pstats")
+
+        profile_data = {
+            "name": self.name,
+            "start_time": self.start_time.isoformat(),
+            "wall_seconds": time.perf_counter() - self.start_wall,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "peak_memory_bytes": peak_memory,
+            "num_threads_profiled": len(self.thread_profiles),
+            "stages": self.stages,
+            "top_tottime": get_top_functions(stats, "tottime"),
+            "top_cumtime": get_top_functions(stats, "cumtime"),
+            "pstats_file": f"{file_stem}.pstats",
+        }
+        profile_json_path = profile_path / f"{file_stem}.json"
+        with open(profile_json_path, "wt", encoding="utf-8") as profile_file:
+            json.dump(profile_data, profile_file, indent=2)
+        print(f"Profile written to {profile_json_path}")
+        return profile_json_path
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def print_profile_report(profile_json_path: Path) -> None:
+    """Print the stage times and top hot spots of a saved profile."""
+    with open(profile_json_path, "rt", encoding="utf-8") as profile_file:
+        profile_data = json.load(profile_file)
+
+    print(f"{profile_data['name']} at {profile_data['start_time']}")
+    print(
+        f"Wall {profile_data['wall_seconds']:.2f}s  CPU {profile_data['cpu_seconds']:.2f}s  "
+        f"Peak memory {profile_data['peak_memory_bytes'] / 2**20:.1f} MiB  "
+        f"Threads {profile_data['num_threads_profiled']}"
+    )
+
+    print("\nStages:")
+    for stage_name, stage in sorted(
+        profile_data["stages"].items(), key=lambda item: -item[1]["wall_seconds"]
+    ):
+        share = stage["wall_seconds"] / max(profile_data["wall_seconds"], 1e-9)
+        print(
+            f"  {stage_name:16s} x{stage['count']:<6d} wall {stage['wall_seconds']:8.3f}s "
+            f"({share:6.1%})  cpu {stage['cpu_seconds']:8.3f}s  "
+            f"peak {stage['peak_memory_bytes'] / 2**20:8.1f} MiB"
+        )
+
+    for sort_key, title in [("top_tottime", "own time"), ("top_cumtime", "cumulative time")]:
+        print(f"\nTop functions by {title}:")
+        for function in profile_data[sort_key][:15]:
+            print(
+                f"  {function['tottime']:8.3f}s {function['cumtime']:8.3f}s "
+                f"{function['num_calls']:>9d}  {function['function']} ({function['location']})"
+            )
+
+
+def main():
+    # report a given profile, or the latest one under the results
+    if len(sys.argv) == 2:
+        profile_json_path = Path(sys.argv[1])
+    else:
+        profile_json_paths = sorted(
+            RESULTS_PATH.rglob(f"{PROFILE_DIRECTORY_NAME}/*.json"),
+            key=lambda path: path.stat().st_mtime,
+        )
+        if len(profile_json_paths) == 0:
+            print(f"No profiles found under {RESULTS_PATH}; set {PROFILE_ENV_VAR}=1 to record one")
+            return
+        profile_json_path = profile_json_paths[-1]
+
+    print_profile_report(profile_json_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -469,3 +469,43 @@ def generate_prompt_020(question_data: dict) -> str:
         raise ValueError(f"Unknown question type {question_data['question_type']}")
 
     return question_prompt
+
+
+def generate_prompt_021(question_data: dict) -> str:
+    """Generate a question prompt to send to GPT-3 API in prompt style 021, which ends right
+    before the answer letter so that a single completion token with logprobs ranks the choices"""
+    question_prompt = f"""Please answer the following CPA exam question with the letter of the best choice.\n\n"""
+
+    # if multiple choice, list the choices
+    if question_data["question_type"] == "multiple_choice":
+        question_prompt += f"""Question: {question_data['question']}\n"""
+        for choice in question_data["choices"]:
+            question_prompt += f"{choice}. {question_data['choices'][choice]}\n"
+        question_prompt += "Answer:"
+    else:
+        raise ValueError(f"Unknown question type {question_data['question_type']}")
+
+    return question_prompt
+
+
+def generate_prompt_022(question_data: dict, exemplar_list: list[dict]) -> str:
+    """Generate a question prompt to send to GPT-3 API in prompt style 022, which shows solved
+    exemplar questions, e.g., the nearest neighbors from few_shot_index, before the question"""
+    question_prompt = f"""Please answer the following CPA exam question in this format:\nChoice: <LETTER>\n\n"""
+
+    # if multiple choice, list the solved exemplars and then the choices
+    if question_data["question_type"] == "multiple_choice":
+        for exemplar_data in exemplar_list:
+            question_prompt += f"""Question: {exemplar_data['question']}\n"""
+            for choice in exemplar_data["choices"]:
+                question_prompt += f"{choice}. {exemplar_data['choices'][choice]}\n"
+            question_prompt += f"""####\nChoice: {exemplar_data['answer']}\n\n"""
+
+        question_prompt += f"""Question: {question_data['question']}\n"""
+        for choice in question_data["choices"]:
+            question_prompt += f"{choice}. {question_data['choices'][choice]}\n"
+        question_prompt += "####\n"
+    else:
+        raise ValueError(f"Unknown question type {question_data['question_type']}")
+
+    return question_prompt
@@ -0,0 +1,227 @@
+"""
+Find near-duplicate questions in a question bank with MinHash and locality-sensitive hashing.
+
+A question repeated or reworded across sections is paid for in every session and counts twice
+towards per-section accuracy.  Comparing every pair of questions is quadratic, so instead:
+    1. each question's normalized text and choices are split into word bigram shingles, hashed
+       with CRC-32
+    2. a MinHash signature of NUM_PERMUTATIONS values per question estimates the Jaccard
+       similarity of the shingle sets; the signatures are computed with NumPy for all questions
+       at once
+    3. the signatures are cut into NUM_BANDS bands, and questions that share any band exactly
+       become candidate pairs, which finds pairs above about (1 / NUM_BANDS) ** (1 / rows per
+       band) similarity with high probability
+    4. candidate pairs are kept if the exact Jaccard similarity of their shingles is at least
+       the threshold, and grouped into clusters with union-find
+
+The runners report the clusters when the bank is loaded and can ask only the first question of
+each cluster, e.g.:
+    duplicate_clusters = find_duplicate_clusters(question_list)
+    print_duplicate_report(question_list, duplicate_clusters)
+    question_list = remove_duplicate_questions(question_list, duplicate_clusters)
+"""
+
+# imports
+import itertools
+import zlib
+
+# packages
+import numpy
+
+# number of MinHash values per question
+NUM_PERMUTATIONS = 64
+
+# number of LSH bands the signature is cut into; rows per band = NUM_PERMUTATIONS / NUM_BANDS
+NUM_BANDS = 16
+
+# default Jaccard similarity of the shingles above which two questions are duplicates
+DEFAULT_SIMILARITY_THRESHOLD = 0.5
+
+# seed for the MinHash hash functions, so signatures are the same across runs
+MINHASH_SEED = 42
+
+# maximum shingles hashed in one block, to bound the memory of the signature computation
+MAX_BLOCK_SHINGLES = 200_000
+
+# lowercase letters and digits are kept, and every other ASCII character separates words
+WORD_CHARACTER_TABLE = str.maketrans(
+    {
+        chr(code): (chr(code).lower() if chr(code).isalnum() else " ")
+        for code in range(128)
+    }
+)
+
+
+def normalize_question_text(question: dict) -> str:
+    """Return the lowercase words of a question and its choices, without punctuation."""
+    choice_text = " ".join((question.get("choices") or {}).values())
+    return f"{question['question']} {choice_text}".translate(WORD_CHARACTER_TABLE)
+
+
+def get_shingle_hashes(question_list: list[dict]) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """Return the hashes of the word bigram shingles of every question, concatenated, and the
+    start offset of each question's hashes with a final end offset.  Each distinct word is
+    hashed once with CRC-32, and bigram hashes combine the hashes of their two words."""
+    question_words = [
+        normalize_question_text(question).split() or [""] for question in question_list
+    ]
+    all_words = list(itertools.chain.from_iterable(question_words))
+    word_ids = dict.fromkeys(all_words)
+    for word_id, word in enumerate(word_ids):
+        word_ids[word] = word_id
+    word_hashes = numpy.array(
+        [zlib.crc32(word.encode("utf-8")) for word in word_ids], dtype=numpy.uint32
+    )
+    all_word_ids = numpy.fromiter(
+        map(word_ids.__getitem__, all_words), dtype=numpy.int64, count=len(all_words)
+    )
+    all_word_hashes = word_hashes[all_word_ids]
+
+    # a bigram for each pair of neighbouring words within a question, or the word itself for
+    # one-word questions
+    question_lengths = numpy.fromiter(map(len, question_words), dtype=numpy.int64)
+    word_ends = numpy.cumsum(question_lengths)
+    is_bigram_start = numpy.ones(len(all_words), dtype=bool)
+    is_bigram_start[word_ends - 1] = question_lengths == 1
+    bigram_starts = numpy.flatnonzero(is_bigram_start)
+    bigram_ends = numpy.minimum(bigram_starts + 1, len(all_words) - 1)
+    shingle_hashes = all_word_hashes[bigram_starts] * numpy.uint32(0x9E3779B1) + numpy.where(
+        question_lengths.repeat(question_lengths)[bigram_starts] > 1,
+        all_word_hashes[bigram_ends],
+        numpy.uint32(0),
+    )
+    offsets = numpy.concatenate([[0], numpy.cumsum(numpy.maximum(question_lengths - 1, 1))])
+    return shingle_hashes, offsets
+
+
+def compute_minhash_signatures(
+    shingle_hashes: numpy.ndarray, offsets: numpy.ndarray
+) -> numpy.ndarray:
+    """Return a questions x NUM_PERMUTATIONS matrix of MinHash values.  Each hash function is
+    an affine map modulo 2**32 with an odd multiplier, which permutes the 32-bit shingle
+    hashes; the values are computed in blocks of about MAX_BLOCK_SHINGLES shingles, laid out
+    by hash function so that the minimum over each question's shingles is contiguous."""
+    rng = numpy.random.default_rng(MINHASH_SEED)
+    multipliers = rng.integers(0, 2**31, size=(NUM_PERMUTATIONS, 1), dtype=numpy.uint32) * 2 + 1
+    increments = rng.integers(0, 2**32, size=(NUM_PERMUTATIONS, 1), dtype=numpy.uint32)
+
+    num_questions = len(offsets) - 1
+    signatures = numpy.empty((NUM_PERMUTATIONS, num_questions), dtype=numpy.uint32)
+    block_start = 0
+    while block_start < num_questions:
+        block_end = (
+            int(numpy.searchsorted(offsets, offsets[block_start] + MAX_BLOCK_SHINGLES, "right"))
+            - 1
+        )
+        block_end = min(max(block_end, block_start + 1), num_questions)
+        block_hashes = shingle_hashes[offsets[block_start] : offsets[block_end]]
+        hashed = numpy.multiply(multipliers, block_hashes[None, :])
+        hashed += increments
+        signatures[:, block_start:block_end] = numpy.minimum.reduceat(
+            hashed, offsets[block_start:block_end] - offsets[block_start], axis=1
+        )
+        block_start = block_end
+
+    return signatures.T
+
+
+def find_candidate_pairs(signatures: numpy.ndarray) -> set[tuple[int, int]]:
+    """Return the pairs of question indexes whose signatures share at least one band."""
+    rows_per_band = signatures.shape[1] // NUM_BANDS
+    candidate_pairs = set()
+    for band_index in range(NUM_BANDS):
+        band = numpy.ascontiguousarray(
+            signatures[:, band_index * rows_per_band : (band_index + 1) * rows_per_band]
+        )
+        # one opaque key per row, so that numpy.unique groups identical bands
+        band_keys = band.view(numpy.dtype((numpy.void, band.dtype.itemsize * rows_per_band)))
+        _, bucket_ids, bucket_sizes = numpy.unique(
+            band_keys.ravel(), return_inverse=True, return_counts=True
+        )
+        bucket_ids = bucket_ids.ravel()
+        shared = numpy.flatnonzero(bucket_sizes[bucket_ids] > 1)
+        shared = shared[numpy.argsort(bucket_ids[shared], kind="stable")]
+        bucket_starts = numpy.flatnonzero(numpy.diff(bucket_ids[shared], prepend=-1))
+        for bucket in numpy.split(shared, bucket_starts[1:]):
+            bucket = bucket.tolist()
+            for position, first_index in enumerate(bucket):
+                for second_index in bucket[position + 1 :]:
+                    candidate_pairs.add((first_index, second_index))
+    return candidate_pairs
+
+
+def get_jaccard_similarity(first_hashes: numpy.ndarray, second_hashes: numpy.ndarray) -> float:
+    """Return the Jaccard similarity of the sets of two hash arrays."""
+    first_hashes, second_hashes = numpy.unique(first_hashes), numpy.unique(second_hashes)
+    num_shared = len(numpy.intersect1d(first_hashes, second_hashes, assume_unique=True))
+    return num_shared / (len(first_hashes) + len(second_hashes) - num_shared)
+
+
+def find_duplicate_clusters(
+    question_list: list[dict], threshold: float = DEFAULT_SIMILARITY_THRESHOLD
+) -> list[list[int]]:
+    """Return the clusters of near-duplicate questions as sorted lists of question indexes,
+    ordered by their first question; questions without duplicates are not included."""
+    if len(question_list) < 2:
+        return []
+    shingle_hashes, offsets = get_shingle_hashes(question_list)
+    signatures = compute_minhash_signatures(shingle_hashes, offsets)
+
+    # union-find over the verified pairs
+    parents = list(range(len(question_list)))
+
+    def find_root(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    for first_index, second_index in find_candidate_pairs(signatures):
+        if (
+            get_jaccard_similarity(
+                shingle_hashes[offsets[first_index] : offsets[first_index + 1]],
+                shingle_hashes[offsets[second_index] : offsets[second_index + 1]],
+            )
+            >= threshold
+        ):
+            first_root, second_root = find_root(first_index), find_root(second_index)
+            if first_root != second_root:
+                parents[max(first_root, second_root)] = min(first_root, second_root)
+
+    clusters = {}
+    for index in range(len(question_list)):
+        clusters.setdefault(find_root(index), []).append(index)
+    return sorted(
+        (members for members in clusters.values() if len(members) > 1), key=lambda c: c[0]
+    )
+
+
+def get_question_id(question: dict) -> str:
+    """Return the section and number of a question, e.g., "AUD-12"."""
+    return f"{question.get('question_section')}-{question.get('question_number')}"
+
+
+def print_duplicate_report(question_list: list[dict], duplicate_clusters: list[list[int]]) -> None:
+    """Print the number of duplicate questions and each cluster, flagging clusters whose
+    questions have different answers."""
+    num_duplicates = sum(len(cluster) - 1 for cluster in duplicate_clusters)
+    print(
+        f"Near-duplicate questions: {num_duplicates} of {len(question_list)} in "
+        f"{len(duplicate_clusters)} clusters"
+    )
+    for cluster in duplicate_clusters:
+        answers = {str(question_list[index]["answer"]) for index in cluster}
+        flag = "  (answers differ)" if len(answers) > 1 else ""
+        print(
+            "  " + ", ".join(get_question_id(question_list[index]) for index in cluster) + flag
+        )
+
+
+def remove_duplicate_questions(
+    question_list: list[dict], duplicate_clusters: list[list[int]]
+) -> list[dict]:
+    """Return the question list with only the first question of each duplicate cluster."""
+    removed_indexes = {index for cluster in duplicate_clusters for index in cluster[1:]}
+    return [
+        question for index, question in enumerate(question_list) if index not in removed_indexes
+    ]
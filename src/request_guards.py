@@ -0,0 +1,323 @@
+"""
+Guards that stop sending requests when they are wasted: a circuit breaker for each model and a
+token and cost budget for a whole sweep.
+
+A CircuitBreaker trips once the error rate over a model's recent requests passes a threshold,
+e.g., when the endpoint is degraded or the model has been retired.  While it is open, that
+model's requests wait instead of failing through their retries; after a cooldown one probe
+request is let through (half-open), which closes the breaker on success or reopens it with a
+doubled cooldown on failure.  After max_failed_probes failed probes in a row the model is given
+up on and its requests raise CircuitOpenError.
+
+A TokenBudget counts the tokens in each response's usage and their cost, and raises
+BudgetExceededError for any request sent once a limit is reached.  Requests already in flight
+finish, so the budget can be overrun by at most their tokens.  Streamed responses carry no usage,
+so they are charged an estimate of their prompt tokens plus max_tokens for each choice.  A
+resumed sweep charges the budget with the tokens its saved sessions already used (see
+get_session_charged_tokens) so that the limits hold across runs.
+
+Both raise subclasses of RequestAborted, which exam sessions do not retry; the session is saved
+as unfinished so that it can be resumed later.
+"""
+
+# imports
+import collections
+import threading
+import time
+
+# project imports
+from completion_client import CompletionStream
+
+# default number of recent requests the error rate is taken over
+DEFAULT_ERROR_WINDOW = 20
+
+# default error rate over the window that trips the breaker
+DEFAULT_ERROR_THRESHOLD = 0.5
+
+# default number of requests in the window before the breaker can trip
+DEFAULT_MIN_REQUESTS = 10
+
+# default seconds the breaker stays open after tripping, and the most it backs off to
+DEFAULT_OPEN_SECONDS = 30.0
+DEFAULT_MAX_OPEN_SECONDS = 600.0
+
+# default number of failed probes in a row before a model is given up on
+DEFAULT_MAX_FAILED_PROBES = 5
+
+# USD per 1,000 tokens for each model, prompt and completion tokens alike
+MODEL_PRICES = {
+    "text-ada-001": 0.0004,
+    "text-babbage-001": 0.0005,
+    "text-curie-001": 0.002,
+    "text-davinci-001": 0.02,
+    "text-davinci-002": 0.02,
+    "text-davinci-003": 0.02,
+}
+
+# approximate characters per token for estimating the prompt tokens of streamed requests
+CHARACTERS_PER_TOKEN = 4
+
+
+class RequestAborted(Exception):
+    """A request that should not be retried, stopping the session that sent it."""
+
+
+class CircuitOpenError(RequestAborted):
+    """A model whose circuit breaker gave up after repeated failed probes."""
+
+
+class BudgetExceededError(RequestAborted):
+    """A request sent after the token or cost budget was used up."""
+
+
+class CircuitBreaker:
+    """A closed, open, or half-open circuit breaker for the requests to one model."""
+
+    def __init__(
+        self,
+        error_window: int = DEFAULT_ERROR_WINDOW,
+        error_threshold: float = DEFAULT_ERROR_THRESHOLD,
+        min_requests: int = DEFAULT_MIN_REQUESTS,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+        max_open_seconds: float = DEFAULT_MAX_OPEN_SECONDS,
+        max_failed_probes: int = DEFAULT_MAX_FAILED_PROBES,
+    ):
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.initial_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_failed_probes = max_failed_probes
+
+        self.condition = threading.Condition()
+        self.outcomes = collections.deque(maxlen=error_window)
+        self.state = "closed"
+        self.open_seconds = open_seconds
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self.num_failed_probes = 0
+        self.num_trips = 0
+        self.total_open_seconds = 0.0
+        self.opened_time = None
+
+    def trip(self) -> None:
+        """Open the breaker for the current cooldown; called with the condition held."""
+        now = time.monotonic()
+        if self.state == "closed":
+            self.num_trips += 1
+            self.opened_time = now
+        self.state = "open"
+        self.open_until = now + self.open_seconds
+        self.outcomes.clear()
+        self.condition.notify_all()
+
+    def before_request(self) -> bool:
+        """Wait while the breaker is open and return whether this request is the half-open
+        probe.  Raises CircuitOpenError once the model has been given up on."""
+        with self.condition:
+            while True:
+                if self.state == "failed":
+                    raise CircuitOpenError(
+                        f"Circuit breaker gave up after {self.num_failed_probes} failed probes"
+                    )
+                if self.state == "closed":
+                    return False
+                if self.state == "open" and time.monotonic() >= self.open_until:
+                    self.state = "half_open"
+                if self.state == "half_open" and not self.probe_in_flight:
+                    self.probe_in_flight = True
+                    return True
+                if self.state == "open":
+                    self.condition.wait(timeout=self.open_until - time.monotonic())
+                else:
+                    self.condition.wait()
+
+    def record_success(self, is_probe: bool) -> None:
+        """Record a successful request, closing the breaker after a successful probe."""
+        with self.condition:
+            if is_probe:
+                self.probe_in_flight = False
+                self.state = "closed"
+                self.open_seconds = self.initial_open_seconds
+                self.num_failed_probes = 0
+                self.total_open_seconds += time.monotonic() - self.opened_time
+                self.opened_time = None
+                self.condition.notify_all()
+            self.outcomes.append(False)
+
+    def record_cancelled(self, is_probe: bool) -> None:
+        """Record a request cancelled by the caller, e.g., the slower of two hedged requests,
+        which says nothing about the model; a cancelled probe lets another request probe."""
+        with self.condition:
+            if is_probe:
+                self.probe_in_flight = False
+                self.condition.notify_all()
+
+    def record_failure(self, is_probe: bool) -> None:
+        """Record a failed request, tripping the breaker past the error threshold, or
+        reopening it with a longer cooldown after a failed probe."""
+        with self.condition:
+            if is_probe:
+                self.probe_in_flight = False
+                self.num_failed_probes += 1
+                if self.num_failed_probes >= self.max_failed_probes:
+                    self.state = "failed"
+                    self.condition.notify_all()
+                    return
+                self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+                self.trip()
+                return
+
+            self.outcomes.append(True)
+            if (
+                self.state == "closed"
+                and len(self.outcomes) >= self.min_requests
+                and sum(self.outcomes) / len(self.outcomes) >= self.error_threshold
+            ):
+                self.trip()
+
+    def get_stats(self) -> dict:
+        """Return the breaker state, the number of times it tripped, and the seconds it spent
+        open."""
+        with self.condition:
+            total_open_seconds = self.total_open_seconds
+            if self.opened_time is not None:
+                total_open_seconds += time.monotonic() - self.opened_time
+            return {
+                "state": self.state,
+                "num_trips": self.num_trips,
+                "num_failed_probes": self.num_failed_probes,
+                "open_seconds": total_open_seconds,
+            }
+
+
+class TokenBudget:
+    """A limit on the tokens and cost of the requests sent by a sweep; either limit may be
+    None."""
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        max_cost: float | None = None,
+        model_prices: dict[str, float] | None = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.model_prices = model_prices or MODEL_PRICES
+        self.lock = threading.Lock()
+        self.num_tokens = 0
+        self.cost = 0.0
+        self.model_tokens = collections.Counter()
+
+    def is_exceeded(self) -> bool:
+        """Return whether either limit has been reached."""
+        with self.lock:
+            return (self.max_tokens is not None and self.num_tokens >= self.max_tokens) or (
+                self.max_cost is not None and self.cost >= self.max_cost
+            )
+
+    def check(self) -> None:
+        """Raise BudgetExceededError if either limit has been reached."""
+        if self.is_exceeded():
+            raise BudgetExceededError(
+                f"Budget reached: {self.num_tokens} tokens, ${self.cost:.2f}"
+            )
+
+    def charge(self, model_name: str, num_tokens: int) -> None:
+        """Add the tokens of a response and their cost at the model's price."""
+        with self.lock:
+            self.num_tokens += num_tokens
+            self.cost += num_tokens / 1000.0 * self.model_prices.get(model_name, 0.0)
+            self.model_tokens[model_name] += num_tokens
+
+    def get_stats(self) -> dict:
+        """Return the limits and the tokens and cost used so far."""
+        with self.lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "max_cost": self.max_cost,
+                "num_tokens": self.num_tokens,
+                "cost": self.cost,
+                "model_tokens": dict(self.model_tokens),
+            }
+
+
+def get_charged_tokens(response, prompt: str, parameters: dict) -> int:
+    """Return the total tokens of a response from its usage, or an estimate for a stream."""
+    if isinstance(response, CompletionStream) or "usage" not in response:
+        return len(prompt) // CHARACTERS_PER_TOKEN + parameters.get(
+            "max_tokens", 16
+        ) * parameters.get("n", 1)
+    usage = response["usage"]
+    return usage.get("total_tokens") or usage.get("prompt_tokens", 0) + usage.get(
+        "completion_tokens", 0
+    )
+
+
+def get_session_charged_tokens(exam_data: dict) -> int:
+    """Return the tokens used by the requests saved in a session: each question's response and
+    explanation, charged as get_charged_tokens would have, and the tokens of its hedges."""
+    num_tokens = 0
+    for question_data in exam_data["questions"]:
+        for response_key in ["model_response", "explanation_response"]:
+            if question_data.get(response_key) is not None:
+                num_tokens += get_charged_tokens(
+                    question_data[response_key],
+                    question_data["model_prompt"],
+                    {**exam_data["parameters"], "n": exam_data.get("num_samples", 1)},
+                )
+        request_metrics = question_data.get("request_metrics") or {}
+        num_tokens += request_metrics.get("hedge_prompt_tokens") or 0
+        num_tokens += request_metrics.get("hedge_completion_tokens") or 0
+    return num_tokens
+
+
+class GuardedClient:
+    """A completion client that checks the budget and the model's circuit
+    breaker before every request and records the outcome afterwards."""
+
+    def __init__(
+        self,
+        client,
+        circuit_breaker: CircuitBreaker | None = None,
+        budget: TokenBudget | None = None,
+    ):
+        self.client = client
+        self.circuit_breaker = circuit_breaker
+        self.budget = budget
+
+    def create(self, model: str, prompt: str, **kwargs):
+        """Create the completion with the wrapped client, unless the budget is used up,
+        waiting while the circuit breaker is open."""
+        if self.budget is not None:
+            self.budget.check()
+        is_probe = (
+            self.circuit_breaker.before_request() if self.circuit_breaker is not None else False
+        )
+        if self.budget is not None:
+            self.budget.check()
+
+        try:
+            response = self.client.create(model=model, prompt=prompt, **kwargs)
+        except Exception:
+            handle = kwargs.get("handle")
+            if self.circuit_breaker is not None:
+                if handle is not None and handle.cancelled:
+                    self.circuit_breaker.record_cancelled(is_probe)
+                else:
+                    self.circuit_breaker.record_failure(is_probe)
+            raise
+
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success(is_probe)
+        if self.budget is not None:
+            self.budget.charge(model, get_charged_tokens(response, prompt, kwargs))
+        return response
+
+    def get_pool_stats(self) -> dict:
+        """Return the wrapped client's statistics with the circuit breaker and budget."""
+        stats = dict(self.client.get_pool_stats())
+        if self.circuit_breaker is not None:
+            stats["circuit_breaker"] = self.circuit_breaker.get_stats()
+        if self.budget is not None:
+            stats["budget"] = self.budget.get_stats()
+        return stats
@@ -0,0 +1,240 @@
+"""
+Per-request latency, token, and throughput metrics for exam sessions.
+
+Each question in a session records a metrics dictionary like this:
+    {
+        "queue_wait": 0.001,        # seconds from the prompt being ready to the first request
+        "http_latency": 1.52,       # seconds for the successful request
+        "total_latency": 1.52,      # seconds from the first request to the result, with retries
+        "retries": 0,               # failed attempts before the final result
+        "prompt_tokens": 118,
+        "completion_tokens": 111,
+        "tokens_per_second": 73.0,  # completion tokens / http_latency
+        "time_to_first_token": None,  # seconds to the first streamed token, if streamed
+        "time_to_answer": None,     # seconds until the answer fields were parsed, if streamed
+        "hedged": False,            # whether a duplicate request was sent (see hedging.py)
+        "hedge_won": False,         # whether the duplicate returned first
+        "hedge_prompt_tokens": 0,   # tokens spent on the request that lost
+        "hedge_completion_tokens": 0,
+        "hedge_tokens_estimated": False,  # whether the loser was cancelled without usage
+    }
+
+The summary functions roll these up into percentiles and a fixed-bucket latency histogram so
+that sessions and groups of sessions can be compared.
+"""
+
+# imports
+import math
+import time
+
+# the metrics that are summarized with percentiles
+SUMMARY_METRICS = [
+    "queue_wait",
+    "http_latency",
+    "total_latency",
+    "tokens_per_second",
+    "time_to_first_token",
+    "time_to_answer",
+]
+
+# the percentiles reported for each metric
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+# upper bounds in seconds of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf]
+
+
+class RequestTimer:
+    """Track the timing of a single question's request, from the prompt being ready through
+    the successful response, including retries."""
+
+    def __init__(self):
+        self.enqueue_time = time.perf_counter()
+        self.first_request_time = None
+        self.attempt_start_time = None
+        self.attempt_end_time = None
+        self.first_token_time = None
+        self.answer_time = None
+        self.retries = 0
+        self.hedge_metrics = {
+            "hedged": False,
+            "hedge_won": False,
+            "hedge_prompt_tokens": 0,
+            "hedge_completion_tokens": 0,
+            "hedge_tokens_estimated": False,
+        }
+
+    def start_attempt(self) -> None:
+        """Mark the start of an attempt."""
+        self.attempt_start_time = time.perf_counter()
+        self.first_token_time = None
+        self.answer_time = None
+        if self.first_request_time is None:
+            self.first_request_time = self.attempt_start_time
+
+    def mark_first_token(self) -> None:
+        """Mark the arrival of the first streamed token of the current attempt."""
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+
+    def mark_answer(self) -> None:
+        """Mark the point in a streamed attempt where the answer fields were parsed."""
+        if self.answer_time is None:
+            self.answer_time = time.perf_counter()
+
+    def record_hedge(self, hedge_metrics: dict) -> None:
+        """Add the hedge metrics of an attempt, accumulating tokens across retries."""
+        self.hedge_metrics["hedged"] |= hedge_metrics["hedged"]
+        self.hedge_metrics["hedge_won"] = hedge_metrics["hedge_won"]
+        self.hedge_metrics["hedge_prompt_tokens"] += hedge_metrics["hedge_prompt_tokens"]
+        self.hedge_metrics["hedge_completion_tokens"] += hedge_metrics[
+            "hedge_completion_tokens"
+        ]
+        self.hedge_metrics["hedge_tokens_estimated"] |= hedge_metrics["hedge_tokens_estimated"]
+
+    def end_attempt(self, success: bool) -> None:
+        """Mark the end of an attempt, counting it as a retry if it failed."""
+        self.attempt_end_time = time.perf_counter()
+        if not success:
+            self.retries += 1
+
+    def get_metrics(self, response: dict | None) -> dict:
+        """Return the metrics dictionary for the final response, if any."""
+        metrics = {
+            "queue_wait": None,
+            "http_latency": None,
+            "total_latency": None,
+            "retries": self.retries,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "tokens_per_second": None,
+            "time_to_first_token": None,
+            "time_to_answer": None,
+            **self.hedge_metrics,
+        }
+
+        if self.first_request_time is not None:
+            metrics["queue_wait"] = self.first_request_time - self.enqueue_time
+            metrics["total_latency"] = self.attempt_end_time - self.first_request_time
+
+        if response is not None:
+            metrics["http_latency"] = self.attempt_end_time - self.attempt_start_time
+            if self.first_token_time is not None:
+                metrics["time_to_first_token"] = (
+                    self.first_token_time - self.attempt_start_time
+                )
+            if self.answer_time is not None:
+                metrics["time_to_answer"] = self.answer_time - self.attempt_start_time
+            metrics.update(get_usage_tokens(response))
+            if (
+                metrics["completion_tokens"] is not None
+                and metrics["http_latency"] > 0
+            ):
+                metrics["tokens_per_second"] = (
+                    metrics["completion_tokens"] / metrics["http_latency"]
+                )
+
+        return metrics
+
+
+def get_usage_tokens(response: dict | None) -> dict:
+    """Return the prompt and completion token counts from a response's usage, if present."""
+    try:
+        usage = response["usage"]
+        return {
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage.get("completion_tokens", 0),
+        }
+    except (KeyError, TypeError):
+        return {
+            "prompt_tokens": None,
+            "completion_tokens": None,
+        }
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float | None:
+    """Return the nearest-rank percentile of a sorted list of values."""
+    if len(sorted_values) == 0:
+        return None
+    rank = math.ceil(percentile / 100.0 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def get_latency_histogram(values: list[float]) -> dict:
+    """Return the number of values in each latency bucket keyed by the bucket upper bound."""
+    histogram = {str(bound): 0 for bound in LATENCY_BUCKETS}
+    for value in values:
+        for bound in LATENCY_BUCKETS:
+            if value <= bound:
+                histogram[str(bound)] += 1
+                break
+    return histogram
+
+
+def get_metric_values(metrics_list: list[dict], metric_name: str) -> list[float]:
+    """Return the non-missing values of a metric; missing values may be None or NaN."""
+    values = []
+    for metrics in metrics_list:
+        value = metrics.get(metric_name)
+        if value is None or value != value:
+            continue
+        values.append(value)
+    return values
+
+
+def summarize_request_metrics(metrics_list: list[dict]) -> dict:
+    """Summarize a list of per-request metrics into counts, token totals, throughput,
+    percentiles for each summary metric, and a histogram of HTTP latency.  Requests without
+    timing, e.g., from sessions recorded before metrics were added, only count towards tokens.
+    """
+    metrics_list = [metrics for metrics in metrics_list if metrics is not None]
+    http_latency_values = get_metric_values(metrics_list, "http_latency")
+    retries_values = get_metric_values(metrics_list, "retries")
+
+    summary = {
+        "num_requests": len(metrics_list),
+        # a timed request without an HTTP latency never succeeded
+        "num_failed": len(retries_values) - len(http_latency_values),
+        "num_retries": sum(retries_values),
+        "prompt_tokens": sum(get_metric_values(metrics_list, "prompt_tokens")),
+        "completion_tokens": sum(get_metric_values(metrics_list, "completion_tokens")),
+    }
+
+    # duplicate requests sent to cut tail latency
+    num_hedged = sum(get_metric_values(metrics_list, "hedged"))
+    summary["num_hedged"] = num_hedged
+    summary["num_hedge_wins"] = sum(get_metric_values(metrics_list, "hedge_won"))
+    summary["hedge_rate"] = (
+        num_hedged / len(retries_values) if len(retries_values) > 0 else None
+    )
+    summary["hedge_prompt_tokens"] = sum(
+        get_metric_values(metrics_list, "hedge_prompt_tokens")
+    )
+    summary["hedge_completion_tokens"] = sum(
+        get_metric_values(metrics_list, "hedge_completion_tokens")
+    )
+    summary["num_hedge_tokens_estimated"] = sum(
+        get_metric_values(metrics_list, "hedge_tokens_estimated")
+    )
+
+    # overall throughput across the requests that were timed
+    timed_metrics_list = [
+        m for m in metrics_list if len(get_metric_values([m], "http_latency")) > 0
+    ]
+    total_http_latency = sum(http_latency_values)
+    summary["tokens_per_second"] = (
+        sum(get_metric_values(timed_metrics_list, "completion_tokens"))
+        / total_http_latency
+        if total_http_latency > 0
+        else None
+    )
+
+    # percentiles for each metric
+    for metric_name in SUMMARY_METRICS:
+        values = sorted(get_metric_values(metrics_list, metric_name))
+        for percentile in SUMMARY_PERCENTILES:
+            summary[f"{metric_name}_p{percentile}"] = get_percentile(values, percentile)
+
+    summary["http_latency_histogram"] = get_latency_histogram(http_latency_values)
+
+    return summary
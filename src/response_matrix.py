@@ -0,0 +1,227 @@
+"""
+Dense sessions x questions matrices of scored responses for vectorized analysis.
+
+Each session group is stored as a few NumPy arrays that share a session axis and a question axis:
+    - correct: int8 matrix, 1 if correct, 0 if wrong, -1 if the session did not ask the question
+    - answers: int8 matrix of answer codes, the index of the chosen letter in ANSWER_LETTERS,
+      OTHER_ANSWER for an answer that is not a choice letter, or NO_ANSWER if unparsed or not asked
+    - question_ids, correct_answers: "<section>-<number>" and the correct answer code for each
+      column
+    - session_names, model_names, prompt_methods, temperatures, best_of: metadata for each row
+
+The arrays are saved with numpy.save as plain (non-object) arrays so they can be loaded with
+mmap_mode="r", and agreement, difficulty, and majority voting are single array operations.
+Only the first sample of each question is used for sessions run with n > 1.
+"""
+
+# imports
+from pathlib import Path
+from typing import Iterable
+
+# packages
+import numpy
+
+# project imports
+from score_exam import score_exam_records
+from session_archive import get_archive_paths, iter_sessions
+
+# choice letters in answer code order
+ANSWER_LETTERS = ["A", "B", "C", "D"]
+
+# code for an answer that is not one of the choice letters
+OTHER_ANSWER = len(ANSWER_LETTERS)
+
+# code for no parsed answer or a question the session did not ask
+NO_ANSWER = -1
+
+# directory name of the saved matrix within a session group
+RESPONSE_MATRIX_NAME = "response_matrix"
+
+# arrays along the question axis, which are shared by every subset of sessions
+QUESTION_ARRAYS = ["question_ids", "correct_answers"]
+
+# array names saved for each matrix
+RESPONSE_MATRIX_ARRAYS = [
+    "correct",
+    "answers",
+    "question_ids",
+    "correct_answers",
+    "session_names",
+    "model_names",
+    "prompt_methods",
+    "temperatures",
+    "best_of",
+]
+
+
+class ResponseMatrix:
+    """Correctness and answer codes for a set of sessions and questions, with the session
+    metadata alongside."""
+
+    def __init__(self, **arrays: numpy.ndarray):
+        for name in RESPONSE_MATRIX_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def asked(self) -> numpy.ndarray:
+        """Return a boolean matrix of the questions each session asked."""
+        return self.correct >= 0
+
+    def select_sessions(self, session_mask: numpy.ndarray) -> "ResponseMatrix":
+        """Return the matrix for the sessions selected by a boolean mask, e.g.,
+        matrix.select_sessions(matrix.prompt_methods == "generate_prompt_018")"""
+        arrays = {}
+        for name in RESPONSE_MATRIX_ARRAYS:
+            if name in QUESTION_ARRAYS:
+                arrays[name] = getattr(self, name)
+            else:
+                arrays[name] = getattr(self, name)[session_mask]
+        return ResponseMatrix(**arrays)
+
+    def save(self, matrix_path: Path) -> None:
+        """Save each array with numpy.save to the matrix directory."""
+        matrix_path.mkdir(parents=True, exist_ok=True)
+        for name in RESPONSE_MATRIX_ARRAYS:
+            numpy.save(matrix_path / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, matrix_path: Path, mmap_mode: str | None = "r") -> "ResponseMatrix":
+        """Load a saved matrix, memory-mapping the arrays by default."""
+        return cls(
+            **{
+                name: numpy.load(matrix_path / f"{name}.npy", mmap_mode=mmap_mode)
+                for name in RESPONSE_MATRIX_ARRAYS
+            }
+        )
+
+
+def get_answer_code(answer: str | None) -> int:
+    """Return the answer code for a parsed answer."""
+    if answer is None:
+        return NO_ANSWER
+    elif answer in ANSWER_LETTERS:
+        return ANSWER_LETTERS.index(answer)
+    return OTHER_ANSWER
+
+
+def build_response_matrix(sessions: Iterable[tuple[str, dict]]) -> ResponseMatrix:
+    """Score the named sessions and return their response matrix, with one column for each
+    question asked by any session, sorted by question ID."""
+    session_names = []
+    session_metadata = []
+    session_responses = []
+    correct_answers = {}
+    for session_name, exam_data in sessions:
+        responses = {}
+        for record in score_exam_records(exam_data):
+            if record["sample_index"] != 0:
+                continue
+            question_input = exam_data["questions"][record["question_number"] - 1][
+                "question_input"
+            ]
+            question_id = (
+                f"{question_input.get('question_section')}-"
+                f"{question_input.get('question_number')}"
+            )
+            responses[question_id] = (
+                int(record["is_correct"]),
+                get_answer_code(record["model_answer"]),
+            )
+            correct_answers[question_id] = get_answer_code(record["correct_answer"])
+        session_names.append(session_name)
+        session_metadata.append(
+            (
+                exam_data.get("model_name") or "",
+                exam_data.get("prompt_method") or "",
+                exam_data["parameters"].get("temperature", numpy.nan),
+                exam_data["parameters"].get("best_of", 1),
+            )
+        )
+        session_responses.append(responses)
+
+    question_ids = sorted(correct_answers)
+    question_index = {question_id: i for i, question_id in enumerate(question_ids)}
+
+    correct = numpy.full((len(session_names), len(question_ids)), -1, dtype=numpy.int8)
+    answers = numpy.full((len(session_names), len(question_ids)), NO_ANSWER, dtype=numpy.int8)
+    for session_index, responses in enumerate(session_responses):
+        columns = [question_index[question_id] for question_id in responses]
+        values = numpy.array(list(responses.values()), dtype=numpy.int8).reshape(-1, 2)
+        correct[session_index, columns] = values[:, 0]
+        answers[session_index, columns] = values[:, 1]
+
+    return ResponseMatrix(
+        correct=correct,
+        answers=answers,
+        question_ids=numpy.array(question_ids, dtype=str),
+        correct_answers=numpy.array(
+            [correct_answers[question_id] for question_id in question_ids],
+            dtype=numpy.int8,
+        ),
+        session_names=numpy.array(session_names, dtype=str),
+        model_names=numpy.array([m[0] for m in session_metadata], dtype=str),
+        prompt_methods=numpy.array([m[1] for m in session_metadata], dtype=str),
+        temperatures=numpy.array([m[2] for m in session_metadata], dtype=numpy.float64),
+        best_of=numpy.array([m[3] for m in session_metadata], dtype=numpy.int64),
+    )
+
+
+def load_response_matrix(session_group_path: Path) -> ResponseMatrix:
+    """Load the memory-mapped matrix for a session group, rebuilding and saving it first if it
+    does not exist or is older than any of the group's sessions."""
+    matrix_path = session_group_path / RESPONSE_MATRIX_NAME
+    source_paths = list(session_group_path.glob("*/exam_data.json")) + get_archive_paths(
+        session_group_path
+    )
+    source_mtime = max((path.stat().st_mtime for path in source_paths), default=0.0)
+
+    if (
+        not (matrix_path / "correct.npy").exists()
+        or (matrix_path / "correct.npy").stat().st_mtime < source_mtime
+    ):
+        build_response_matrix(iter_sessions(session_group_path)).save(matrix_path)
+
+    return ResponseMatrix.load(matrix_path)
+
+
+def get_question_difficulty(matrix: ResponseMatrix) -> numpy.ndarray:
+    """Return the share of sessions asking each question that got it wrong, or NaN for
+    questions no session asked."""
+    num_asked = matrix.asked.sum(axis=0)
+    num_correct = (matrix.correct == 1).sum(axis=0)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return 1.0 - num_correct / num_asked
+
+
+def get_answer_counts(matrix: ResponseMatrix) -> numpy.ndarray:
+    """Return a questions x (letters + other) matrix of how many sessions chose each answer."""
+    one_hot = matrix.answers[:, :, None] == numpy.arange(OTHER_ANSWER + 1)
+    return one_hot.sum(axis=0)
+
+
+def get_majority_answers(matrix: ResponseMatrix) -> numpy.ndarray:
+    """Return the most common answer code across sessions for each question, ties going to
+    the earliest letter, or NO_ANSWER for questions without any answer."""
+    answer_counts = get_answer_counts(matrix)
+    return numpy.where(
+        answer_counts.sum(axis=1) > 0, answer_counts.argmax(axis=1), NO_ANSWER
+    )
+
+
+def get_majority_accuracy(matrix: ResponseMatrix) -> float:
+    """Return the share of questions whose majority answer across sessions is correct."""
+    majority_answers = get_majority_answers(matrix)
+    answered = majority_answers != NO_ANSWER
+    return float((majority_answers == matrix.correct_answers)[answered].mean())
+
+
+def get_agreement_matrix(matrix: ResponseMatrix) -> numpy.ndarray:
+    """Return a sessions x sessions matrix of the share of questions asked by both sessions
+    on which they chose the same answer, or NaN where they share no questions."""
+    one_hot = (matrix.answers[:, :, None] == numpy.arange(OTHER_ANSWER + 1)).reshape(
+        len(matrix.session_names), -1
+    )
+    one_hot = one_hot.astype(numpy.float32)
+    asked = matrix.asked.astype(numpy.float32)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return (one_hot @ one_hot.T) / (asked @ asked.T)
@@ -8,39 +8,79 @@ Provide results in csv/latex and various figures for Assessment 1, including:
 """
 
 # imports
+import functools
 import io
 import json
 import os
 import textwrap
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 # packages
-import matplotlib.pyplot
 import numpy
 import pandas
 
 # project imports
+from bootstrap import bootstrap_confidence_intervals, bootstrap_paired_differences
+from figure_pipeline import render_figures
+from profiling import Profiler
 from question_data import parse_question_source
+from results_cube import (
+    cube_session_count,
+    cube_total,
+    filter_cube,
+    load_results_cube,
+    rollup_cube,
+)
+from response_matrix import (
+    get_agreement_matrix,
+    get_majority_accuracy,
+    get_question_difficulty,
+    load_response_matrix,
+)
+from results_warehouse import connect_warehouse, get_warehouse_path, query_results_cube
+from significance import paired_significance_matrices
+
+# matplotlib is loaded lazily through setup_matplotlib()
+if TYPE_CHECKING:
+    import matplotlib.pyplot
 
 DATA_PATH = Path(os.getcwd()).parent / "data"
 RESULTS_PATH = Path(os.getcwd()).parent / "results"
 
-# add this path to the matplotlib font manager
-# add all fonts under ~/.local/share/fonts/ to the matplotlib font manager
-for font_file in Path("~/.local/share/fonts/").rglob("*.ttf"):
-    matplotlib.font_manager.fontManager.addfont(font_file)
+# user fonts to register with matplotlib
+USER_FONT_PATH = Path("~/.local/share/fonts/").expanduser()
 
-# set /usr/share/fonts/truetype/noto/NotoSerif-SemiCondensedThin.ttf as default font
-matplotlib.font_manager.fontManager.addfont(
-    Path("/usr/share/fonts/truetype/noto/NotoSerif-SemiCondensed.ttf")
-)
-matplotlib.rcParams["font.family"] = "Noto Serif"
-matplotlib.rcParams.update({"font.size": 14})
+# default serif font for all figures
+DEFAULT_FONT_PATH = Path("/usr/share/fonts/truetype/noto/NotoSerif-SemiCondensed.ttf")
+
+
+@functools.cache
+def setup_matplotlib():
+    """Import matplotlib and register the figure fonts on first use, then return the
+    matplotlib package with pyplot loaded.  Walking the font directories is slow, so this
+    is deferred until a figure is actually drawn rather than done at import time.
+    """
+    import matplotlib.font_manager
+    import matplotlib.pyplot
+
+    # add all fonts under ~/.local/share/fonts/ to the matplotlib font manager
+    for font_file in USER_FONT_PATH.rglob("*.ttf"):
+        matplotlib.font_manager.fontManager.addfont(font_file)
+
+    # set /usr/share/fonts/truetype/noto/NotoSerif-SemiCondensed.ttf as default font
+    if DEFAULT_FONT_PATH.exists():
+        matplotlib.font_manager.fontManager.addfont(DEFAULT_FONT_PATH)
+    matplotlib.rcParams["font.family"] = "Noto Serif"
+    matplotlib.rcParams.update({"font.size": 14})
 
+    return matplotlib
 
-def plot_accuracy_bar_chart(session_df: pandas.DataFrame) -> matplotlib.pyplot.Figure:
+
+def plot_accuracy_bar_chart(cube: pandas.DataFrame) -> "matplotlib.pyplot.Figure":
     """Plot the accuracy bar chart comparing the best model against the baseline
-    guess rate."""
+    guess rate from the results cube."""
+    matplotlib = setup_matplotlib()
 
     # set the font size to 14
     matplotlib.pyplot.rcParams["font.size"] = 12
@@ -61,20 +101,15 @@ def plot_accuracy_bar_chart(session_df: pandas.DataFrame) -> matplotlib.pyplot.F
     matplotlib.pyplot.rcParams["grid.color"] = "#343434"
 
     # get the accuracy by section and SEM
-    correct_by_section_mean = session_df.groupby("question_section")[
-        "is_correct"
-    ].mean()
-    correct_by_section_sem = session_df.groupby("question_section")["is_correct"].sem()
+    section_df = rollup_cube(cube, ["question_section"])
+    correct_by_section_mean = section_df["is_correct"]
+    correct_by_section_sem = section_df["is_correct_sem"]
 
     categories = list(correct_by_section_mean.index)
 
     # get top two correct rate and SEM
-    t2_correct_by_section_mean = session_df.groupby("question_section")[
-        "is_top_two_correct"
-    ].mean()
-    t2_correct_by_section_sem = session_df.groupby("question_section")[
-        "is_top_two_correct"
-    ].sem()
+    t2_correct_by_section_mean = section_df["is_top_two_correct"]
+    t2_correct_by_section_sem = section_df["is_top_two_correct_sem"]
 
     # get the baseline guess rate
     baseline_guess_rate = 0.25
@@ -227,10 +262,11 @@ def plot_accuracy_bar_chart(session_df: pandas.DataFrame) -> matplotlib.pyplot.F
 
 
 def plot_accuracy_bar_chart_progression(
-    all_exam_df: pandas.DataFrame,
-) -> matplotlib.pyplot.Figure:
+    all_cube: pandas.DataFrame,
+) -> "matplotlib.pyplot.Figure":
     """PLot the progression of model performance across model_name values
-    in ascending performance order."""
+    in ascending performance order from the results cube."""
+    matplotlib = setup_matplotlib()
 
     # create a new figure
     matplotlib.pyplot.figure(figsize=(8, 6))
@@ -263,14 +299,14 @@ def plot_accuracy_bar_chart_progression(
         pad=20,
     )
 
-    # get values
-    model_performance = all_exam_df.groupby("model_name")["is_correct"].mean()
+    # get values with bootstrap confidence intervals
+    model_performance_df = bootstrap_confidence_intervals(all_cube, ["model_name"])
 
     # add gpt-2 as 0
-    model_performance["GPT-2"] = 0.0
+    model_performance_df.loc["GPT-2"] = 0.0
 
     # cleanup titles
-    model_performance.index = [
+    model_performance_df.index = [
         "ada-001",
         "babbage-001",
         "curie-001",
@@ -280,7 +316,16 @@ def plot_accuracy_bar_chart_progression(
     ]
 
     # sort the model performance by value
-    model_performance = model_performance.sort_values()
+    model_performance_df = model_performance_df.sort_values("is_correct")
+    model_performance = model_performance_df["is_correct"]
+
+    # get the asymmetric error bars from the confidence intervals
+    model_performance_err = numpy.array(
+        [
+            model_performance - model_performance_df["is_correct_ci_low"],
+            model_performance_df["is_correct_ci_high"] - model_performance,
+        ]
+    )
 
     # set the y ticks in percentages by 10% and add grid lines
     matplotlib.pyplot.yticks(
@@ -307,7 +352,14 @@ def plot_accuracy_bar_chart_progression(
         model_performance,
         color="#F6A6A6",
         label="Model Performance",
+        yerr=model_performance_err,
         capsize=10,
+        error_kw={
+            "elinewidth": 1,
+            "capthick": 1,
+            "ecolor": "#787878",
+            "alpha": 0.5,
+        },
     )
 
     # do the same thing between x=0 and x=1 for Q1 2019
@@ -367,20 +419,34 @@ def plot_accuracy_bar_chart_progression(
 
 
 if __name__ == "__main__":
+    # profile the run if CPA_EXAM_PROFILE is set
+    profiler = Profiler("results_assessment_2", RESULTS_PATH / "questions-02").start()
+
     # load the questions
+    profiler.start_stage("parse")
     question_list = parse_question_source(DATA_PATH / "questions_02.txt")
 
-    # load the exam result data
-    exam_df = pandas.read_csv(
-        RESULTS_PATH / "questions-02" / "sessions-001" / "exam_results.csv",
-        low_memory=False,
-    )
-    old_exam_df = pandas.read_csv(
-        RESULTS_PATH / "questions-02" / "sessions-002" / "exam_results.csv",
-        low_memory=False,
-    )
+    # load the aggregate cubes for the exam result data, aggregating in the warehouse if the
+    # sessions have been ingested, else building them from the CSVs if needed
+    profiler.start_stage("load")
+    warehouse_path = get_warehouse_path(RESULTS_PATH / "questions-02")
+    if warehouse_path.exists():
+        warehouse_connection = connect_warehouse(warehouse_path)
+        exam_cube = query_results_cube(warehouse_connection, session_group="sessions-001")
+        old_exam_cube = query_results_cube(
+            warehouse_connection, session_group="sessions-002"
+        )
+        warehouse_connection.close()
+    else:
+        exam_cube = load_results_cube(
+            RESULTS_PATH / "questions-02" / "sessions-001" / "exam_results.csv"
+        )
+        old_exam_cube = load_results_cube(
+            RESULTS_PATH / "questions-02" / "sessions-002" / "exam_results.csv"
+        )
 
     # calculate the baseline multiple choice rate by averaging 1/N, N=len(choices)
+    profiler.start_stage("analyze")
     multiple_choice_counts = []
     for question in question_list:
         if question["question_type"] == "multiple_choice":
@@ -388,17 +454,15 @@ if __name__ == "__main__":
 
     # print key stats on counts
     print(f"Questions: {len(question_list)}")
-    print(f"Exam Data: {exam_df.shape}")
-    print(f"Old Model Exam Data: {old_exam_df.shape}")
+    print(f"Exam Data: {exam_cube['count'].sum()}")
+    print(f"Old Model Exam Data: {old_exam_cube['count'].sum()}")
 
     # get the number of unique sessions for both new and old
-    session_count = exam_df["session_name"].unique()
-    old_session_count = old_exam_df["session_name"].unique()
-    print(f"Sessions: {len(session_count)}")
-    print(f"Old Model Sessions: {len(old_session_count)}")
+    print(f"Sessions: {cube_session_count(exam_cube)}")
+    print(f"Old Model Sessions: {cube_session_count(old_exam_cube)}")
 
     # get performance by prompt
-    prompt_performance = exam_df.groupby("prompt_method")["is_correct"].mean()
+    prompt_performance = rollup_cube(exam_cube, ["prompt_method"])["is_correct"]
 
     # performance by prompts print
     print("\nPrompt Performance:")
@@ -412,8 +476,7 @@ if __name__ == "__main__":
 
     # get the performance by prompt and temperature
     performance_prompt_temp_df = (
-        exam_df.groupby(["prompt_method", "temperature"])["is_correct"]
-        .mean()
+        rollup_cube(exam_cube, ["prompt_method", "temperature"])["is_correct"]
         .reset_index()
         .sort_values("is_correct", ascending=False)
     )
@@ -426,32 +489,48 @@ if __name__ == "__main__":
     print(f"Worst Prompt: {performance_prompt_temp_df.iloc[-1]['prompt_method']}")
     print(f"Worst Temperature: {performance_prompt_temp_df.iloc[-1]['temperature']}")
 
-    # get the subset of exam_df for best prompt and temp
-    best_exam_df = exam_df[
-        (exam_df["prompt_method"] == best_prompt)
-        & (exam_df["temperature"] == best_temp)
+    # compare the best prompt and temperature against every other pair on the same questions
+    paired_df = bootstrap_paired_differences(exam_cube, ["prompt_method", "temperature"])
+    best_key = (best_prompt, best_temp)
+    best_paired_df = paired_df[
+        (paired_df["group_a"] == best_key) | (paired_df["group_b"] == best_key)
     ]
+    print("\nBest Prompt/Temperature Paired Bootstrap Comparisons:")
+    print(best_paired_df.sort_values("p_value").to_string(index=False))
+
+    # get the subset of the cube for best prompt and temp
+    best_exam_cube = filter_cube(
+        exam_cube, prompt_method=best_prompt, temperature=best_temp
+    )
 
     print(f"Best Correct / Top Two Correct:")
-    print(best_exam_df["is_correct"].mean())
-    print(best_exam_df["is_top_two_correct"].mean())
+    print(cube_total(best_exam_cube, "is_correct"))
+    print(cube_total(best_exam_cube, "is_top_two_correct"))
 
-    # get the accuracy by section for this data
-    best_performance_section_df = best_exam_df.groupby(["question_section"])[
-        "is_correct"
-    ].mean()
+    # get the accuracy by section for this data with bootstrap confidence intervals
+    best_performance_section_df = bootstrap_confidence_intervals(
+        best_exam_cube, ["question_section"]
+    )
     print("\nBest Model by Section:")
     print(
         pandas.DataFrame(
-            (100.0 * best_performance_section_df).sort_values(ascending=False)
+            (100.0 * best_performance_section_df).sort_values(
+                "is_correct", ascending=False
+            )
         ).style.to_latex()
     )
     print()
 
     # now print with both is_correct and is_top_two_correct combined
-    best_performance_section_df = best_exam_df.groupby(["question_section"])[
-        "is_correct", "is_top_two_correct"
-    ].mean()
+    best_performance_section_df = pandas.concat(
+        [
+            bootstrap_confidence_intervals(best_exam_cube, ["question_section"]),
+            bootstrap_confidence_intervals(
+                best_exam_cube, ["question_section"], measure="is_top_two_correct"
+            ),
+        ],
+        axis=1,
+    )
     print("\nBest Model by Section (with top two):")
     print(
         pandas.DataFrame(
@@ -462,25 +541,78 @@ if __name__ == "__main__":
     )
 
     # get the headline accuracy rate for old and new data by model name
-    all_exam_df = pandas.concat([exam_df, old_exam_df])
-    performance_by_model = all_exam_df.groupby("model_name")["is_correct"].mean()
+    all_exam_cube = pandas.concat([exam_cube, old_exam_cube], ignore_index=True)
+    performance_by_model = bootstrap_confidence_intervals(all_exam_cube, ["model_name"])
     print("\nPerformance by Model:")
     print(
         pandas.DataFrame(
-            (100.0 * performance_by_model).sort_values(ascending=False)
+            (100.0 * performance_by_model).sort_values("is_correct", ascending=False)
         ).style.to_latex()
     )
     print()
 
-    # generate a bar chart of the best model performance by section
-    f = plot_accuracy_bar_chart(exam_df)
+    # majority vote, agreement, and difficulty across the best prompt and temperature sessions
+    profiler.start_stage("matrix")
+    response_matrix = load_response_matrix(RESULTS_PATH / "questions-02" / "sessions-001")
+    best_response_matrix = response_matrix.select_sessions(
+        (response_matrix.prompt_methods == best_prompt)
+        & (response_matrix.temperatures == best_temp)
+    )
+    print(
+        f"Majority Vote Across Best Sessions: {get_majority_accuracy(best_response_matrix):.2%}"
+    )
+    agreement_matrix = get_agreement_matrix(best_response_matrix)
+    session_pairs = numpy.triu_indices(len(agreement_matrix), k=1)
+    if len(session_pairs[0]) > 0:
+        print(
+            "Mean Pairwise Answer Agreement: "
+            f"{numpy.nanmean(agreement_matrix[session_pairs]):.2%}"
+        )
+
+    # sign test every prompt and temperature pair on the same questions, Holm corrected
+    difference_df, p_value_df = paired_significance_matrices(
+        response_matrix, ["prompt_methods", "temperatures"], correction="holm"
+    )
+    if best_key in p_value_df.index:
+        best_significance_df = pandas.DataFrame(
+            {
+                "difference": difference_df.loc[best_key],
+                "p_value": p_value_df.loc[best_key],
+            }
+        ).drop(index=[best_key])
+        num_significant = int((best_significance_df["p_value"] < 0.05).sum())
+        print(
+            f"\nBest Prompt/Temperature Sign Tests (Holm): {num_significant} of "
+            f"{len(best_significance_df)} others significantly different at 0.05"
+        )
+        print(best_significance_df.sort_values("p_value").to_string())
+    print()
 
-    # save the pdf and png
-    f.savefig("best_model_performance_by_section.pdf", dpi=300)
-    f.savefig("best_model_performance_by_section.png", dpi=300)
+    question_difficulty = get_question_difficulty(response_matrix)
+    print("Hardest Questions:")
+    for question_index in numpy.argsort(-numpy.nan_to_num(question_difficulty))[:10]:
+        print(
+            f"  {response_matrix.question_ids[question_index]}: "
+            f"{question_difficulty[question_index]:.2%} wrong"
+        )
+    print()
 
-    # get the progression bar chart
-    f = plot_accuracy_bar_chart_progression(all_exam_df)
-    f.savefig("model_progression.pdf", dpi=300)
-    f.savefig("model_progression.png", dpi=300)
-    f.show()
+    # render the figures in parallel, skipping any whose aggregates and style are unchanged
+    profiler.start_stage("render")
+    rendered_files = render_figures(
+        [
+            {
+                "name": "best_model_performance_by_section",
+                "function": "results_assessment_2.plot_accuracy_bar_chart",
+                "data": exam_cube,
+            },
+            {
+                "name": "model_progression",
+                "function": "results_assessment_2.plot_accuracy_bar_chart_progression",
+                "data": all_exam_cube,
+            },
+        ],
+        Path(os.getcwd()),
+    )
+    print(f"Rendered {len(rendered_files)} figure files")
+    profiler.stop()
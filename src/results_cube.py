@@ -0,0 +1,152 @@
+"""
+Build, persist, and query a pre-aggregated "cube" of scored exam results.
+
+The scored exam CSV has one row per (session, question).  Every table and figure in the
+analysis scripts is a grouped mean over some subset of the session parameters and question
+fields, so we aggregate the full CSV once into counts and correct sums at the finest grain
+we ever group by:
+    - model_name, prompt_method, temperature, best_of (session parameters)
+    - question_section, question_number (question fields)
+
+Any coarser table is then a sum over this cube, which is a few thousand rows regardless of
+how many sessions were scored.  Sessions run with n > 1 have one row per sample, so each cell
+also counts its first samples, i.e., the sessions that asked the question.
+"""
+
+# imports
+from pathlib import Path
+
+# packages
+import pandas
+
+# the dimensions of the cube in the order they are stored
+CUBE_DIMENSIONS = [
+    "model_name",
+    "prompt_method",
+    "temperature",
+    "best_of",
+    "question_section",
+    "question_number",
+]
+
+# the boolean score columns that are summed into the cube
+CUBE_MEASURES = [
+    "is_correct",
+    "is_top_two_correct",
+    "is_top_three_correct",
+]
+
+
+def build_results_cube(exam_df: pandas.DataFrame) -> pandas.DataFrame:
+    """Aggregate a scored exam dataframe into a cube with one row per dimension combination
+    and the following columns:
+        - count: number of scored responses, counting every sample
+        - num_sessions: number of sessions that asked the question, i.e., first samples
+        - <measure>_sum: number of responses where the measure is true
+    """
+    # cast the measures to int so that sums are counts
+    measure_df = exam_df[CUBE_DIMENSIONS].copy()
+    for measure in CUBE_MEASURES:
+        measure_df[f"{measure}_sum"] = exam_df[measure].astype(bool).astype(int)
+    if "sample_index" in exam_df.columns:
+        measure_df["num_sessions"] = (exam_df["sample_index"] == 0).astype(int)
+    else:
+        measure_df["num_sessions"] = 1
+
+    # aggregate in a single groupby pass, keeping missing sections and model names
+    cube = (
+        measure_df.groupby(CUBE_DIMENSIONS, dropna=False, sort=True)
+        .agg(
+            count=(f"{CUBE_MEASURES[0]}_sum", "size"),
+            num_sessions=("num_sessions", "sum"),
+            **{
+                f"{measure}_sum": (f"{measure}_sum", "sum")
+                for measure in CUBE_MEASURES
+            },
+        )
+        .reset_index()
+    )
+
+    return cube
+
+
+def rollup_cube(cube: pandas.DataFrame, dimensions: list[str]) -> pandas.DataFrame:
+    """Roll the cube up to the given dimensions and return a dataframe indexed by them with
+    the count, the correct sums, the mean rate for each measure (named after the measure, e.g.,
+    is_correct), and the standard error of the mean rate (e.g., is_correct_sem).
+    """
+    sum_columns = ["count"] + [f"{measure}_sum" for measure in CUBE_MEASURES]
+    rollup_df = cube.groupby(dimensions)[sum_columns].sum()
+
+    for measure in CUBE_MEASURES:
+        rate = rollup_df[f"{measure}_sum"] / rollup_df["count"]
+        rollup_df[measure] = rate
+        # sample standard error of a binary mean, matching pandas .sem() with ddof=1
+        rollup_df[f"{measure}_sem"] = (
+            rate * (1.0 - rate) / (rollup_df["count"] - 1)
+        ) ** 0.5
+
+    return rollup_df
+
+
+def cube_total(cube: pandas.DataFrame, measure: str = "is_correct") -> float:
+    """Return the overall mean rate for a measure across the whole cube."""
+    return cube[f"{measure}_sum"].sum() / cube["count"].sum()
+
+
+def cube_session_count(cube: pandas.DataFrame) -> int:
+    """Return the number of sessions in the cube; each session answers every question, so
+    this is the largest per-question session count within each parameter combination.  The
+    response count is only used for cubes saved before sessions were counted, which had one
+    sample per question.
+    """
+    session_dimensions = [
+        dimension
+        for dimension in CUBE_DIMENSIONS
+        if dimension not in ("question_section", "question_number")
+    ]
+    return int(
+        cube.groupby(session_dimensions, dropna=False)[
+            "num_sessions" if "num_sessions" in cube.columns else "count"
+        ]
+        .max()
+        .sum()
+    )
+
+
+def filter_cube(cube: pandas.DataFrame, **dimension_values) -> pandas.DataFrame:
+    """Return the subset of the cube matching all of the given dimension values, e.g.,
+    filter_cube(cube, prompt_method="generate_prompt_018", temperature=0.0)
+    """
+    mask = pandas.Series(True, index=cube.index)
+    for dimension, value in dimension_values.items():
+        mask &= cube[dimension] == value
+    return cube.loc[mask]
+
+
+def get_cube_path(results_csv_path: Path) -> Path:
+    """Return the path of the cube stored alongside a scored results CSV."""
+    return results_csv_path.with_name(results_csv_path.stem + "_cube.csv")
+
+
+def load_results_cube(results_csv_path: Path) -> pandas.DataFrame:
+    """Load the cube for a scored results CSV, rebuilding and saving it first if it does not
+    exist or is older than the CSV.
+    """
+    cube_path = get_cube_path(results_csv_path)
+
+    # rebuild if the scored results changed since the cube was written
+    if (
+        not cube_path.exists()
+        or cube_path.stat().st_mtime < results_csv_path.stat().st_mtime
+    ):
+        exam_df = pandas.read_csv(
+            results_csv_path,
+            usecols=lambda column: column in CUBE_DIMENSIONS + CUBE_MEASURES + ["sample_index"],
+            low_memory=False,
+        )
+        cube = build_results_cube(exam_df)
+        cube.to_csv(cube_path, index=False)
+        return cube
+
+    return pandas.read_csv(cube_path)
@@ -0,0 +1,610 @@
+"""
+Ingest scored exam sessions into a local SQLite warehouse and query them without loading every
+session or the full results CSV into memory.
+
+The warehouse has normalized tables for questions, parameter sets, sessions, and responses:
+    - questions: one row per (question_set, question_section, question_number)
+    - parameter_sets: one row per distinct set of completion parameters
+    - sessions: one row per session directory, with the model, prompt, and parameter set
+    - responses: one row per scored (session, question, sample), as from score_exam_records
+
+A full-text index over each response's explanation, its references section, and the
+citations to authority extracted from both is kept in step with the responses table, so it is
+updated incrementally as sessions are ingested.
+
+Sessions are grouped by the directory they were stored in, e.g., "sessions-001", and are only
+re-ingested when the exam_data.json or archive they were read from changes; sessions deleted
+from the group directory are removed from the warehouse.  Queries take filters on the session,
+parameter, and question columns, e.g.:
+    query_responses(connection, model_name="text-davinci-003", question_section="REG")
+    query_results_cube(connection, session_group="sessions-001")
+    search_responses(connection, get_citation_query("IRC 1031"), is_correct=False)
+"""
+
+# imports
+import json
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+# packages are imported where they are used so that ingestion starts quickly
+if TYPE_CHECKING:
+    import pandas
+
+# project imports
+from results_cube import CUBE_MEASURES
+from score_exam import extract_citations, extract_references, score_exam_records
+from session_archive import get_archive_paths, read_session_archive
+
+RESULTS_PATH = Path(__file__).parent.parent / "results"
+
+# warehouse file name, stored in the question set results directory
+WAREHOUSE_NAME = "exam_results.sqlite"
+
+# completion parameters stored in the parameter_sets table
+PARAMETER_COLUMNS = [
+    "temperature",
+    "max_tokens",
+    "top_p",
+    "best_of",
+    "frequency_penalty",
+    "presence_penalty",
+]
+
+# scored record columns stored in the responses table
+RESPONSE_COLUMNS = [
+    "sample_index",
+    "model_answer",
+    "model_second_answer",
+    "model_third_answer",
+    "model_explanation",
+    "majority_answer",
+    "is_correct",
+    "is_second_correct",
+    "is_third_correct",
+    "is_top_two_correct",
+    "is_top_three_correct",
+    "is_majority_correct",
+    "queue_wait",
+    "http_latency",
+    "total_latency",
+    "retries",
+    "prompt_tokens",
+    "completion_tokens",
+    "tokens_per_second",
+]
+
+WAREHOUSE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    question_id INTEGER PRIMARY KEY,
+    question_set TEXT,
+    question_section TEXT,
+    question_number INTEGER,
+    question_type TEXT,
+    question TEXT,
+    correct_answer TEXT
+);
+CREATE TABLE IF NOT EXISTS parameter_sets (
+    parameter_id INTEGER PRIMARY KEY,
+    temperature REAL,
+    max_tokens INTEGER,
+    top_p REAL,
+    best_of INTEGER,
+    frequency_penalty REAL,
+    presence_penalty REAL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY,
+    session_group TEXT NOT NULL,
+    session_name TEXT NOT NULL,
+    question_set TEXT,
+    model_name TEXT,
+    prompt_method TEXT,
+    scoring_mode TEXT,
+    parameter_id INTEGER REFERENCES parameter_sets (parameter_id),
+    start_time TEXT,
+    end_time TEXT,
+    duration REAL,
+    source_path TEXT,
+    source_mtime REAL,
+    UNIQUE (session_group, session_name)
+);
+CREATE TABLE IF NOT EXISTS responses (
+    response_id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (session_id),
+    question_id INTEGER NOT NULL REFERENCES questions (question_id),
+    question_position INTEGER NOT NULL,
+    sample_index INTEGER NOT NULL,
+    model_answer TEXT,
+    model_second_answer TEXT,
+    model_third_answer TEXT,
+    model_explanation TEXT,
+    majority_answer TEXT,
+    is_correct INTEGER,
+    is_second_correct INTEGER,
+    is_third_correct INTEGER,
+    is_top_two_correct INTEGER,
+    is_top_three_correct INTEGER,
+    is_majority_correct INTEGER,
+    queue_wait REAL,
+    http_latency REAL,
+    total_latency REAL,
+    retries INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    tokens_per_second REAL,
+    UNIQUE (session_id, question_position, sample_index)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS response_search USING fts5 (
+    explanation,
+    reference_text,
+    citations,
+    tokenize = 'porter unicode61'
+);
+CREATE INDEX IF NOT EXISTS questions_key_index
+    ON questions (question_set, question_section, question_number);
+CREATE INDEX IF NOT EXISTS questions_section_index ON questions (question_section);
+CREATE INDEX IF NOT EXISTS sessions_model_index ON sessions (model_name);
+CREATE INDEX IF NOT EXISTS sessions_prompt_index ON sessions (prompt_method);
+CREATE INDEX IF NOT EXISTS sessions_parameter_index ON sessions (parameter_id);
+CREATE INDEX IF NOT EXISTS responses_question_index ON responses (question_id);
+"""
+
+# the column behind each query filter
+FILTER_COLUMNS = {
+    "session_group": "s.session_group",
+    "session_name": "s.session_name",
+    "question_set": "s.question_set",
+    "model_name": "s.model_name",
+    "prompt_method": "s.prompt_method",
+    "scoring_mode": "s.scoring_mode",
+    "temperature": "p.temperature",
+    "max_tokens": "p.max_tokens",
+    "top_p": "p.top_p",
+    "best_of": "p.best_of",
+    "frequency_penalty": "p.frequency_penalty",
+    "presence_penalty": "p.presence_penalty",
+    "question_section": "q.question_section",
+    "question_number": "q.question_number",
+    "question_type": "q.question_type",
+    "sample_index": "r.sample_index",
+    "is_correct": "r.is_correct",
+}
+
+# the joined tables behind every query
+QUERY_TABLES = """
+    responses r
+    JOIN sessions s ON s.session_id = r.session_id
+    JOIN parameter_sets p ON p.parameter_id = s.parameter_id
+    JOIN questions q ON q.question_id = r.question_id
+"""
+
+
+def get_warehouse_path(question_set_path: Path = RESULTS_PATH / "questions-02") -> Path:
+    """Return the path of the warehouse for a question set results directory."""
+    return question_set_path / WAREHOUSE_NAME
+
+
+def connect_warehouse(warehouse_path: Path) -> sqlite3.Connection:
+    """Open the warehouse, creating its tables and indexes if needed."""
+    connection = sqlite3.connect(warehouse_path)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(WAREHOUSE_SCHEMA)
+    return connection
+
+
+def get_or_create_row(
+    connection: sqlite3.Connection, table: str, key_column: str, values: dict
+) -> int:
+    """Return the key of the row in the table matching all values, inserting it first if
+    there is none.  Missing values match with IS so that NULLs compare equal."""
+    columns = list(values)
+    row = connection.execute(
+        f"SELECT {key_column} FROM {table} WHERE "
+        + " AND ".join(f"{column} IS ?" for column in columns),
+        [values[column] for column in columns],
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    return connection.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [values[column] for column in columns],
+    ).lastrowid
+
+
+def delete_session_responses(connection: sqlite3.Connection, session_id: int) -> None:
+    """Remove the responses of a session and their search index entries."""
+    # the search index rowids are the response_id of the responses they index
+    connection.execute(
+        "DELETE FROM response_search WHERE rowid IN "
+        "(SELECT response_id FROM responses WHERE session_id = ?)",
+        (session_id,),
+    )
+    connection.execute("DELETE FROM responses WHERE session_id = ?", (session_id,))
+
+
+def ingest_session(
+    connection: sqlite3.Connection,
+    session_group: str,
+    session_name: str,
+    exam_data: dict,
+    exam_records: list[dict] | None = None,
+    source_path: str | None = None,
+    source_mtime: float | None = None,
+) -> int:
+    """Store a session and its scored records in the warehouse, replacing any earlier copy of
+    the same session, and return the number of responses stored.  The records are scored from
+    the session data if they are not given, and the file the session was read from, relative
+    to the session group directory, is stored with its modification time."""
+    if exam_records is None:
+        exam_records = score_exam_records(exam_data)
+
+    parameters = exam_data.get("parameters", {})
+    parameter_id = get_or_create_row(
+        connection,
+        "parameter_sets",
+        "parameter_id",
+        {column: parameters.get(column) for column in PARAMETER_COLUMNS},
+    )
+
+    session_values = {
+        "question_set": exam_data.get("question_set"),
+        "model_name": exam_data.get("model_name"),
+        "prompt_method": exam_data.get("prompt_method"),
+        "scoring_mode": exam_data.get("scoring_mode", "completion"),
+        "parameter_id": parameter_id,
+        "start_time": exam_data.get("start_time"),
+        "end_time": exam_data.get("end_time"),
+        "duration": exam_records[0]["duration"] if len(exam_records) > 0 else None,
+        "source_path": source_path,
+        "source_mtime": source_mtime,
+    }
+    session_id = connection.execute(
+        f"""
+        INSERT INTO sessions (session_group, session_name, {', '.join(session_values)})
+        VALUES (?, ?, {', '.join('?' * len(session_values))})
+        ON CONFLICT (session_group, session_name) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in session_values)}
+        RETURNING session_id
+        """,
+        [session_group, session_name, *session_values.values()],
+    ).fetchone()[0]
+    delete_session_responses(connection, session_id)
+
+    # look up each question once per session
+    question_ids = []
+    for question in exam_data["questions"]:
+        question_input = question["question_input"]
+        question_ids.append(
+            get_or_create_row(
+                connection,
+                "questions",
+                "question_id",
+                {
+                    "question_set": exam_data.get("question_set"),
+                    "question_section": question_input.get("question_section"),
+                    "question_number": question_input.get("question_number"),
+                    "question_type": question_input.get("question_type"),
+                    "question": question_input.get("question"),
+                    "correct_answer": json.dumps(question_input.get("answer")),
+                },
+            )
+        )
+
+    # records are numbered by their position in the session
+    connection.executemany(
+        f"""
+        INSERT INTO responses
+            (session_id, question_id, question_position, {', '.join(RESPONSE_COLUMNS)})
+        VALUES (?, ?, ?, {', '.join('?' * len(RESPONSE_COLUMNS))})
+        """,
+        [
+            (
+                session_id,
+                question_ids[record["question_number"] - 1],
+                record["question_number"],
+                *(record[column] for column in RESPONSE_COLUMNS),
+            )
+            for record in exam_records
+        ],
+    )
+
+    index_session_text(connection, session_id, exam_data)
+
+    return len(exam_records)
+
+
+def get_response_text(question: dict, sample_index: int) -> str | None:
+    """Return the text of one sample of a question's response, if any."""
+    try:
+        return question["model_response"]["choices"][sample_index]["text"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def index_session_text(
+    connection: sqlite3.Connection, session_id: int, exam_data: dict
+) -> None:
+    """Add the explanations, references, and citations of a session's stored responses to
+    the full-text search index."""
+    search_rows = []
+    for row in connection.execute(
+        """
+        SELECT response_id, question_position, sample_index, model_explanation
+        FROM responses WHERE session_id = ?
+        """,
+        (session_id,),
+    ):
+        response_text = get_response_text(
+            exam_data["questions"][row["question_position"] - 1], row["sample_index"]
+        )
+        reference_text = extract_references(response_text)
+        citations = extract_citations(
+            " ".join(filter(None, [row["model_explanation"], reference_text]))
+        )
+        if row["model_explanation"] is None and reference_text is None:
+            continue
+        search_rows.append(
+            (row["response_id"], row["model_explanation"], reference_text, "; ".join(citations))
+        )
+
+    connection.executemany(
+        """
+        INSERT INTO response_search (rowid, explanation, reference_text, citations)
+        VALUES (?, ?, ?, ?)
+        """,
+        search_rows,
+    )
+
+
+def ingest_sessions(connection: sqlite3.Connection, session_group_path: Path) -> list[str]:
+    """Ingest every session under a session group directory whose exam_data.json or archive
+    is new or changed since it was last ingested, remove the sessions that are no longer in the
+    directory, and return the names of the ingested sessions.  A session directory takes
+    precedence over an archived copy of the session."""
+    session_group = session_group_path.name
+    ingested_session_ids = {}
+    ingested_sources = {}
+    for row in connection.execute(
+        "SELECT session_id, session_name, source_path, source_mtime FROM sessions "
+        "WHERE session_group = ?",
+        (session_group,),
+    ):
+        ingested_session_ids[row["session_name"]] = row["session_id"]
+        ingested_sources[row["session_name"]] = (row["source_path"], row["source_mtime"])
+
+    ingested_session_names = []
+    session_directory_names = set()
+    for exam_path in sorted(session_group_path.iterdir()):
+        exam_json_path = exam_path / "exam_data.json"
+        if not exam_json_path.exists():
+            continue
+        session_directory_names.add(exam_path.name)
+
+        # skip sessions that have not changed
+        source_path = f"{exam_path.name}/exam_data.json"
+        source_mtime = exam_json_path.stat().st_mtime
+        if ingested_sources.get(exam_path.name) == (source_path, source_mtime):
+            continue
+
+        with open(exam_json_path, "r") as exam_json_file:
+            exam_data = json.load(exam_json_file)
+        with connection:
+            ingest_session(
+                connection,
+                session_group,
+                exam_path.name,
+                exam_data,
+                source_path=source_path,
+                source_mtime=source_mtime,
+            )
+        ingested_session_names.append(exam_path.name)
+
+    # archived sessions share the archive's modification time, so an unchanged archive can be
+    # skipped without reading it, unless a session was ingested from a directory that has since
+    # been removed and may only be left in the archive
+    archive_paths = get_archive_paths(session_group_path)
+    archive_names = {archive_path.name for archive_path in archive_paths}
+    has_removed_directories = any(
+        session_name not in session_directory_names and source_path not in archive_names
+        for session_name, (source_path, _) in ingested_sources.items()
+    )
+    archived_session_names = set()
+    for archive_path in archive_paths:
+        source_mtime = archive_path.stat().st_mtime
+        unchanged_session_names = {
+            session_name
+            for session_name, source in ingested_sources.items()
+            if source == (archive_path.name, source_mtime)
+        }
+        if len(unchanged_session_names) > 0 and not has_removed_directories:
+            archived_session_names.update(unchanged_session_names)
+            continue
+
+        for session_name, exam_data in read_session_archive(archive_path):
+            # the first copy of a session is kept, from its directory or an earlier archive
+            if session_name in session_directory_names or session_name in archived_session_names:
+                continue
+            archived_session_names.add(session_name)
+            if session_name in unchanged_session_names:
+                continue
+            with connection:
+                ingest_session(
+                    connection,
+                    session_group,
+                    session_name,
+                    exam_data,
+                    source_path=archive_path.name,
+                    source_mtime=source_mtime,
+                )
+            ingested_session_names.append(session_name)
+
+    # remove the sessions whose directories and archived copies were deleted
+    for session_name, session_id in ingested_session_ids.items():
+        if session_name in session_directory_names or session_name in archived_session_names:
+            continue
+        with connection:
+            delete_session_responses(connection, session_id)
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    return ingested_session_names
+
+
+def get_filter_clause(
+    filters: dict, conditions: list[str] | None = None, parameters: list | None = None
+) -> tuple[str, list]:
+    """Return a WHERE clause and its parameters for the query filters, after any given
+    conditions and their parameters; a list or tuple value matches any of its values."""
+    conditions = list(conditions or [])
+    parameters = list(parameters or [])
+    for name, value in filters.items():
+        if name not in FILTER_COLUMNS:
+            raise ValueError(f"Unknown filter {name}")
+        column = FILTER_COLUMNS[name]
+        if isinstance(value, (list, tuple)):
+            conditions.append(f"{column} IN ({', '.join('?' * len(value))})")
+            parameters.extend(value)
+        else:
+            conditions.append(f"{column} IS ?")
+            parameters.append(value)
+
+    if len(conditions) == 0:
+        return "", []
+    return "WHERE " + " AND ".join(conditions), parameters
+
+
+def query_responses(connection: sqlite3.Connection, **filters) -> Iterator[dict]:
+    """Yield the scored responses matching the filters one at a time, with the same fields as
+    score_exam_records plus the session group and name."""
+    where_clause, parameters = get_filter_clause(filters)
+    cursor = connection.execute(
+        f"""
+        SELECT
+            s.session_group, s.session_name, s.model_name, s.prompt_method, s.duration,
+            {', '.join(f'p.{column}' for column in PARAMETER_COLUMNS)},
+            q.question_section, q.question_number, q.question_type, q.correct_answer,
+            {', '.join(f'r.{column}' for column in RESPONSE_COLUMNS)}
+        FROM {QUERY_TABLES}
+        {where_clause}
+        ORDER BY s.session_id, r.question_position, r.sample_index
+        """,
+        parameters,
+    )
+    for row in cursor:
+        record = dict(row)
+        record["correct_answer"] = json.loads(record["correct_answer"])
+        yield record
+
+
+def query_results_cube(connection: sqlite3.Connection, **filters) -> "pandas.DataFrame":
+    """Return the results cube for the responses matching the filters, aggregated in SQL.
+    As in the cube built from the results CSV, question_number is the question's position in
+    the session, not its number within its section."""
+    import pandas
+
+    where_clause, parameters = get_filter_clause(filters)
+    return pandas.read_sql_query(
+        f"""
+        SELECT
+            s.model_name, s.prompt_method, p.temperature, p.best_of,
+            q.question_section, r.question_position AS question_number,
+            COUNT(*) AS count,
+            SUM(r.sample_index = 0) AS num_sessions,
+            {', '.join(f'SUM(r.{measure}) AS {measure}_sum' for measure in CUBE_MEASURES)}
+        FROM {QUERY_TABLES}
+        {where_clause}
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        """,
+        connection,
+        params=parameters,
+    )
+
+
+def query_always_wrong_questions(connection: sqlite3.Connection, **filters) -> list[dict]:
+    """Return the questions that no response matching the filters answered correctly, with
+    the number of responses to each, e.g., the questions every davinci-003 prompt gets wrong."""
+    where_clause, parameters = get_filter_clause(filters)
+    return [
+        dict(row)
+        for row in connection.execute(
+            f"""
+            SELECT
+                q.question_set, q.question_section, q.question_number,
+                COUNT(*) AS num_responses
+            FROM {QUERY_TABLES}
+            {where_clause}
+            GROUP BY q.question_id
+            HAVING SUM(r.is_correct) = 0
+            ORDER BY q.question_section, q.question_number
+            """,
+            parameters,
+        )
+    ]
+
+
+def get_citation_query(citation: str) -> str:
+    """Return a full-text query matching responses that cite the given authority, written
+    in any form that extract_citations recognizes, e.g., "IRC § 1031" or "ASC 606"."""
+    canonical_citations = extract_citations(citation)
+    if len(canonical_citations) > 0:
+        citation = canonical_citations[0]
+    return 'citations : "' + citation.replace('"', '""') + '"'
+
+
+def search_responses(
+    connection: sqlite3.Connection, match_query: str, limit: int | None = 100, **filters
+) -> list[dict]:
+    """Return the responses matching an FTS5 query over the explanation, reference_text,
+    and citations columns and the filters, best matches first, with a highlighted snippet
+    of the explanation, e.g.:
+        search_responses(connection, "depreciation NEAR recapture", model_name="text-davinci-003")
+    """
+    where_clause, parameters = get_filter_clause(
+        filters, ["response_search MATCH ?"], [match_query]
+    )
+    return [
+        dict(row)
+        for row in connection.execute(
+            f"""
+            SELECT
+                s.session_group, s.session_name, s.model_name, s.prompt_method,
+                q.question_section, q.question_number, r.sample_index,
+                r.model_answer, r.is_correct,
+                snippet(response_search, 0, '[', ']', '...', 16) AS explanation_snippet,
+                response_search.reference_text, response_search.citations
+            FROM response_search
+            JOIN responses r ON r.response_id = response_search.rowid
+            JOIN sessions s ON s.session_id = r.session_id
+            JOIN parameter_sets p ON p.parameter_id = s.parameter_id
+            JOIN questions q ON q.question_id = r.question_id
+            {where_clause}
+            ORDER BY response_search.rank
+            LIMIT ?
+            """,
+            [*parameters, -1 if limit is None else limit],
+        )
+    ]
+
+
+def main():
+    # ingest every session group for the question set
+    question_set_path = RESULTS_PATH / "questions-02"
+    connection = connect_warehouse(get_warehouse_path(question_set_path))
+    for session_group_path in sorted(question_set_path.iterdir()):
+        if not session_group_path.is_dir():
+            continue
+        ingested_session_names = ingest_sessions(connection, session_group_path)
+        print(f"{session_group_path.name}: ingested {len(ingested_session_names)} sessions")
+
+    # questions that every davinci-003 session gets wrong
+    for question in query_always_wrong_questions(connection, model_name="text-davinci-003"):
+        print(question)
+
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,25 @@ Run a CPA exam session with prompt style 001.
 """
 
 # imports
-import datetime
-import json
-import time
 from pathlib import Path
 from typing import Iterator
 
 # packages
 import openai
-import pandas
-import tqdm
 
 # set the key
 openai.api_key = (Path(__file__).parent / ".openai_key").read_text()
 
 # local imports
-from question_data import parse_question_source
+from exam_session import (
+    create_runner_hedge_policy,
+    get_runner_session_kwargs,
+    load_runner_questions,
+    run_exam_session,
+)
+from few_shot_index import FewShotIndex, get_few_shot_prompt_method
+from profiling import Profiler
+from session_archive import get_archived_session_names
 from prompts import *
 
 
@@ -51,20 +54,21 @@ def get_parameter_sets() -> Iterator[dict]:
                             }
 
 
-def get_next_session_path() -> Path:
-    """Get the next session path."""
+def get_next_session_path(archived_session_names: set[str]) -> Path:
+    """Get the next session path, skipping the names of archived sessions even if their
+    directories were removed."""
     session_number = 1
+    session_group_path = (
+        Path(__file__).parent.parent / "results" / "questions-02" / "sessions-001"
+    )
+    session_group_path.mkdir(exist_ok=True)
 
     while True:
         session_id = f"cpa-exam-{session_number:03d}"
-        session_path = (
-            Path(__file__).parent.parent / "results" / "questions-02" / "sessions-001"
-        )
-        session_path.mkdir(exist_ok=True)
-        session_path = session_path / session_id
+        session_path = session_group_path / session_id
 
-        # skip if exists
-        if session_path.exists():
+        # skip if exists or archived
+        if session_path.exists() or session_id in archived_session_names:
             session_number += 1
             continue
 
@@ -74,14 +78,26 @@ def get_next_session_path() -> Path:
 
 
 def main():
+    # profile the run if CPA_EXAM_PROFILE is set
+    profiler = Profiler(
+        "run_exam", Path(__file__).parent.parent / "results" / "questions-02" / "sessions-001"
+    ).start()
+
     # iterate through questions and generate prompt
+    profiler.start_stage("load")
     question_file = Path(__file__).parent.parent / "data" / "questions_02.txt"
-    question_list = parse_question_source(question_file)
-    question_set_name = question_file.name
+    question_list, question_set_name = load_runner_questions(question_file)
 
     # set samples per value
     num_samples_per_set = 1
 
+    # the scoring mode, streaming, pipeline workers, client, and live metrics are set in
+    # exam_session.py for both runners
+    session_kwargs = get_runner_session_kwargs()
+
+    # optionally duplicate slow requests, as set in exam_session.py
+    hedge_policy = create_runner_hedge_policy()
+
     """
     These prompts are only relevant for the test REG section:
         generate_prompt_001,
@@ -109,100 +125,41 @@ def main():
         generate_prompt_020,
     ]
 
+    # optionally add the few-shot prompt style 022 with the 3 most similar solved questions
+    # from other sections, looked up from a neighbor table computed once for the question
+    # list; it adds a prompt to every parameter set and sample, so it is off unless
+    # include_few_shot_prompt is set
+    include_few_shot_prompt = False
+    if include_few_shot_prompt:
+        few_shot_index = FewShotIndex(question_list, num_neighbors=3, exclude_same_section=True)
+        prompt_list.append(get_few_shot_prompt_method(few_shot_index))
+
+    # load the names of archived sessions once, since reading them decompresses the archive
+    archived_session_names = get_archived_session_names(
+        Path(__file__).parent.parent / "results" / "questions-02" / "sessions-001"
+    )
+
     # iterate through parameter values
+    profiler.start_stage("run")
     for parameter_kwargs in get_parameter_sets():
         for sample_id in range(num_samples_per_set):
             for prompt_method in prompt_list:
                 # set up the session path iteratively
-                session_path = get_next_session_path()
-
-                # status update
-                # print(f"Running with prompt method {str(prompt_method.__name__)}, parameters: {parameter_kwargs}")
-
-                # generate the prompts
-                exam_data = {
-                    "model_name": MODEL_NAME,
-                    "question_set": question_set_name,
-                    "prompt_method": str(prompt_method.__name__),
-                    "parameters": parameter_kwargs,
-                    "start_time": datetime.datetime.now().isoformat(),
-                    "end_time": None,
-                    "questions": [],
-                }
-
-                # iterate through questions and generate prompt
-                question_prog_bar = tqdm.tqdm(question_list, desc="Questions")
-                for question in question_prog_bar:
-                    # set description
-                    question_prog_bar.set_description(
-                        f"Q{question['question_number']}, prompt method {str(prompt_method.__name__)}, parameters: {parameter_kwargs}"
-                    )
-                    # generate the prompt
-                    prompt = prompt_method(question)
-
-                    # setup question data
-                    question_data = {
-                        "question_input": question,
-                        "model_prompt": prompt,
-                        "model_response": None,
-                    }
-
-                    # try to query the API, retry on failure, else log the failed response
-                    try:
-                        question_data["model_response"] = openai.Completion.create(
-                            model=MODEL_NAME,
-                            prompt=question_data["model_prompt"],
-                            **parameter_kwargs,
-                        )
-                    except Exception as e:
-                        question_prog_bar.set_description(
-                            f"First error, retrying in 5: {e}"
-                        )
-                        question_data["model_response"] = None
-
-                        # sleep and retry
-                        time.sleep(5)
-
-                        try:
-                            question_data["model_response"] = openai.Completion.create(
-                                model=MODEL_NAME,
-                                prompt=question_data["model_prompt"],
-                                **parameter_kwargs,
-                            )
-                        except Exception as f:
-                            question_prog_bar.set_description(
-                                f"Second error, retrying in 10: {f}"
-                            )
-                            question_data["model_response"] = None
-
-                            # sleep and retry
-                            time.sleep(10)
-
-                            try:
-                                question_data[
-                                    "model_response"
-                                ] = openai.Completion.create(
-                                    model=MODEL_NAME,
-                                    prompt=question_data["model_prompt"],
-                                    **parameter_kwargs,
-                                )
-                            except Exception as g:
-                                print(f"Third error, skipping question {question}: {g}")
-                                question_data["model_response"] = None
-                    finally:
-                        # log the current state of the exam
-                        exam_data["questions"].append(question_data)
-                        with open(
-                            session_path / "exam_data.json", "wt", encoding="utf-8"
-                        ) as output_file:
-                            json.dump(exam_data, output_file)
-
-                # save final state
-                exam_data["end_time"] = datetime.datetime.now().isoformat()
-                with open(
-                    session_path / "exam_data.json", "wt", encoding="utf-8"
-                ) as output_file:
-                    json.dump(exam_data, output_file)
+                session_path = get_next_session_path(archived_session_names)
+
+                # run the session
+                run_exam_session(
+                    model_name=MODEL_NAME,
+                    prompt_method=prompt_method,
+                    parameter_kwargs=parameter_kwargs,
+                    question_list=question_list,
+                    question_set_name=question_set_name,
+                    session_path=session_path,
+                    hedge_policy=hedge_policy,
+                    **session_kwargs,
+                )
+
+    profiler.stop()
 
 
 if __name__ == "__main__":
@@ -3,24 +3,34 @@ Run a CPA exam session with prompt style 001.
 """
 
 # imports
-import datetime
+import collections
+import functools
 import json
-import time
 from pathlib import Path
 from typing import Iterator
 
 # packages
 import openai
-import pandas
-import tqdm
 
 # set the key
 openai.api_key = (Path(__file__).parent / ".openai_key").read_text()
 
 # local imports
-from question_data import parse_question_source
+from exam_session import (
+    create_runner_hedge_policy,
+    get_runner_session_kwargs,
+    load_runner_questions,
+    run_exam_session,
+)
+from model_scheduler import ModelScheduler
+from profiling import Profiler
+from request_guards import CircuitBreaker, TokenBudget, get_session_charged_tokens
+from session_archive import get_archived_session_names, iter_sessions
 from prompts import *
 
+# session group directory for the old model sessions
+SESSION_GROUP_PATH = Path(__file__).parent.parent / "results" / "questions-02" / "sessions-002"
+
 
 def get_parameter_sets() -> Iterator[dict]:
     """Generate a set of parameter sets."""
@@ -52,20 +62,18 @@ def get_parameter_sets() -> Iterator[dict]:
                             }
 
 
-def get_next_session_path() -> Path:
-    """Get the next session path."""
+def get_next_session_path(archived_session_names: set[str]) -> Path:
+    """Get the next session path, skipping the names of archived sessions even if their
+    directories were removed."""
     session_number = 1
+    SESSION_GROUP_PATH.mkdir(parents=True, exist_ok=True)
 
     while True:
         session_id = f"cpa-exam-{session_number:03d}"
-        session_path = (
-            Path(__file__).parent.parent / "results" / "questions-02" / "sessions-002"
-        )
-        session_path.mkdir(exist_ok=True)
-        session_path = session_path / session_id
+        session_path = SESSION_GROUP_PATH / session_id
 
-        # skip if exists
-        if session_path.exists():
+        # skip if exists or archived
+        if session_path.exists() or session_id in archived_session_names:
             session_number += 1
             continue
 
@@ -74,15 +82,61 @@ def get_next_session_path() -> Path:
         return session_path
 
 
+def get_session_key(
+    model_name: str, prompt_method_name: str, parameter_kwargs: dict, question_set_name: str
+) -> tuple:
+    """Get the key identifying the sessions run with the same settings and questions."""
+    return (
+        model_name,
+        prompt_method_name,
+        json.dumps(parameter_kwargs, sort_keys=True),
+        question_set_name,
+    )
+
+
+def get_previous_sessions(
+    budget: TokenBudget | None = None,
+) -> dict[tuple, list[tuple[Path, bool]]]:
+    """Get the path of each existing session and whether it finished, by session key, so that
+    a stopped sweep can skip finished sessions and resume unfinished ones.  The tokens the
+    sessions already used are charged to the budget, if given."""
+    previous_sessions = collections.defaultdict(list)
+    if not SESSION_GROUP_PATH.exists():
+        return previous_sessions
+
+    for session_name, exam_data in iter_sessions(SESSION_GROUP_PATH):
+        session_key = get_session_key(
+            exam_data["model_name"],
+            exam_data["prompt_method"],
+            exam_data.get("parameter_set", exam_data["parameters"]),
+            exam_data["question_set"],
+        )
+        previous_sessions[session_key].append(
+            (SESSION_GROUP_PATH / session_name, exam_data["end_time"] is not None)
+        )
+        if budget is not None:
+            budget.charge(exam_data["model_name"], get_session_charged_tokens(exam_data))
+    return previous_sessions
+
+
 def main():
+    # profile the run if CPA_EXAM_PROFILE is set
+    profiler = Profiler("run_exam_old_models", SESSION_GROUP_PATH).start()
+
     # iterate through questions and generate prompt
+    profiler.start_stage("load")
     question_file = Path(__file__).parent.parent / "data" / "questions_02.txt"
-    question_list = parse_question_source(question_file)
-    question_set_name = question_file.name
+    question_list, question_set_name = load_runner_questions(question_file)
 
     # set samples per value
     num_samples_per_set = 1
 
+    # the scoring mode, streaming, pipeline workers, client, and live metrics are set in
+    # exam_session.py for both runners; the scheduler sends each model's requests through the
+    # client with the model's rate limit
+    session_kwargs = get_runner_session_kwargs()
+    client = session_kwargs.pop("client")
+
     """
     These prompts are only relevant for the test REG section:
         generate_prompt_001,
@@ -112,112 +166,101 @@ def main():
         generate_prompt_020,
     ]
 
-    model_list = [
-        "text-ada-001",
-        "text-babbage-001",
-        "text-curie-001",
-        "text-davinci-001",
-    ]
+    # requests per minute allowed for each model, each with its own rate limit budget
+    model_requests_per_minute = {
+        "text-ada-001": 3000,
+        "text-babbage-001": 3000,
+        "text-curie-001": 3000,
+        "text-davinci-001": 3000,
+    }
+
+    # pause a model's requests once half of its last 20 fail, probing again after 30 seconds
+    # and doubling the wait after each failed probe, and give up on it after 5 failed probes
+    circuit_breakers = {
+        model_name: CircuitBreaker(
+            error_window=20, error_threshold=0.5, open_seconds=30.0, max_failed_probes=5
+        )
+        for model_name in model_requests_per_minute
+    }
+
+    # stop starting requests once the sweep has used this many tokens or US dollars, counting
+    # the sessions of previous runs; run again to resume the sweep, which skips finished
+    # sessions and resumes unfinished ones
+    budget = TokenBudget(max_tokens=5_000_000, max_cost=25.0)
+
+    # run the sessions of all models concurrently, one session per model at a time
+    scheduler = ModelScheduler(
+        client,
+        model_requests_per_minute,
+        max_sessions_per_model=1,
+        circuit_breakers=circuit_breakers,
+        budget=budget,
+    )
+
+    # optionally duplicate slow requests, as set in exam_session.py, tracking the latency of
+    # each model separately
+    hedge_policies = {
+        model_name: create_runner_hedge_policy() for model_name in model_requests_per_minute
+    }
 
-    # iterate through parameter values
-    for model_name in model_list:
+    # load the names of archived sessions once, since reading them decompresses the archive
+    archived_session_names = get_archived_session_names(SESSION_GROUP_PATH)
+
+    # queue the sessions for each model, skipping the finished sessions of a previous run and
+    # charging the budget with the tokens the previous runs used
+    previous_sessions = get_previous_sessions(budget)
+    print(f"Budget used by previous runs: {budget.get_stats()}")
+    new_session_paths = []
+    for model_name in model_requests_per_minute:
         for parameter_kwargs in get_parameter_sets():
             for sample_id in range(num_samples_per_set):
                 for prompt_method in prompt_list:
-                    # set up the session path iteratively
-                    session_path = get_next_session_path()
-
-                    # status update
-                    # print(f"Running with prompt method {str(prompt_method.__name__)}, parameters: {parameter_kwargs}")
-
-                    # generate the prompts
-                    exam_data = {
-                        "model_name": model_name,
-                        "question_set": question_set_name,
-                        "prompt_method": str(prompt_method.__name__),
-                        "parameters": parameter_kwargs,
-                        "start_time": datetime.datetime.now().isoformat(),
-                        "end_time": None,
-                        "questions": [],
-                    }
-
-                    # iterate through questions and generate prompt
-                    question_prog_bar = tqdm.tqdm(question_list, desc="Questions")
-                    for question in question_prog_bar:
-                        # set description
-                        question_prog_bar.set_description(
-                            f"Q{question['question_number']}, prompt method {str(prompt_method.__name__)}, parameters: {parameter_kwargs}"
-                        )
-                        # generate the prompt
-                        prompt = prompt_method(question)
-
-                        # setup question data
-                        question_data = {
-                            "question_input": question,
-                            "model_prompt": prompt,
-                            "model_response": None,
-                        }
-
-                        # try to query the API, retry on failure, else log the failed response
-                        try:
-                            question_data["model_response"] = openai.Completion.create(
-                                model=model_name,
-                                prompt=question_data["model_prompt"],
-                                **parameter_kwargs,
-                            )
-                        except Exception as e:
-                            question_prog_bar.set_description(
-                                f"First error, retrying in 5: {e}"
-                            )
-                            question_data["model_response"] = None
-
-                            # sleep and retry
-                            time.sleep(5)
-
-                            try:
-                                question_data[
-                                    "model_response"
-                                ] = openai.Completion.create(
-                                    model=model_name,
-                                    prompt=question_data["model_prompt"],
-                                    **parameter_kwargs,
-                                )
-                            except Exception as f:
-                                question_prog_bar.set_description(
-                                    f"Second error, retrying in 10: {f}"
-                                )
-                                question_data["model_response"] = None
-
-                                # sleep and retry
-                                time.sleep(10)
-
-                                try:
-                                    question_data[
-                                        "model_response"
-                                    ] = openai.Completion.create(
-                                        model=model_name,
-                                        prompt=question_data["model_prompt"],
-                                        **parameter_kwargs,
-                                    )
-                                except Exception as g:
-                                    print(
-                                        f"Third error, skipping question {question}: {g}"
-                                    )
-                                    question_data["model_response"] = None
-                        finally:
-                            # log the current state of the exam
-                            exam_data["questions"].append(question_data)
-                            with open(
-                                session_path / "exam_data.json", "wt", encoding="utf-8"
-                            ) as output_file:
-                                json.dump(exam_data, output_file)
-
-                    # save final state
-                    exam_data["end_time"] = datetime.datetime.now().isoformat()
-                    with open(
-                        session_path / "exam_data.json", "wt", encoding="utf-8"
-                    ) as output_file:
-                        json.dump(exam_data, output_file)
+                    session_key = get_session_key(
+                        model_name, prompt_method.__name__, parameter_kwargs, question_set_name
+                    )
+                    if len(previous_sessions[session_key]) > 0:
+                        session_path, finished = previous_sessions[session_key].pop(0)
+                        if finished:
+                            continue
+                        session_path.mkdir(exist_ok=True)
+                    else:
+                        # set up the session path iteratively
+                        session_path = get_next_session_path(archived_session_names)
+                        new_session_paths.append(session_path)
+
+                    # run the session with the model's rate-limited client
+                    scheduler.submit(
+                        model_name,
+                        functools.partial(
+                            run_exam_session,
+                            model_name=model_name,
+                            prompt_method=prompt_method,
+                            parameter_kwargs=parameter_kwargs,
+                            question_list=question_list,
+                            question_set_name=question_set_name,
+                            session_path=session_path,
+                            hedge_policy=hedge_policies[model_name],
+                            resume=True,
+                            **session_kwargs,
+                        ),
+                    )
+
+    # run the sweep
+    profiler.start_stage("run")
+    sweep_stats = scheduler.run()
+    print(f"Sweep time: {sweep_stats['wall_seconds']:.1f}s")
+    for model_name, model_seconds in sweep_stats["model_seconds"].items():
+        print(f"  {model_name}: {model_seconds:.1f}s")
+    print(f"Budget used: {budget.get_stats()}")
+    if sweep_stats["num_dropped_jobs"] > 0:
+        print(f"Sweep stopped with {sweep_stats['num_dropped_jobs']} sessions left to resume")
+
+    # remove the directories of sessions that were never started
+    for session_path in new_session_paths:
+        if not (session_path / "exam_data.json").exists():
+            session_path.rmdir()
+
+    profiler.stop()
 
 
 if __name__ == "__main__":
@@ -5,11 +5,225 @@ CSV file with the question number, question type, answer, and parameters.
 
 # imports
 import datetime
-import json
+import math
+import re
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+# packages are imported where they are used so that parsing and scoring start quickly
+if TYPE_CHECKING:
+    import pandas
+
+# project imports
+from profiling import Profiler
+from request_metrics import get_usage_tokens, summarize_request_metrics
+
+# session parameters that identify a group of comparable sessions for performance reports
+PERFORMANCE_GROUP_KEYS = [
+    "model_name",
+    "prompt_method",
+    "temperature",
+    "max_tokens",
+    "top_p",
+    "best_of",
+    "frequency_penalty",
+    "presence_penalty",
+]
+
+# patterns for citations to authority in explanations and references, with a function that
+# returns the canonical form of each match so that the same citation is always written one way
+CITATION_PATTERNS = [
+    (
+        re.compile(
+            r"\b(?:IRC|I\.R\.C\.|Internal Revenue Code|U\.?S\.? ?Code|U\.?S\.?C\.?)"
+            r"\s*(?:§+|Sec\.|Section)?\s*(\d+[A-Z]?)\b"
+        ),
+        lambda match: f"IRC {match.group(1)}",
+    ),
+    (
+        re.compile(
+            r"\b(?:Treas(?:ury)?\.? Reg(?:ulations?|s?\.)?)\s*(?:§+|Sec\.|Section)?\s*"
+            r"(\d+\.[\w()\-.]*\w)"
+        ),
+        lambda match: f"Treas. Reg. {match.group(1)}",
+    ),
+    (
+        re.compile(r"\bCircular (?:No\. )?230\b"),
+        lambda match: "Circular 230",
+    ),
+    (
+        re.compile(r"\bASC (?:Topic )?(\d{3}(?:-\d{2}){0,3})\b"),
+        lambda match: f"ASC {match.group(1)}",
+    ),
+    (
+        re.compile(r"\b(AU-C|AT-C|AR-C|AU|AS)(?: Section| Sec\.| §)?\s+(\d{3,4})\b"),
+        lambda match: f"{match.group(1)} {match.group(2)}",
+    ),
+    (
+        re.compile(r"\bGASB (?:Statement )?(?:No\. ?)?(\d+)\b"),
+        lambda match: f"GASB {match.group(1)}",
+    ),
+    (
+        re.compile(r"\b(?:SFAS|FAS|FASB Statement)(?: No\.)? ?(\d+)\b"),
+        lambda match: f"SFAS {match.group(1)}",
+    ),
+    (
+        re.compile(r"\b(?:IRS )?(?:Publication|Pub\.) (\d+[A-Z]?(?:-[A-Z]+)?)\b"),
+        lambda match: f"IRS Publication {match.group(1)}",
+    ),
+    (
+        re.compile(r"\bRev(?:enue|\.) ?Rul(?:ing|\.) ?(\d{2,4}-\d+)\b"),
+        lambda match: f"Rev. Rul. {match.group(1)}",
+    ),
+]
+
+
+def parse_gpt_response_line(response: dict, i: int, line: str) -> bool:
+    """Parse line number i of a response into the response dictionary in place, and return
+    True if parsing should stop, i.e., the rest of the response is the explanation."""
+    # check for the answer
+    line = line.strip()
+
+    if "Option" in line and ":" in line:
+        line = line.replace("Option", "")
+
+    line_tokens = line.split()
+    if len(line_tokens) == 0:
+        return False
+
+    # check for the answer
+    # any `continue` lines below are for answers that do not follow prompts and are therefore coded as no response
+    if line_tokens[0].startswith("Choice"):
+        if len(line_tokens) < 2:
+            return False
+        response["answer"] = (
+            line_tokens[1]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    elif line_tokens[0].startswith("Best"):
+        if len(line_tokens) < 3:
+            return False
+        response["answer"] = (
+            line_tokens[2]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    elif line_tokens[0].startswith("Amount"):
+        if len(line_tokens) < 2:
+            return False
+        response["answer"] = line_tokens[1].strip()
+    elif line_tokens[0].startswith("Answer"):
+        if len(line_tokens) < 2:
+            return False
+        response["answer"] = (
+            line_tokens[1]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    elif line_tokens[0].startswith("Explanation"):
+        if len(line_tokens) < 2:
+            return False
+        response["explanation"] = " ".join(line_tokens[1:])
+        return True
+    elif line_tokens[0].startswith("First"):
+        if len(line_tokens) < 3:
+            return False
+        response["answer"] = (
+            line_tokens[2]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    elif line_tokens[0].startswith("Second"):
+        if len(line_tokens) < 3:
+            return False
+        response["second_answer"] = (
+            line_tokens[2]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    elif line_tokens[0].startswith("Third"):
+        if len(line_tokens) < 3:
+            return False
+        response["third_answer"] = (
+            line_tokens[2]
+            .replace(".", "")
+            .replace(":", "")
+            .replace(",", "")
+            .strip()
+        )
+    else:
+        if i == 0 and len(line_tokens) <= 2:
+            response["answer"] = (
+                line_tokens[0]
+                .replace(".", "")
+                .replace(":", "")
+                .replace(",", "")
+                .strip()
+            )
+        elif i == 0 and len(line_tokens) > 2:
+            if line_tokens[0].strip(".").isnumeric():
+                response["answer"] = (
+                    line_tokens[0]
+                    .replace(".", "")
+                    .replace(":", "")
+                    .replace(",", "")
+                    .strip()
+                )
+            elif line_tokens[0].strip(".").lower() in ["a", "b", "c", "d"]:
+                response["answer"] = (
+                    line_tokens[0]
+                    .replace(".", "")
+                    .replace(":", "")
+                    .replace(",", "")
+                    .strip()
+                )
+        elif i == 0 and line.startswith("Option"):
+            response["answer"] = (
+                line_tokens[1]
+                .replace(".", "")
+                .replace(":", "")
+                .replace(",", "")
+                .strip()
+            )
+        elif i == 0 and len(line_tokens) > 2 and "$" in line_tokens[-1]:
+            response["answer"] = (
+                line_tokens[-1]
+                .replace(".", "")
+                .replace(":", "")
+                .replace(",", "")
+                .strip()
+            )
+        else:
+            if "Worst" in line or "Ex" in line:
+                return False
+            if response["answer"] is None:
+                # these are required for older models that don't follow instructions well
+                if line.strip().split()[0] in ["A.", "B.", "C.", "D."]:
+                    response["answer"] = line.strip().split()[0].strip(".").strip()
+                else:
+                    print(f"Could not parse answer: {line}")
+                    print(line.split()[0])
 
-# packages
-import pandas
+    return False
+
+
+def normalize_answer_letter(answer: str | None) -> str | None:
+    """Return a multiple choice answer as an uppercase letter without surrounding spaces or
+    punctuation, e.g., " a." -> "A", so that answers and answer keys compare equal."""
+    if answer is None:
+        return None
+    return answer.strip().strip(".:,()").strip().upper() or None
 
 
 def parse_gpt_response(response: str) -> dict:
@@ -52,148 +266,133 @@ def parse_gpt_response(response: str) -> dict:
     }
 
     for i, line in enumerate(response_lines):
-        # check for the answer
-        line = line.strip()
-
-        if "Option" in line and ":" in line:
-            line = line.replace("Option", "")
-
-        line_tokens = line.split()
-        if len(line_tokens) == 0:
-            continue
-
-        # check for the answer
-        # any `continue` lines below are for answers that do not follow prompts and are therefore coded as no response
-        if line_tokens[0].startswith("Choice"):
-            if len(line_tokens) < 2:
-                continue
-            response["answer"] = (
-                line_tokens[1]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        elif line_tokens[0].startswith("Best"):
-            if len(line_tokens) < 3:
-                continue
-            response["answer"] = (
-                line_tokens[2]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        elif line_tokens[0].startswith("Amount"):
-            if len(line_tokens) < 2:
-                continue
-            response["answer"] = line_tokens[1].strip()
-        elif line_tokens[0].startswith("Answer"):
-            if len(line_tokens) < 2:
-                continue
-            response["answer"] = (
-                line_tokens[1]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        elif line_tokens[0].startswith("Explanation"):
-            if len(line_tokens) < 2:
-                continue
-            response["explanation"] = " ".join(line_tokens[1:])
+        if parse_gpt_response_line(response, i, line):
             break
-        elif line_tokens[0].startswith("First"):
-            if len(line_tokens) < 3:
-                continue
-            response["answer"] = (
-                line_tokens[2]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        elif line_tokens[0].startswith("Second"):
-            if len(line_tokens) < 3:
-                continue
-            response["second_answer"] = (
-                line_tokens[2]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        elif line_tokens[0].startswith("Third"):
-            if len(line_tokens) < 3:
-                continue
-            response["third_answer"] = (
-                line_tokens[2]
-                .replace(".", "")
-                .replace(":", "")
-                .replace(",", "")
-                .strip()
-            )
-        else:
-            if i == 0 and len(line_tokens) <= 2:
-                response["answer"] = (
-                    line_tokens[0]
-                    .replace(".", "")
-                    .replace(":", "")
-                    .replace(",", "")
-                    .strip()
-                )
-            elif i == 0 and len(line_tokens) > 2:
-                if line_tokens[0].strip(".").isnumeric():
-                    response["answer"] = (
-                        line_tokens[0]
-                        .replace(".", "")
-                        .replace(":", "")
-                        .replace(",", "")
-                        .strip()
-                    )
-                elif line_tokens[0].strip(".").lower() in ["a", "b", "c", "d"]:
-                    response["answer"] = (
-                        line_tokens[0]
-                        .replace(".", "")
-                        .replace(":", "")
-                        .replace(",", "")
-                        .strip()
-                    )
-            elif i == 0 and line.startswith("Option"):
-                response["answer"] = (
-                    line_tokens[1]
-                    .replace(".", "")
-                    .replace(":", "")
-                    .replace(",", "")
-                    .strip()
-                )
-            elif i == 0 and len(line_tokens) > 2 and "$" in line_tokens[-1]:
-                response["answer"] = (
-                    line_tokens[-1]
-                    .replace(".", "")
-                    .replace(":", "")
-                    .replace(",", "")
-                    .strip()
-                )
-            else:
-                if "Worst" in line or "Ex" in line:
-                    continue
-                if response["answer"] is None:
-                    # these are required for older models that don't follow instructions well
-                    if line.strip().split()[0] in ["A.", "B.", "C.", "D."]:
-                        response["answer"] = line.strip().split()[0].strip(".").strip()
-                    else:
-                        print(f"Could not parse answer: {line}")
-                        print(line.split()[0])
 
     # return dictionary
     return response
 
 
-def score_exam(exam_data: dict) -> pandas.DataFrame:
+def extract_references(response: str | None) -> str | None:
+    """Return the references section of a response, i.e., the text after a "References:" or
+    "Reference:" label, which parse_gpt_response leaves out of the explanation."""
+    if response is None:
+        return None
+    match = re.search(r"\bReferences?:\s*(.*)", response, re.DOTALL)
+    if match is None:
+        return None
+    return match.group(1).strip() or None
+
+
+def extract_citations(text: str | None) -> list[str]:
+    """Return the distinct citations to authority in the text in canonical form and in order
+    of first appearance, e.g., ["IRC 6695", "Circular 230"]."""
+    if text is None:
+        return []
+    citation_positions = {}
+    for pattern, format_citation in CITATION_PATTERNS:
+        for match in pattern.finditer(text):
+            citation = format_citation(match)
+            citation_positions.setdefault(citation, match.start())
+    return sorted(citation_positions, key=citation_positions.get)
+
+
+class IncrementalResponseParser:
+    """Parse a streamed response as its text arrives, one completed line at a time, with the
+    same rules as parse_gpt_response.  The parser is complete once all required answer fields
+    are set or the explanation has started, so a stream can be cancelled at that point when
+    the explanation is not needed."""
+
+    def __init__(self, required_fields: tuple[str, ...] = ("answer",)):
+        self.required_fields = required_fields
+        self.text = ""
+        self.pending_line = ""
+        self.line_number = 0
+        self.explanation_started = False
+        self.response = {
+            "answer": None,
+            "second_answer": None,
+            "third_answer": None,
+            "explanation": None,
+        }
+
+    def feed(self, text: str) -> None:
+        """Add streamed text and parse any lines it completes."""
+        self.text += text
+        self.pending_line += text
+        while not self.explanation_started and "\n" in self.pending_line:
+            line, self.pending_line = self.pending_line.split("\n", 1)
+            self.parse_line(line)
+
+        # the explanation has started once its label appears, even before the line completes
+        if self.pending_line.strip().startswith("Explanation"):
+            self.explanation_started = True
+
+    def parse_line(self, line: str) -> None:
+        """Parse one completed line."""
+        if parse_gpt_response_line(self.response, self.line_number, line):
+            self.explanation_started = True
+        self.line_number += 1
+
+    def is_complete(self) -> bool:
+        """Return whether all required fields are parsed or the explanation has started."""
+        return self.explanation_started or all(
+            self.response[field] is not None for field in self.required_fields
+        )
+
+    def close(self) -> dict:
+        """Parse any remaining partial line and return the parsed response."""
+        if not self.explanation_started and len(self.pending_line) > 0:
+            self.parse_line(self.pending_line)
+            self.pending_line = ""
+        return self.response
+
+
+def rank_answer_logprobs(response: dict, choices: dict) -> dict:
+    """Rank the multiple choice letters from the top logprobs of the first completion token
+    and return a dictionary like this:
+    {
+        "ranking": ["D", "A", "B"],
+        "logprobs": {"D": -0.12, "A": -2.5, "B": -3.1}
+    }
+
+    Tokens are matched to choices after stripping whitespace and trailing periods, and the
+    probabilities of tokens that map to the same choice (e.g., " D" and "D") are summed.
+    Choices that are not in the top logprobs are left out of the ranking.
+    """
+    try:
+        top_logprobs = response["choices"][0]["logprobs"]["top_logprobs"][0]
+    except (KeyError, IndexError, TypeError):
+        return {
+            "ranking": [],
+            "logprobs": {},
+        }
+
+    # sum the probability mass for each choice letter
+    choice_probabilities = {}
+    for token, logprob in top_logprobs.items():
+        choice = token.strip().rstrip(".").upper()
+        if choice not in choices:
+            continue
+        choice_probabilities[choice] = choice_probabilities.get(choice, 0.0) + math.exp(
+            logprob
+        )
+
+    ranking = sorted(
+        choice_probabilities, key=lambda c: choice_probabilities[c], reverse=True
+    )
+    return {
+        "ranking": ranking,
+        "logprobs": {c: math.log(choice_probabilities[c]) for c in ranking},
+    }
+
+
+def score_exam_records(exam_data: dict) -> list[dict]:
     """
     Read an exam JSON data dictionary, parse all questions, and
-    return per-exam dataframe.
+    return a list of per-question score records, one per sample when the
+    session requested n > 1 completions per question, with a majority vote
+    across the samples of each question.
     :param exam_data:
     :return:
     """
@@ -201,145 +400,263 @@ def score_exam(exam_data: dict) -> pandas.DataFrame:
     exam_question_list = []
 
     # iterate through all questions, parse the model response, and compare against the correct answer
-    for question in exam_data["questions"]:
-        # get the model response as text and parse it
+    for question_index, question in enumerate(exam_data["questions"]):
+        # get the model response text for each sample; sessions run with n > 1 have one
+        # choice per sample
         try:
-            model_answer_text = question["model_response"]["choices"][0]["text"]
+            model_answer_texts = [
+                choice["text"] for choice in question["model_response"]["choices"]
+            ]
         except (KeyError, TypeError):
-            model_answer_text = None
-
-        # parse the model response
-        model_response_data = parse_gpt_response(model_answer_text)
-
-        # compare answer to question_input correct answer
-        correct_answer = question["question_input"]["answer"]
+            model_answer_texts = []
+        if len(model_answer_texts) == 0:
+            model_answer_texts = [None]
+
+        question_record_list = []
+        for sample_index, model_answer_text in enumerate(model_answer_texts):
+            # parse the model response, or use the logprob ranking if the session recorded one
+            if question.get("answer_ranking") is not None:
+                answer_ranking = question["answer_ranking"] + [None, None, None]
+                model_response_data = {
+                    "answer": answer_ranking[0],
+                    "second_answer": answer_ranking[1],
+                    "third_answer": answer_ranking[2],
+                    "explanation": None,
+                }
+            else:
+                model_response_data = parse_gpt_response(model_answer_text)
 
-        # compare answers based on question type
-        answer_correct = False
-        second_correct = False
-        third_correct = False
-        if model_response_data["answer"] is not None:
+            # compare multiple choice answers as normalized letters, e.g., "a." as "A"
             if question["question_input"]["question_type"] == "multiple_choice":
-                # multiple choice
-                if model_response_data["answer"] == correct_answer:
-                    answer_correct = True
-                if model_response_data["second_answer"] == correct_answer:
-                    second_correct = True
-                if model_response_data["third_answer"] == correct_answer:
-                    third_correct = True
-            elif question["question_input"]["question_type"] == "short_answer":
-                # short answer
-                if isinstance(correct_answer, list):
-                    if model_response_data["answer"] in correct_answer:
+                for answer_key in ["answer", "second_answer", "third_answer"]:
+                    model_response_data[answer_key] = normalize_answer_letter(
+                        model_response_data.get(answer_key)
+                    )
+
+            # use the second pass explanation from a two-phase session if there is one
+            try:
+                model_response_data["explanation"] = question["explanation_response"][
+                    "choices"
+                ][0]["text"].strip()
+            except (KeyError, TypeError):
+                pass
+
+            # compare answer to question_input correct answer
+            correct_answer = question["question_input"]["answer"]
+
+            # compare answers based on question type
+            answer_correct = False
+            second_correct = False
+            third_correct = False
+            if model_response_data["answer"] is not None:
+                if question["question_input"]["question_type"] == "multiple_choice":
+                    # multiple choice
+                    correct_letter = normalize_answer_letter(correct_answer)
+                    if model_response_data["answer"] == correct_letter:
                         answer_correct = True
-                elif isinstance(correct_answer, str):
-                    if model_response_data["answer"] == correct_answer:
+                    if model_response_data["second_answer"] == correct_letter:
+                        second_correct = True
+                    if model_response_data["third_answer"] == correct_letter:
+                        third_correct = True
+                elif question["question_input"]["question_type"] == "short_answer":
+                    # short answer
+                    if isinstance(correct_answer, list):
+                        if model_response_data["answer"] in correct_answer:
+                            answer_correct = True
+                    elif isinstance(correct_answer, str):
+                        if model_response_data["answer"] == correct_answer:
+                            answer_correct = True
+                elif question["question_input"]["question_type"] == "amount":
+                    # strip dollar signs, (, ), and commas from both sides
+                    correct_answer = (
+                        correct_answer.replace("$", "")
+                        .replace("(", "")
+                        .replace(")", "")
+                        .replace(",", "")
+                    )
+                    model_answer = (
+                        model_response_data["answer"]
+                        .replace("$", "")
+                        .replace("(", "")
+                        .replace(")", "")
+                        .replace(",", "")
+                    )
+                    if correct_answer == model_answer:
                         answer_correct = True
-            elif question["question_input"]["question_type"] == "amount":
-                # strip dollar signs, (, ), and commas from both sides
-                correct_answer = (
-                    correct_answer.replace("$", "")
-                    .replace("(", "")
-                    .replace(")", "")
-                    .replace(",", "")
-                )
-                model_answer = (
-                    model_response_data["answer"]
-                    .replace("$", "")
-                    .replace("(", "")
-                    .replace(")", "")
-                    .replace(",", "")
+
+            # calculate duration
+            try:
+                session_duration = (
+                    datetime.datetime.fromisoformat(exam_data["end_time"])
+                    - datetime.datetime.fromisoformat(exam_data["start_time"])
+                ).total_seconds()
+            except:
+                session_duration = None
+
+            # get the per-request metrics, falling back to the response usage for older sessions
+            request_metrics = question.get("request_metrics") or {}
+            usage_tokens = get_usage_tokens(question["model_response"])
+
+            # append data to result list
+            question_record_list.append(
+                {
+                    "question_section": question["question_input"]["question_section"]
+                    if "question_section" in question["question_input"]
+                    else None,
+                    "question_number": question_index + 1,
+                    "sample_index": sample_index,
+                    "question_type": question["question_input"]["question_type"],
+                    "model_answer": model_response_data["answer"],
+                    "model_second_answer": None,
+                    "model_third_answer": None,
+                    "correct_answer": correct_answer,
+                    "model_explanation": model_response_data["explanation"],
+                    "is_correct": answer_correct,
+                    "is_second_correct": second_correct,
+                    "is_third_correct": third_correct,
+                    # top two answers
+                    "is_top_two_correct": answer_correct or second_correct,
+                    # top three answers
+                    "is_top_three_correct": answer_correct
+                    or second_correct
+                    or third_correct,
+                    # parameters here
+                    "model_name": exam_data["model_name"]
+                    if "model_name" in exam_data
+                    else None,
+                    "prompt_method": exam_data["prompt_method"]
+                    if "prompt_method" in exam_data
+                    else None,
+                    "temperature": exam_data["parameters"]["temperature"],
+                    "max_tokens": exam_data["parameters"]["max_tokens"],
+                    "top_p": exam_data["parameters"]["top_p"],
+                    "best_of": exam_data["parameters"]["best_of"],
+                    "frequency_penalty": exam_data["parameters"]["frequency_penalty"],
+                    "presence_penalty": exam_data["parameters"]["presence_penalty"],
+                    "duration": session_duration,
+                    # request metrics here
+                    "queue_wait": request_metrics.get("queue_wait"),
+                    "http_latency": request_metrics.get("http_latency"),
+                    "total_latency": request_metrics.get("total_latency"),
+                    "retries": request_metrics.get("retries"),
+                    "prompt_tokens": usage_tokens["prompt_tokens"],
+                    "completion_tokens": usage_tokens["completion_tokens"],
+                    "tokens_per_second": request_metrics.get("tokens_per_second"),
+                }
+            )
+
+        # majority vote across samples: the most common answer, ties going to the earliest
+        answer_counts = {}
+        for record in question_record_list:
+            if record["model_answer"] is not None:
+                answer_counts[record["model_answer"]] = (
+                    answer_counts.get(record["model_answer"], 0) + 1
                 )
-                if correct_answer == model_answer:
-                    answer_correct = True
+        majority_answer = max(answer_counts, key=answer_counts.get, default=None)
+        is_majority_correct = any(
+            record["is_correct"]
+            for record in question_record_list
+            if record["model_answer"] == majority_answer
+            and majority_answer is not None
+        )
+        for record in question_record_list:
+            record["majority_answer"] = majority_answer
+            record["is_majority_correct"] = is_majority_correct
 
-        # calculate duration
-        try:
-            session_duration = (
-                datetime.datetime.fromisoformat(exam_data["end_time"])
-                - datetime.datetime.fromisoformat(exam_data["start_time"])
-            ).total_seconds()
-        except:
-            session_duration = None
-
-        # append data to result list
-        exam_question_list.append(
-            {
-                "question_section": question["question_input"]["question_section"]
-                if "question_section" in question["question_input"]
-                else None,
-                "question_number": len(exam_question_list) + 1,
-                "question_type": question["question_input"]["question_type"],
-                "model_answer": model_response_data["answer"],
-                "model_second_answer": None,
-                "model_third_answer": None,
-                "correct_answer": correct_answer,
-                "model_explanation": model_response_data["explanation"],
-                "is_correct": answer_correct,
-                "is_second_correct": second_correct,
-                "is_third_correct": third_correct,
-                # top two answers
-                "is_top_two_correct": answer_correct or second_correct,
-                # top three answers
-                "is_top_three_correct": answer_correct
-                or second_correct
-                or third_correct,
-                # parameters here
-                "model_name": exam_data["model_name"]
-                if "model_name" in exam_data
-                else None,
-                "prompt_method": exam_data["prompt_method"]
-                if "prompt_method" in exam_data
-                else None,
-                "temperature": exam_data["parameters"]["temperature"],
-                "max_tokens": exam_data["parameters"]["max_tokens"],
-                "top_p": exam_data["parameters"]["top_p"],
-                "best_of": exam_data["parameters"]["best_of"],
-                "frequency_penalty": exam_data["parameters"]["frequency_penalty"],
-                "presence_penalty": exam_data["parameters"]["presence_penalty"],
-                "duration": session_duration,
-            }
+        exam_question_list.extend(question_record_list)
+
+    # return records
+    return exam_question_list
+
+
+def score_exam(exam_data: dict) -> "pandas.DataFrame":
+    """
+    Read an exam JSON data dictionary, parse all questions, and
+    return per-exam dataframe.
+    :param exam_data:
+    :return:
+    """
+    import pandas
+
+    return pandas.DataFrame(score_exam_records(exam_data))
+
+
+def summarize_exam_performance(exam_question_list: list[dict]) -> list[dict]:
+    """
+    Group scored question records by model and parameter set and return one row per group
+    with accuracy next to the latency percentiles, token counts, and throughput.
+    :param exam_question_list:
+    :return:
+    """
+    group_records = {}
+    for record in exam_question_list:
+        group_key = tuple(record[key] for key in PERFORMANCE_GROUP_KEYS)
+        group_records.setdefault(group_key, []).append(record)
+
+    performance_list = []
+    for group_key, records in group_records.items():
+        performance = dict(zip(PERFORMANCE_GROUP_KEYS, group_key))
+        performance["is_correct"] = sum(r["is_correct"] for r in records) / len(records)
+        performance["is_majority_correct"] = sum(
+            r["is_majority_correct"] for r in records
+        ) / len(records)
+        # every sample of a question shares one request, so summarize the first sample only
+        performance.update(
+            summarize_request_metrics([r for r in records if r["sample_index"] == 0])
         )
+        # the histogram is not useful in a flat table
+        performance.pop("http_latency_histogram")
+        performance_list.append(performance)
 
-    # return dataframe
-    return pandas.DataFrame(exam_question_list)
+    return performance_list
 
 
 def main():
+    import pandas
+
+    from results_warehouse import (
+        connect_warehouse,
+        get_warehouse_path,
+        ingest_sessions,
+        query_always_wrong_questions,
+    )
+    from session_archive import iter_sessions
+
     # get the list of exam sessions
     base_result_path = Path(__file__).parent.parent / "results" / "questions-02"
     result_path = base_result_path / "sessions-001"
 
-    # combine all exams
-    exam_df_list = []
+    # profile the run if CPA_EXAM_PROFILE is set
+    profiler = Profiler("score_exam", result_path).start()
 
-    # iterate through session exams, read JSON file, and score
-    for exam_path in result_path.iterdir():
-        # check if there's an exam json file
-        if exam_path.is_file():
-            continue
-        exam_json_path = exam_path / "exam_data.json"
-        if not exam_json_path.exists():
-            print(f"Exam JSON file not found at {str(exam_json_path)}")
-            continue
+    # combine all exams
+    exam_record_list = []
 
-        # read the exam data
-        with open(exam_json_path, "r") as exam_json_file:
-            exam_data = json.load(exam_json_file)
+    # update the warehouse with new and changed sessions and report the questions each model
+    # always gets wrong if set; results_warehouse.py updates it on its own
+    update_warehouse = False
 
+    # iterate through session exams, stored as directories or archives, and score
+    for session_name, exam_data in profiler.time_iterator("load", iter_sessions(result_path)):
         # score the exam
-        exam_df = score_exam(exam_data)
+        with profiler.stage("score"):
+            exam_records = score_exam_records(exam_data)
         # add the session name
-        exam_df["session_name"] = exam_path.name
+        for record in exam_records:
+            record["session_name"] = session_name
         # track the exams
-        exam_df_list.append(exam_df)
+        exam_record_list.extend(exam_records)
 
-    # concat all together
-    exam_df = pandas.concat(exam_df_list, ignore_index=True)
+    # combine all together
+    profiler.start_stage("concat")
+    exam_df = pandas.DataFrame(exam_record_list)
 
     # save to CSV
+    profiler.start_stage("write")
     exam_df.to_csv(result_path / "exam_results.csv", index=False)
 
+    profiler.start_stage("summarize")
+
     # number of exams
     print("Exam Sessions:", exam_df["session_name"].nunique())
     print("Number of Prompts:", exam_df["prompt_method"].nunique())
@@ -356,6 +673,10 @@ def main():
     top_two_accuracy_rate = exam_df["is_top_three_correct"].mean()
     print(f"Top Three Accuracy Rate: {top_two_accuracy_rate:.2%}")
 
+    # majority vote accuracy rate across the samples of each question
+    majority_accuracy_rate = exam_df["is_majority_correct"].mean()
+    print(f"Majority Vote Accuracy Rate: {majority_accuracy_rate:.2%}")
+
     # accuracy by prompt
     first_by_prompt = exam_df.groupby(["prompt_method"])["is_correct"].mean()
     top_two_by_prompt = exam_df.groupby(["prompt_method"])["is_top_two_correct"].mean()
@@ -368,6 +689,38 @@ def main():
     )
     print(accuracy_by_prompt)
 
+    # accuracy, latency and throughput by model and parameter set
+    performance_df = pandas.DataFrame(summarize_exam_performance(exam_record_list))
+    print(
+        performance_df[
+            PERFORMANCE_GROUP_KEYS
+            + [
+                "is_correct",
+                "is_majority_correct",
+                "http_latency_p50",
+                "http_latency_p95",
+                "http_latency_p99",
+                "completion_tokens",
+                "tokens_per_second",
+            ]
+        ].to_string(index=False)
+    )
+
+    if update_warehouse:
+        profiler.start_stage("warehouse")
+        warehouse_connection = connect_warehouse(get_warehouse_path(base_result_path))
+        ingest_sessions(warehouse_connection, result_path)
+
+        # questions that no session of each model answered correctly
+        for model_name in exam_df["model_name"].dropna().unique():
+            always_wrong_questions = query_always_wrong_questions(
+                warehouse_connection, session_group=result_path.name, model_name=model_name
+            )
+            print(f"Questions always wrong for {model_name}: {len(always_wrong_questions)}")
+        warehouse_connection.close()
+
+    profiler.stop()
+
 
 if __name__ == "__main__":
     main()
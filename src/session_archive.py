@@ -0,0 +1,212 @@
+"""
+Store a group of exam sessions in a single compressed archive, with prompts and question inputs
+stored once in a content-addressed table.
+
+Every session in a sweep repeats the same question inputs, and every session with the same
+prompt style repeats the same prompts, so the archive keeps each distinct value once keyed by
+the sha256 of its JSON and each question refers to it by hash:
+    {
+        "format_version": 1,
+        "blobs": {"<hash>": <question_input or model_prompt>, ...},
+        "sessions": {
+            "cpa-exam-001": {... "questions": [{"question_input_hash": "<hash>", ...}, ...]},
+            ...
+        }
+    }
+
+The archive is written as JSON compressed with gzip (.json.gz) or lzma (.json.xz).  The
+iter_sessions() loader reads exam_data.json session directories and archives in a session group
+directory alike, so the scripts that read sessions do not need to know how they are stored.
+"""
+
+# imports
+import gzip
+import hashlib
+import json
+import lzma
+from pathlib import Path
+from typing import Iterator
+
+# archive format version
+ARCHIVE_FORMAT_VERSION = 1
+
+# compression modules by archive file suffix
+ARCHIVE_CODECS = {
+    ".gz": gzip,
+    ".xz": lzma,
+}
+
+# suffix of archive file names before the compression suffix
+ARCHIVE_NAME_SUFFIX = ".archive.json"
+
+# question fields stored once in the content-addressed table
+SHARED_QUESTION_FIELDS = ["question_input", "model_prompt"]
+
+
+def get_content_hash(value) -> str:
+    """Return the sha256 hash of a value's canonical JSON."""
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def pack_session(exam_data: dict, blobs: dict) -> dict:
+    """Return a copy of a session with its shared question fields replaced by hashes, adding
+    the values to the blob table."""
+    packed_questions = []
+    for question in exam_data["questions"]:
+        packed_question = dict(question)
+        for field in SHARED_QUESTION_FIELDS:
+            if field not in packed_question:
+                continue
+            value = packed_question.pop(field)
+            value_hash = get_content_hash(value)
+            blobs.setdefault(value_hash, value)
+            packed_question[f"{field}_hash"] = value_hash
+        packed_questions.append(packed_question)
+
+    return {**exam_data, "questions": packed_questions}
+
+
+def unpack_session(packed_exam_data: dict, blobs: dict) -> dict:
+    """Return a session with its shared question fields restored from the blob table."""
+    questions = []
+    for packed_question in packed_exam_data["questions"]:
+        question = {}
+        for key, value in packed_question.items():
+            if key.endswith("_hash") and key[: -len("_hash")] in SHARED_QUESTION_FIELDS:
+                question[key[: -len("_hash")]] = blobs[value]
+            else:
+                question[key] = value
+        questions.append(question)
+
+    return {**packed_exam_data, "questions": questions}
+
+
+def open_archive(archive_path: Path, mode: str):
+    """Open an archive file for text reading or writing with the codec for its suffix."""
+    if archive_path.suffix not in ARCHIVE_CODECS:
+        raise ValueError(f"Unknown archive compression {archive_path.suffix}")
+    return ARCHIVE_CODECS[archive_path.suffix].open(archive_path, mode, encoding="utf-8")
+
+
+def write_session_archive(archive_path: Path, sessions: dict[str, dict]) -> None:
+    """Write sessions keyed by name to an archive, writing a temporary file first and renaming
+    it into place so that an interrupted write never leaves a partial archive."""
+    blobs = {}
+    packed_sessions = {
+        session_name: pack_session(exam_data, blobs)
+        for session_name, exam_data in sessions.items()
+    }
+    # the temporary name keeps the compression suffix but does not match get_archive_paths
+    temporary_path = archive_path.with_name(
+        f".{archive_path.name[: -len(archive_path.suffix)]}.tmp{archive_path.suffix}"
+    )
+    with open_archive(temporary_path, "wt") as archive_file:
+        json.dump(
+            {
+                "format_version": ARCHIVE_FORMAT_VERSION,
+                "blobs": blobs,
+                "sessions": packed_sessions,
+            },
+            archive_file,
+            separators=(",", ":"),
+        )
+    temporary_path.replace(archive_path)
+
+
+def read_session_archive(archive_path: Path) -> Iterator[tuple[str, dict]]:
+    """Yield the name and data of each session in an archive."""
+    with open_archive(archive_path, "rt") as archive_file:
+        archive_data = json.load(archive_file)
+    if archive_data["format_version"] != ARCHIVE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported archive format version {archive_data['format_version']}"
+        )
+
+    for session_name, packed_exam_data in archive_data["sessions"].items():
+        yield session_name, unpack_session(packed_exam_data, archive_data["blobs"])
+
+
+def get_archive_paths(session_group_path: Path) -> list[Path]:
+    """Return the archives in a session group directory."""
+    return sorted(
+        path
+        for suffix in ARCHIVE_CODECS
+        for path in session_group_path.glob(f"*{ARCHIVE_NAME_SUFFIX}{suffix}")
+    )
+
+
+def get_archived_session_names(session_group_path: Path) -> set[str]:
+    """Return the names of the sessions stored in the archives of a session group, e.g., so
+    that new sessions do not reuse the name of an archived session."""
+    return {
+        session_name
+        for archive_path in get_archive_paths(session_group_path)
+        for session_name, _ in read_session_archive(archive_path)
+    }
+
+
+def iter_sessions(session_group_path: Path) -> Iterator[tuple[str, dict]]:
+    """Yield the name and data of every session in a session group directory, from both
+    <session_name>/exam_data.json directories and archives.  A session directory takes
+    precedence over an archived copy of the same session."""
+    session_json_paths = {
+        exam_path.name: exam_path / "exam_data.json"
+        for exam_path in sorted(session_group_path.iterdir())
+        if (exam_path / "exam_data.json").exists()
+    }
+
+    for session_name, exam_json_path in session_json_paths.items():
+        with open(exam_json_path, "r") as exam_json_file:
+            yield session_name, json.load(exam_json_file)
+
+    for archive_path in get_archive_paths(session_group_path):
+        for session_name, exam_data in read_session_archive(archive_path):
+            if session_name not in session_json_paths:
+                yield session_name, exam_data
+
+
+def archive_session_group(session_group_path: Path, suffix: str = ".gz") -> Path:
+    """Write every session directory in a session group to one archive named after the group,
+    e.g., sessions-001/sessions-001.archive.json.gz, and return its path.  Sessions already
+    in the archive are kept, so sessions whose directories were removed after an earlier
+    archive are not lost, and a session directory replaces its archived copy.  The session
+    directories are left in place; once the archive is checked they can be removed."""
+    archive_path = session_group_path / (
+        session_group_path.name + ARCHIVE_NAME_SUFFIX + suffix
+    )
+    sessions = dict(read_session_archive(archive_path)) if archive_path.exists() else {}
+    sessions.update(
+        {
+            exam_path.name: json.loads((exam_path / "exam_data.json").read_text())
+            for exam_path in sorted(session_group_path.iterdir())
+            if (exam_path / "exam_data.json").exists()
+        }
+    )
+    write_session_archive(archive_path, dict(sorted(sessions.items())))
+
+    return archive_path
+
+
+def main():
+    # archive the sessions for the question set and compare sizes
+    question_set_path = Path(__file__).parent.parent / "results" / "questions-02"
+    for session_group_path in sorted(question_set_path.iterdir()):
+        if not session_group_path.is_dir():
+            continue
+        session_size = sum(
+            path.stat().st_size for path in session_group_path.glob("*/exam_data.json")
+        )
+        if session_size == 0:
+            continue
+        archive_path = archive_session_group(session_group_path)
+        archive_size = archive_path.stat().st_size
+        print(
+            f"{session_group_path.name}: {session_size / 2**20:.2f} MiB of sessions, "
+            f"{archive_size / 2**20:.2f} MiB archive ({session_size / archive_size:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Vectorized paired sign tests between every pair of configurations, e.g., prompts, models, and
+parameter sets, with multiple-comparison correction.
+
+Configurations are compared on the questions both of them asked, from a configuration x question
+matrix of correct rates built from the response matrix (see response_matrix.py); a
+configuration with several sessions has the mean correctness of its sessions on each question.
+For each pair, the questions where one configuration did better and where the other did better
+are counted for every pair at once by comparing blocks of rows, and the exact two-sided sign
+test p-value is computed from binomial CDFs summed once for each distinct number of discordant
+questions.  With one session per configuration the rates are 0 or 1, and the sign test is the
+exact McNemar test on the discordant questions.
+
+Tens of thousands of pairs are then corrected together, with Holm's step-down method for the
+family-wise error rate or Benjamini-Hochberg for the false discovery rate, and the results are
+returned as configuration x configuration dataframes that can be printed or drawn as a
+heatmap, e.g.:
+    difference_df, p_value_df = paired_significance_matrices(
+        response_matrix, ["prompt_methods", "temperatures"], correction="holm"
+    )
+"""
+
+# packages
+import numpy
+import pandas
+
+# project imports
+from response_matrix import ResponseMatrix
+
+# multiple-comparison corrections
+CORRECTIONS = ["holm", "fdr_bh", "none"]
+
+# maximum configuration x configuration x question comparisons held in memory at once
+MAX_BLOCK_COMPARISONS = 20_000_000
+
+
+def get_configuration_rates(
+    matrix: ResponseMatrix, dimensions: list[str]
+) -> tuple[pandas.Index, numpy.ndarray]:
+    """Return the configuration index over the given session metadata arrays, e.g.,
+    ["model_names", "prompt_methods", "temperatures"], and the configuration x question matrix
+    of the mean correctness of each configuration's sessions, NaN where none asked."""
+    session_df = pandas.DataFrame(
+        {dimension: getattr(matrix, dimension) for dimension in dimensions}
+    )
+    configuration_ids, configuration_index = pandas.MultiIndex.from_frame(
+        session_df
+    ).factorize(sort=True)
+    if len(dimensions) == 1:
+        configuration_index = configuration_index.get_level_values(0)
+
+    # sum the sessions of each configuration with a one-hot matrix product
+    membership = (
+        configuration_ids[None, :] == numpy.arange(len(configuration_index))[:, None]
+    ).astype(numpy.float64)
+    asked = numpy.asarray(matrix.asked, dtype=numpy.float64)
+    correct = numpy.asarray(matrix.correct == 1, dtype=numpy.float64)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        rates = (membership @ correct) / (membership @ asked)
+
+    return configuration_index, rates
+
+
+def get_sign_test_counts(rates: numpy.ndarray) -> numpy.ndarray:
+    """Return the configuration x configuration matrix of the number of questions on which the
+    row configuration did better than the column one; comparisons with NaN count for
+    neither.  The losses are the transpose."""
+    num_configurations, num_questions = rates.shape
+    num_wins = numpy.zeros((num_configurations, num_configurations), dtype=numpy.int64)
+    block_size = max(MAX_BLOCK_COMPARISONS // max(num_configurations * num_questions, 1), 1)
+    for block_start in range(0, num_configurations, block_size):
+        block_rates = rates[block_start : block_start + block_size]
+        num_wins[block_start : block_start + block_size] = (
+            block_rates[:, None, :] > rates[None, :, :]
+        ).sum(axis=2)
+    return num_wins
+
+
+def get_binomial_cdf(num_trials: numpy.ndarray, num_successes: numpy.ndarray) -> numpy.ndarray:
+    """Return P(X <= k) for X ~ Binomial(n, 1/2) for each n in num_trials and k in
+    num_successes, from log factorials so that large n does not overflow.  The CDF is summed
+    only up to the largest k needed for each distinct n, so memory grows with the number of
+    distinct n rather than with the square of the largest."""
+    num_trials, num_successes = numpy.broadcast_arrays(num_trials, num_successes)
+    flat_trials, flat_successes = num_trials.ravel(), num_successes.ravel()
+    max_trials = int(flat_trials.max(initial=0))
+    log_factorials = numpy.concatenate(
+        [[0.0], numpy.cumsum(numpy.log(numpy.arange(1, max_trials + 1)))]
+    )
+
+    # group the entries by n and sum the probabilities of each group's n once
+    cdf_values = numpy.empty(len(flat_trials))
+    unique_trials, trial_ids, trial_counts = numpy.unique(
+        flat_trials, return_inverse=True, return_counts=True
+    )
+    order = numpy.argsort(trial_ids.ravel(), kind="stable")
+    group_ends = numpy.cumsum(trial_counts)
+    for trials, group_start, group_end in zip(
+        unique_trials.tolist(), group_ends - trial_counts, group_ends
+    ):
+        group_indexes = order[group_start:group_end]
+        group_successes = flat_successes[group_indexes]
+        successes = numpy.arange(min(int(group_successes.max()), trials) + 1)
+        probabilities = numpy.exp(
+            log_factorials[trials]
+            - log_factorials[successes]
+            - log_factorials[trials - successes]
+            - trials * numpy.log(2.0)
+        )
+        cdf = numpy.minimum(numpy.cumsum(probabilities), 1.0)
+        cdf_values[group_indexes] = cdf[numpy.minimum(group_successes, trials)]
+    return cdf_values.reshape(num_trials.shape)
+
+
+def get_sign_test_p_values(num_wins: numpy.ndarray) -> numpy.ndarray:
+    """Return the matrix of exact two-sided sign test p-values for the win counts, 1.0 where
+    there are no discordant questions."""
+    num_discordant = num_wins + num_wins.T
+    tail_probabilities = get_binomial_cdf(num_discordant, numpy.minimum(num_wins, num_wins.T))
+    return numpy.minimum(2.0 * tail_probabilities, 1.0)
+
+
+def adjust_p_values(p_value_matrix: numpy.ndarray, correction: str = "holm") -> numpy.ndarray:
+    """Return the symmetric matrix of p-values adjusted over the family of distinct pairs,
+    i.e., the upper triangle, with "holm", "fdr_bh" (Benjamini-Hochberg), or "none"."""
+    if correction not in CORRECTIONS:
+        raise ValueError(f"Unknown correction {correction}")
+    adjusted_matrix = numpy.array(p_value_matrix, dtype=numpy.float64)
+    if correction == "none":
+        return adjusted_matrix
+
+    row_indexes, column_indexes = numpy.triu_indices(len(p_value_matrix), k=1)
+    p_values = adjusted_matrix[row_indexes, column_indexes]
+    num_tests = len(p_values)
+    order = numpy.argsort(p_values, kind="stable")
+    sorted_p_values = p_values[order]
+    ranks = numpy.arange(1, num_tests + 1)
+    if correction == "holm":
+        # step down: the k-th smallest is scaled by (m - k + 1) and kept non-decreasing
+        sorted_adjusted = numpy.maximum.accumulate((num_tests - ranks + 1) * sorted_p_values)
+    else:
+        # step up: the k-th smallest is scaled by m / k and kept non-increasing from the top
+        sorted_adjusted = numpy.minimum.accumulate(
+            (num_tests / ranks * sorted_p_values)[::-1]
+        )[::-1]
+
+    adjusted_p_values = numpy.empty(num_tests)
+    adjusted_p_values[order] = numpy.minimum(sorted_adjusted, 1.0)
+    adjusted_matrix[row_indexes, column_indexes] = adjusted_p_values
+    adjusted_matrix[column_indexes, row_indexes] = adjusted_p_values
+    return adjusted_matrix
+
+
+def get_paired_differences(rates: numpy.ndarray) -> numpy.ndarray:
+    """Return the matrix of the row configuration's mean rate minus the column one's over the
+    questions both asked, NaN where they share no questions."""
+    asked = (~numpy.isnan(rates)).astype(numpy.float64)
+    filled_rates = numpy.nan_to_num(rates)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return (filled_rates @ asked.T - asked @ filled_rates.T) / (asked @ asked.T)
+
+
+def paired_significance_matrices(
+    matrix: ResponseMatrix, dimensions: list[str], correction: str = "holm"
+) -> tuple[pandas.DataFrame, pandas.DataFrame]:
+    """Compare every pair of configurations over the given dimensions with paired sign tests
+    and return two configuration x configuration dataframes:
+        - the row configuration's accuracy minus the column one's on their shared questions
+        - the sign test p-values, adjusted for multiple comparisons over all pairs
+    """
+    configuration_index, rates = get_configuration_rates(matrix, dimensions)
+    p_value_matrix = adjust_p_values(
+        get_sign_test_p_values(get_sign_test_counts(rates)), correction
+    )
+    return (
+        pandas.DataFrame(
+            get_paired_differences(rates), index=configuration_index, columns=configuration_index
+        ),
+        pandas.DataFrame(p_value_matrix, index=configuration_index, columns=configuration_index),
+    )
@@ -0,0 +1,391 @@
+"""
+Generate synthetic question banks and exam sessions for scale testing.
+
+Question banks are written in the same <S>/<Q>/<A> dialect as data/questions_02.txt, with text
+sampled from the vocabulary of the real bank so that token and line statistics look realistic.
+A configurable share of questions are reworded copies of earlier questions.
+
+Sessions have the same structure as the exam_data.json files written by the runners.  Each model
+response is generated by filling in the answer format requested by the session's prompt style,
+e.g., "First Choice: <LETTER>" or "Best Choice: <CHOICE>", so every generate_prompt_* style gets
+responses in its own format; styles without a format, like 021, get a single answer token with
+logprobs.  A configurable share of responses are malformed in the ways real models fail.
+
+For example, to write a 100k-question bank and 10k sessions over 208 questions each:
+    write_synthetic_sweep(Path("results/synthetic"), num_questions=100000, num_sessions=10000)
+"""
+
+# imports
+import datetime
+import json
+import math
+import random
+import re
+from pathlib import Path
+
+# project imports
+import prompts
+from question_data import parse_question_source
+
+DATA_PATH = Path(__file__).parent.parent / "data"
+RESULTS_PATH = Path(__file__).parent.parent / "results"
+
+# sections of the synthetic bank
+SECTIONS = ["REG", "FAR", "AUD", "BEC"]
+
+# choice letters for multiple choice questions
+CHOICE_LETTERS = ["A", "B", "C", "D"]
+
+# prompt styles for synthetic sessions
+SESSION_PROMPT_METHODS = [f"generate_prompt_{i:03d}" for i in range(11, 22)]
+
+# citations used to fill reference placeholders
+CITATIONS = [
+    "IRC § 162",
+    "IRC § 1031",
+    "IRC § 6694",
+    "Treas. Reg. § 1.263(a)-1",
+    "Circular 230 § 10.22",
+    "ASC 606",
+    "ASC 842",
+    "ASC 350-20",
+    "AU-C 240",
+    "AU-C 315",
+    "AT-C 205",
+    "GASB Statement No. 34",
+]
+
+# kinds of malformed responses
+MALFORMED_KINDS = [
+    "failed_request",
+    "empty",
+    "prose",
+    "truncated",
+    "bad_letter",
+]
+
+# a placeholder such as <LETTER> in a prompt's answer format, with the field label before it
+PLACEHOLDER_PATTERN = re.compile(r"([A-Za-z ]*):?\s*<([^>]+)>")
+
+
+def load_vocabulary(question_file: Path = DATA_PATH / "questions_02.txt") -> list[str]:
+    """Return the words of the real question bank, with a small fallback vocabulary if the
+    bank is not available."""
+    if not question_file.exists():
+        return "the of a to and in is for tax entity income audit revenue lease asset".split()
+    words = []
+    for question in parse_question_source(question_file):
+        words.extend(question["question"].split())
+        for choice_text in question["choices"].values():
+            words.extend(choice_text.split())
+    return words
+
+
+def generate_sentence(
+    rng: random.Random, vocabulary: list[str], min_words: int, max_words: int
+) -> str:
+    """Return a sentence of words sampled from the vocabulary."""
+    words = rng.choices(vocabulary, k=rng.randint(min_words, max_words))
+    return " ".join(words).strip().rstrip(".?") + "."
+
+
+def reword_text(rng: random.Random, vocabulary: list[str], text: str, rate: float = 0.1) -> str:
+    """Return the text with a share of its words replaced, for near-duplicate questions."""
+    words = text.split()
+    for i in range(len(words)):
+        if rng.random() < rate:
+            words[i] = rng.choice(vocabulary)
+    return " ".join(words)
+
+
+def generate_question_bank(
+    num_questions: int,
+    seed: int = 0,
+    duplicate_rate: float = 0.02,
+    vocabulary: list[str] | None = None,
+) -> str:
+    """Return the text of a synthetic question bank in the questions_02.txt dialect with
+    num_questions multiple choice questions split evenly across the sections."""
+    rng = random.Random(seed)
+    vocabulary = vocabulary or load_vocabulary()
+
+    question_list = []
+    for question_index in range(num_questions):
+        if len(question_list) > 0 and rng.random() < duplicate_rate:
+            # reword an earlier question and its choices
+            question, choices, answer = rng.choice(question_list)
+            question = reword_text(rng, vocabulary, question)
+            choices = [reword_text(rng, vocabulary, choice) for choice in choices]
+        else:
+            question = generate_sentence(rng, vocabulary, 12, 40).rstrip(".") + "?"
+            choices = [generate_sentence(rng, vocabulary, 3, 20) for _ in CHOICE_LETTERS]
+            answer = rng.choice(CHOICE_LETTERS)
+        question_list.append((question, choices, answer))
+
+    # write the sections in the source dialect
+    section_size = math.ceil(num_questions / len(SECTIONS))
+    bank_lines = []
+    for section_index, section_name in enumerate(SECTIONS):
+        section_questions = question_list[
+            section_index * section_size : (section_index + 1) * section_size
+        ]
+        if len(section_questions) == 0:
+            continue
+        bank_lines.append(f"<S>{section_name}")
+        for question_number, (question, choices, answer) in enumerate(
+            section_questions, start=1
+        ):
+            bank_lines.append(f"<Q>{question_number}. {question}")
+            for letter, choice in zip(CHOICE_LETTERS, choices):
+                bank_lines.append(f"{letter}. {choice}")
+            bank_lines.append(f"<A>{answer}")
+            bank_lines.append("")
+
+    return "\n".join(bank_lines)
+
+
+def rank_choices(rng: random.Random, question: dict, accuracy: float) -> list[str]:
+    """Return the choice letters in the order a synthetic model ranks them, with the correct
+    answer first with probability accuracy."""
+    letters = list(question["choices"])
+    rng.shuffle(letters)
+    if question["answer"] in letters:
+        letters.remove(question["answer"])
+        position = 0 if rng.random() < accuracy else rng.randint(1, len(letters))
+        letters.insert(position, question["answer"])
+    return letters
+
+
+def fill_answer_format(
+    rng: random.Random, vocabulary: list[str], prompt: str, ranking: list[str]
+) -> str | None:
+    """Return a response that fills in the answer format requested by the prompt, or None if
+    the prompt does not request one."""
+    field_letters = {
+        "First Choice": ranking[0],
+        "Best Choice": ranking[0],
+        "Choice": ranking[0],
+        "Second Choice": ranking[1 % len(ranking)],
+        "Third Choice": ranking[2 % len(ranking)],
+        "Worst Choice": ranking[-1],
+    }
+
+    response_lines = []
+    for line in prompt.splitlines():
+        if "<" not in line or ">" not in line:
+            continue
+
+        def fill_placeholder(match: re.Match) -> str:
+            label = match.group(1).strip()
+            placeholder = match.group(2)
+            prefix = f"{label}: " if len(label) > 0 else " "
+            if placeholder in ("LETTER", "CHOICE"):
+                return prefix + field_letters.get(label, ranking[0])
+            elif placeholder.startswith("REFERENCES"):
+                return prefix + "; ".join(rng.sample(CITATIONS, k=rng.randint(1, 3)))
+            elif placeholder.startswith("EXPLA"):
+                return prefix + " ".join(
+                    generate_sentence(rng, vocabulary, 8, 30)
+                    for _ in range(rng.randint(1, 4))
+                )
+            return prefix + ranking[0]
+
+        response_lines.append(PLACEHOLDER_PATTERN.sub(fill_placeholder, line).strip())
+
+    if len(response_lines) == 0:
+        return None
+    return "\n".join(response_lines)
+
+
+def malform_response(
+    rng: random.Random, vocabulary: list[str], response_text: str
+) -> str | None:
+    """Return a malformed version of a response, or None for a failed request."""
+    malformed_kind = rng.choice(MALFORMED_KINDS)
+    if malformed_kind == "failed_request":
+        return None
+    elif malformed_kind == "empty":
+        return ""
+    elif malformed_kind == "prose":
+        return generate_sentence(rng, vocabulary, 10, 40)
+    elif malformed_kind == "truncated":
+        return response_text[: rng.randint(0, max(len(response_text) // 4, 1))]
+    return re.sub(r": ([A-D])\b", ": Option E", response_text, count=1)
+
+
+def make_response(
+    rng: random.Random,
+    model_name: str,
+    created: int,
+    text: str,
+    prompt: str,
+    logprobs: dict | None = None,
+) -> dict:
+    """Return a completion response dictionary for the text, with usage estimated from the
+    word counts."""
+    prompt_tokens = int(len(prompt.split()) * 1.3)
+    completion_tokens = max(int(len(text.split()) * 1.3), 1)
+    return {
+        "id": f"cmpl-synthetic-{rng.getrandbits(64):016x}",
+        "object": "text_completion",
+        "created": created,
+        "model": model_name,
+        "choices": [
+            {
+                "text": text,
+                "index": 0,
+                "logprobs": logprobs,
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def generate_session(
+    question_list: list[dict],
+    prompt_method_name: str,
+    model_name: str = "text-davinci-003",
+    parameters: dict | None = None,
+    accuracy: float = 0.55,
+    malformed_rate: float = 0.02,
+    seed: int = 0,
+    vocabulary: list[str] | None = None,
+) -> dict:
+    """Return a synthetic exam session over the question list in the runners' format."""
+    rng = random.Random(seed)
+    vocabulary = vocabulary or load_vocabulary()
+    prompt_method = getattr(prompts, prompt_method_name)
+    parameters = parameters or {
+        "temperature": 0.0,
+        "max_tokens": 256,
+        "top_p": 1,
+        "best_of": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0,
+    }
+
+    start_time = datetime.datetime(2023, 1, 1) + datetime.timedelta(
+        seconds=rng.randint(0, 10**7)
+    )
+    exam_data = {
+        "model_name": model_name,
+        "question_set": "synthetic",
+        "prompt_method": prompt_method_name,
+        "scoring_mode": "completion",
+        "parameters": parameters,
+        "start_time": start_time.isoformat(),
+        "end_time": None,
+        "questions": [],
+    }
+
+    created = int(start_time.timestamp())
+    for question in question_list:
+        prompt = prompt_method(question)
+        ranking = rank_choices(rng, question, accuracy)
+        response_text = fill_answer_format(rng, vocabulary, prompt, ranking)
+
+        question_data = {
+            "question_input": question,
+            "model_prompt": prompt,
+            "model_response": None,
+        }
+
+        if response_text is None:
+            # prompts without an answer format get a single answer token with logprobs
+            exam_data["scoring_mode"] = "logprob"
+            top_logprobs = {
+                f" {letter}": -float(rank) - rng.random()
+                for rank, letter in enumerate(ranking)
+            }
+            question_data["model_response"] = make_response(
+                rng,
+                model_name,
+                created,
+                f" {ranking[0]}",
+                prompt,
+                {"tokens": [f" {ranking[0]}"], "top_logprobs": [top_logprobs]},
+            )
+            question_data["answer_ranking"] = ranking
+            question_data["answer_logprobs"] = {
+                letter.strip(): logprob for letter, logprob in top_logprobs.items()
+            }
+        else:
+            if rng.random() < malformed_rate:
+                response_text = malform_response(rng, vocabulary, response_text)
+            if response_text is not None:
+                question_data["model_response"] = make_response(
+                    rng, model_name, created, response_text, prompt
+                )
+
+        exam_data["questions"].append(question_data)
+
+    # roughly three seconds per question
+    exam_data["end_time"] = (
+        start_time + datetime.timedelta(seconds=3 * len(question_list))
+    ).isoformat()
+
+    return exam_data
+
+
+def write_synthetic_sweep(
+    output_path: Path,
+    num_questions: int = 100000,
+    num_sessions: int = 10000,
+    questions_per_session: int = 208,
+    malformed_rate: float = 0.02,
+    seed: int = 0,
+) -> None:
+    """Write a synthetic question bank and a sweep of sessions to the output path:
+        - <output_path>/questions_synthetic.txt
+        - <output_path>/sessions/cpa-exam-00001/exam_data.json, ...
+    Each session asks the first questions_per_session questions of the bank in bank order, as
+    the runners ask every session the same questions in the same order, so that the results
+    cubes, which key questions by position, line up across sessions.  Sessions cycle through
+    the prompt styles, temperatures, and a range of model accuracies.
+    """
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary()
+
+    # write and parse the bank so sessions use exactly what the parser returns
+    output_path.mkdir(parents=True, exist_ok=True)
+    question_file = output_path / "questions_synthetic.txt"
+    question_file.write_text(
+        generate_question_bank(num_questions, seed=seed, vocabulary=vocabulary)
+    )
+    question_list = parse_question_source(question_file)
+
+    session_root_path = output_path / "sessions"
+    session_root_path.mkdir(exist_ok=True)
+    session_questions = question_list[:questions_per_session]
+    for session_number in range(1, num_sessions + 1):
+        exam_data = generate_session(
+            session_questions,
+            SESSION_PROMPT_METHODS[session_number % len(SESSION_PROMPT_METHODS)],
+            parameters={
+                "temperature": [0.0, 0.5, 1.0][session_number % 3],
+                "max_tokens": 256,
+                "top_p": 1,
+                "best_of": 1,
+                "frequency_penalty": 0,
+                "presence_penalty": 0,
+            },
+            accuracy=rng.uniform(0.3, 0.65),
+            malformed_rate=malformed_rate,
+            seed=seed + session_number,
+            vocabulary=vocabulary,
+        )
+        exam_data["question_set"] = question_file.name
+
+        session_path = session_root_path / f"cpa-exam-{session_number:05d}"
+        session_path.mkdir(exist_ok=True)
+        with open(session_path / "exam_data.json", "wt", encoding="utf-8") as output_file:
+            json.dump(exam_data, output_file)
+
+
+if __name__ == "__main__":
+    write_synthetic_sweep(RESULTS_PATH / "synthetic", num_questions=100000, num_sessions=10000)
@@ -0,0 +1,9 @@
+"""
+Make the flat src/ modules importable from the tests, as they are when the scripts run.
+"""
+
+# imports
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
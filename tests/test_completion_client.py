@@ -0,0 +1,183 @@
+"""
+Exercise the completion client's connection pool, timeouts, cancellation, and stale connection
+handling against the local completion server.
+"""
+
+# imports
+import http.client
+import threading
+import time
+
+# packages
+import openai.error
+import pytest
+
+# project imports
+from completion_client import CompletionCancelled, CompletionClient, RequestHandle
+from local_completion_server import get_local_api_base, start_local_server
+
+# a prompt with an answer format for the local server to fill in
+PROMPT = "Question: Which is correct?\nChoice: <LETTER>\nExplanation: <EXPLANATION>\n"
+
+
+@pytest.fixture
+def server():
+    local_server = start_local_server()
+    yield local_server
+    local_server.shutdown()
+
+
+def get_client(local_server, **kwargs) -> CompletionClient:
+    return CompletionClient("test", api_base=get_local_api_base(local_server), **kwargs)
+
+
+def test_sequential_requests_reuse_one_connection(server) -> None:
+    client = get_client(server)
+    for _ in range(5):
+        response = client.create(model="text-davinci-003", prompt=PROMPT, max_tokens=64)
+        assert response["choices"][0]["text"].startswith("Choice: ")
+
+    stats = client.get_pool_stats()
+    assert stats["num_requests"] == 5
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 4
+    assert stats["reuse_rate"] == 0.8
+    assert stats["idle_connections"] == 1
+    assert server.num_connections == 1
+
+
+def test_concurrent_requests_stay_within_the_pool_size() -> None:
+    server = start_local_server(latency_seconds=0.05)
+    client = get_client(server, pool_size=2)
+    threads = [
+        threading.Thread(
+            target=client.create, kwargs={"model": "text-davinci-003", "prompt": PROMPT}
+        )
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    stats = client.get_pool_stats()
+    assert stats["num_requests"] == server.num_requests == 6
+    assert stats["connections_opened"] == server.num_connections == 2
+    assert stats["open_connections"] == 2
+
+
+def test_stop_sequences_end_the_completion(server) -> None:
+    client = get_client(server)
+    response = client.create(model="text-davinci-003", prompt=PROMPT, stop=["Explanation:"])
+    assert response["choices"][0]["text"].startswith("Choice: ")
+    assert "Explanation:" not in response["choices"][0]["text"]
+
+
+def test_error_responses_raise_openai_errors() -> None:
+    server = start_local_server(failure_rate=1.0)
+    client = get_client(server)
+    with pytest.raises(openai.error.RateLimitError) as error_info:
+        client.create(model="text-davinci-003", prompt=PROMPT)
+    server.shutdown()
+    assert error_info.value.http_status == 429
+
+    # the error response was read, so its connection is still usable
+    assert client.get_pool_stats()["idle_connections"] == 1
+
+
+def test_read_timeout_raises_and_discards_the_connection() -> None:
+    server = start_local_server(latency_seconds=1.0)
+    client = get_client(server, read_timeout=0.1)
+    start_time = time.perf_counter()
+    with pytest.raises(openai.error.Timeout):
+        client.create(model="text-davinci-003", prompt=PROMPT)
+    assert time.perf_counter() - start_time < 0.9
+    server.shutdown()
+
+    stats = client.get_pool_stats()
+    assert stats["connections_discarded"] == 1
+    assert stats["open_connections"] == 0
+
+
+def test_cancel_interrupts_a_request_from_another_thread() -> None:
+    server = start_local_server(latency_seconds=1.0)
+    client = get_client(server)
+    handle = RequestHandle()
+    threading.Timer(0.1, handle.cancel).start()
+    with pytest.raises(CompletionCancelled):
+        client.create(model="text-davinci-003", prompt=PROMPT, handle=handle)
+    server.shutdown()
+    assert client.get_pool_stats()["open_connections"] == 0
+
+
+def test_closing_a_stream_early_discards_its_connection(server) -> None:
+    client = get_client(server)
+    stream = client.create(model="text-davinci-003", prompt=PROMPT, stream=True)
+    chunk = next(iter(stream))
+    assert chunk["choices"][0]["finish_reason"] is None
+    stream.close()
+    assert client.get_pool_stats()["connections_discarded"] == 1
+
+    # a stream read to the end returns its connection, with the usage on the last chunk
+    stream = client.create(model="text-davinci-003", prompt=PROMPT, stream=True)
+    chunks = list(stream)
+    stream.close()
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+    assert chunks[-1]["usage"]["completion_tokens"] > 0
+    assert client.get_pool_stats()["idle_connections"] == 1
+
+
+def test_idle_connections_closed_by_the_server_are_replaced() -> None:
+    server = start_local_server(idle_timeout_seconds=0.05)
+    client = get_client(server)
+    client.create(model="text-davinci-003", prompt=PROMPT)
+    time.sleep(0.3)
+    client.create(model="text-davinci-003", prompt=PROMPT)
+    server.shutdown()
+
+    stats = client.get_pool_stats()
+    assert stats["connections_opened"] == 2
+    assert stats["connections_reused"] == 0
+    assert stats["connections_discarded"] == 1
+    assert server.num_requests == 2
+
+
+def test_failed_write_to_a_reused_connection_is_sent_again(server, monkeypatch) -> None:
+    client = get_client(server)
+    client.create(model="text-davinci-003", prompt=PROMPT)
+
+    # the idle connection fails before the request is written, e.g., a closed socket
+    def fail_request(*args, **kwargs) -> None:
+        raise BrokenPipeError()
+
+    monkeypatch.setattr(client.pool.idle_connections[0], "request", fail_request)
+    response = client.create(model="text-davinci-003", prompt=PROMPT)
+    assert response["choices"][0]["text"].startswith("Choice: ")
+    assert server.num_requests == 2
+    assert client.get_pool_stats()["connections_opened"] == 2
+
+
+def test_failed_read_after_the_request_was_written_is_not_sent_again(server, monkeypatch) -> None:
+    client = get_client(server)
+    client.create(model="text-davinci-003", prompt=PROMPT)
+
+    # the request is written, then the server disconnects before the response
+    connection = client.pool.idle_connections[0]
+    write_request = connection.request
+
+    def disconnect_after_request(*args, **kwargs) -> None:
+        write_request(*args, **kwargs)
+        connection.getresponse = fail_response
+
+    def fail_response() -> None:
+        raise http.client.RemoteDisconnected("Remote end closed connection")
+
+    monkeypatch.setattr(connection, "request", disconnect_after_request)
+    with pytest.raises(openai.error.APIConnectionError):
+        client.create(model="text-davinci-003", prompt=PROMPT)
+
+    # the server got the written request once and the client did not send it again
+    time.sleep(0.05)
+    assert server.num_requests == 2
+    assert client.get_pool_stats()["connections_opened"] == 1
@@ -0,0 +1,109 @@
+"""
+Run exam sessions against the local completion server and check what they save.
+"""
+
+# imports
+from pathlib import Path
+
+# packages
+import openai
+import pytest
+
+# project imports
+from completion_client import CompletionClient
+from exam_session import get_runner_session_kwargs, load_runner_questions, run_exam_session
+from local_completion_server import get_local_api_base, start_local_server
+from prompts import generate_prompt_020
+from question_data import parse_question_source
+from score_exam import score_exam_records
+from synthetic_data import DATA_PATH
+
+# sampled parameters without reranking
+PARAMETERS = {
+    "temperature": 0.7,
+    "max_tokens": 64,
+    "top_p": 1.0,
+    "best_of": 1,
+    "frequency_penalty": 0.0,
+    "presence_penalty": 0.0,
+}
+
+
+def test_samples_keep_the_callers_best_of(tmp_path: Path) -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")[:5]
+    server = start_local_server()
+    try:
+        exam_data = run_exam_session(
+            "text-davinci-003",
+            generate_prompt_020,
+            PARAMETERS,
+            question_list,
+            "questions_02.txt",
+            tmp_path,
+            num_samples=3,
+            client=CompletionClient("test", api_base=get_local_api_base(server)),
+        )
+    finally:
+        server.shutdown()
+
+    # the request asked for n=3 completions, but the session is still a best_of=1 session
+    assert exam_data["parameters"] == PARAMETERS
+    assert exam_data["num_samples"] == 3
+    assert all(
+        len(question["model_response"]["choices"]) == 3 for question in exam_data["questions"]
+    )
+    exam_records = score_exam_records(exam_data)
+    assert {record["best_of"] for record in exam_records} == {1}
+    assert {record["sample_index"] for record in exam_records} == {0, 1, 2}
+
+
+def test_two_phase_answers_stop_before_the_explanation(tmp_path: Path) -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")[:5]
+    server = start_local_server()
+    try:
+        exam_data = run_exam_session(
+            "text-davinci-003",
+            generate_prompt_020,
+            PARAMETERS,
+            question_list,
+            "questions_02.txt",
+            tmp_path,
+            scoring_mode="two_phase",
+            explanation_policy="all",
+            client=CompletionClient("test", api_base=get_local_api_base(server)),
+        )
+    finally:
+        server.shutdown()
+
+    # the first pass stops at "Explanation:" and the second pass asks for the explanation
+    for question in exam_data["questions"]:
+        assert "Explanation:" not in question["model_response"]["choices"][0]["text"]
+        assert question["explanation_response"] is not None
+    assert server.num_requests == 2 * len(question_list)
+
+
+def test_runner_settings_run_a_session(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # the runners set the key on the openai module before creating their client
+    monkeypatch.setattr(openai, "api_key", "test")
+    question_list, question_set_name = load_runner_questions(DATA_PATH / "questions_02.txt")
+    assert question_set_name == "questions_02.txt"
+    assert len(question_list) == len(parse_question_source(DATA_PATH / "questions_02.txt"))
+
+    session_kwargs = get_runner_session_kwargs()
+    assert isinstance(session_kwargs["client"], CompletionClient)
+    server = start_local_server()
+    try:
+        session_kwargs["client"] = CompletionClient("test", api_base=get_local_api_base(server))
+        exam_data = run_exam_session(
+            "text-davinci-003",
+            generate_prompt_020,
+            PARAMETERS,
+            question_list[:5],
+            question_set_name,
+            tmp_path,
+            **session_kwargs,
+        )
+    finally:
+        server.shutdown()
+    assert len(exam_data["questions"]) == 5
+    assert exam_data["end_time"] is not None
@@ -0,0 +1,115 @@
+"""
+Check the few-shot neighbor table against a brute-force BM25 ranking and its exclusions.
+"""
+
+# imports
+import collections
+import math
+
+# packages
+import pytest
+
+# project imports
+from few_shot_index import BM25_B, BM25_K1, FewShotIndex, get_few_shot_prompt_method
+from question_data import parse_question_source
+from question_duplicates import get_question_id, normalize_question_text
+from synthetic_data import DATA_PATH
+
+
+def get_brute_force_neighbors(
+    question_list: list[dict], num_neighbors: int, exclude_same_section: bool
+) -> list[list[int]]:
+    """Rank every eligible question for every question by BM25 over the distinct words of
+    the question, one pair at a time."""
+    question_words = [normalize_question_text(question).split() for question in question_list]
+    term_counts = [collections.Counter(words) for words in question_words]
+    document_frequencies = collections.Counter(
+        word for counts in term_counts for word in counts
+    )
+    mean_length = max(sum(map(len, question_words)) / len(question_words), 1.0)
+    num_questions = len(question_list)
+
+    def get_weight(word: str, document_index: int) -> float:
+        term_count = term_counts[document_index][word]
+        inverse_frequency = math.log(
+            1.0
+            + (num_questions - document_frequencies[word] + 0.5)
+            / (document_frequencies[word] + 0.5)
+        )
+        length_norm = BM25_K1 * (
+            1.0 - BM25_B + BM25_B * len(question_words[document_index]) / mean_length
+        )
+        return inverse_frequency * term_count * (BM25_K1 + 1.0) / (term_count + length_norm)
+
+    neighbors = []
+    for query_index, query in enumerate(question_list):
+        scores = []
+        for document_index, document in enumerate(question_list):
+            if (
+                document_index == query_index
+                or document["question_type"] != query["question_type"]
+                or (
+                    exclude_same_section
+                    and document["question_section"] == query["question_section"]
+                )
+            ):
+                continue
+            score = sum(
+                get_weight(word, document_index)
+                for word in term_counts[query_index]
+                if word in term_counts[document_index]
+            )
+            scores.append((-score, document_index))
+        neighbors.append([document_index for _, document_index in sorted(scores)[:num_neighbors]])
+    return neighbors
+
+
+@pytest.fixture(scope="module")
+def question_list() -> list[dict]:
+    # every fourth question, so that every section is included
+    return parse_question_source(DATA_PATH / "questions_02.txt")[::4]
+
+
+@pytest.mark.parametrize("exclude_same_section", [False, True])
+def test_neighbor_table_matches_brute_force_bm25(
+    question_list: list[dict], exclude_same_section: bool
+) -> None:
+    few_shot_index = FewShotIndex(
+        question_list, num_neighbors=3, exclude_same_section=exclude_same_section
+    )
+    expected_neighbors = get_brute_force_neighbors(question_list, 3, exclude_same_section)
+    for question_index, question in enumerate(question_list):
+        exemplars = few_shot_index.get_exemplars(question)
+        assert [get_question_id(exemplar) for exemplar in exemplars] == [
+            get_question_id(question_list[index]) for index in expected_neighbors[question_index]
+        ]
+
+
+def test_exemplars_exclude_the_question_and_optionally_its_section(
+    question_list: list[dict],
+) -> None:
+    few_shot_index = FewShotIndex(question_list, num_neighbors=3, exclude_same_section=True)
+    for question in question_list:
+        for exemplar in few_shot_index.get_exemplars(question):
+            assert get_question_id(exemplar) != get_question_id(question)
+            assert exemplar["question_section"] != question["question_section"]
+            assert exemplar["question_type"] == question["question_type"]
+
+
+def test_neighbor_table_is_built_on_the_first_lookup(question_list: list[dict]) -> None:
+    few_shot_index = FewShotIndex(question_list, num_neighbors=2)
+    assert few_shot_index.neighbor_table is None
+    prompt_method = get_few_shot_prompt_method(few_shot_index)
+    assert prompt_method.__name__ == "generate_prompt_022"
+    prompt = prompt_method(question_list[0])
+    assert few_shot_index.neighbor_table.shape == (len(question_list), 2)
+    for exemplar in few_shot_index.get_exemplars(question_list[0]):
+        assert exemplar["question"] in prompt
+
+
+def test_unknown_and_repeated_questions_are_rejected(question_list: list[dict]) -> None:
+    with pytest.raises(ValueError):
+        FewShotIndex(question_list + question_list[:1])
+    few_shot_index = FewShotIndex(question_list[:10])
+    with pytest.raises(ValueError):
+        few_shot_index.get_exemplars(question_list[20])
@@ -0,0 +1,108 @@
+"""
+Check when requests are hedged, which response wins, and the latency and tokens recorded.
+"""
+
+# imports
+import threading
+import time
+
+# packages
+import pytest
+
+# project imports
+from completion_client import CompletionCancelled, RequestHandle
+from hedging import HedgePolicy, create_hedged_completion, is_hedging_safe
+
+
+class DelayedClient:
+    """A client whose n-th request takes the n-th delay and can be cancelled while waiting."""
+
+    def __init__(self, delays: list[float], prompt_tokens: list[int] | None = None):
+        self.delays = list(delays)
+        self.prompt_tokens = list(prompt_tokens or [10] * len(delays))
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    def create(self, model: str, prompt: str, handle: RequestHandle, **parameters) -> dict:
+        with self.lock:
+            request_index = self.num_requests
+            self.num_requests += 1
+        end_time = time.perf_counter() + self.delays[request_index]
+        while time.perf_counter() < end_time:
+            if handle.cancelled:
+                raise CompletionCancelled()
+            time.sleep(0.005)
+        return {
+            "choices": [{"text": f"response {request_index}"}],
+            "usage": {
+                "prompt_tokens": self.prompt_tokens[request_index],
+                "completion_tokens": 5,
+                "total_tokens": self.prompt_tokens[request_index] + 5,
+            },
+        }
+
+
+def get_warm_policy(hedge_delay: float) -> HedgePolicy:
+    """Return a policy that hedges after hedge_delay seconds."""
+    hedge_policy = HedgePolicy(percentile=95, min_samples=1, min_hedge_delay=hedge_delay)
+    hedge_policy.record_latency(0.0)
+    return hedge_policy
+
+
+def test_policy_waits_for_enough_latencies() -> None:
+    hedge_policy = HedgePolicy(percentile=50, min_samples=3, min_hedge_delay=0.0)
+    for latency in [1.0, 3.0]:
+        hedge_policy.record_latency(latency)
+    assert hedge_policy.get_hedge_delay() is None
+    hedge_policy.record_latency(2.0)
+    assert hedge_policy.get_hedge_delay() == 2.0
+
+
+def test_only_greedy_sampling_is_hedged() -> None:
+    assert is_hedging_safe({"temperature": 0})
+    assert not is_hedging_safe({"temperature": 0.7})
+    assert not is_hedging_safe({})
+
+
+def test_fast_requests_are_not_hedged() -> None:
+    client = DelayedClient([0.0])
+    response, hedge_metrics = create_hedged_completion(
+        client, get_warm_policy(0.5), "text-davinci-003", "prompt", {}
+    )
+    assert response["choices"][0]["text"] == "response 0"
+    assert client.num_requests == 1
+    assert not hedge_metrics["hedged"]
+
+
+def test_winning_hedge_records_the_latency_from_the_first_launch() -> None:
+    hedge_policy = get_warm_policy(0.1)
+    client = DelayedClient([2.0, 0.1])
+    response, hedge_metrics = create_hedged_completion(
+        client, hedge_policy, "text-davinci-003", "prompt", {}
+    )
+    assert response["choices"][0]["text"] == "response 1"
+    assert hedge_metrics["hedged"] and hedge_metrics["hedge_won"]
+
+    # the caller waited for the hedge delay plus the hedge's own latency
+    assert hedge_policy.latencies[-1] == pytest.approx(0.2, abs=0.08)
+
+    # the cancelled request reported no usage, so its prompt tokens are estimated
+    assert hedge_metrics["hedge_prompt_tokens"] == 10
+    assert hedge_metrics["hedge_completion_tokens"] == 0
+    assert hedge_metrics["hedge_tokens_estimated"]
+
+
+def test_failed_request_falls_back_to_the_other() -> None:
+    class FailingFirstClient(DelayedClient):
+        def create(self, model: str, prompt: str, handle: RequestHandle, **parameters) -> dict:
+            response = super().create(model, prompt, handle, **parameters)
+            if response["choices"][0]["text"] == "response 0":
+                raise RuntimeError("first request failed")
+            return response
+
+    client = FailingFirstClient([0.3, 0.1])
+    response, hedge_metrics = create_hedged_completion(
+        client, get_warm_policy(0.05), "text-davinci-003", "prompt", {}
+    )
+    assert response["choices"][0]["text"] == "response 1"
+    assert hedge_metrics["hedge_won"]
@@ -0,0 +1,86 @@
+"""
+Check that near-duplicate questions are found and removed, and that distinct ones are not.
+"""
+
+# imports
+import copy
+
+# packages
+import numpy
+
+# project imports
+from question_data import parse_question_source
+from question_duplicates import (
+    compute_minhash_signatures,
+    find_duplicate_clusters,
+    get_jaccard_similarity,
+    get_shingle_hashes,
+    remove_duplicate_questions,
+)
+from synthetic_data import DATA_PATH
+
+
+def get_reworded_copy(question: dict, section: str) -> dict:
+    """Return a copy of a question in another section with one word of its stem changed."""
+    reworded_question = copy.deepcopy(question)
+    reworded_question["question_section"] = section
+    reworded_question["question_number"] = 999
+    words = reworded_question["question"].split()
+    words[len(words) // 2] = "particular"
+    reworded_question["question"] = " ".join(words)
+    return reworded_question
+
+
+def test_reworded_question_is_clustered_with_the_original() -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")
+    original_clusters = find_duplicate_clusters(question_list)
+    question_list.append(get_reworded_copy(question_list[10], "AUD"))
+
+    # the copy adds one cluster and leaves the bank's own clusters as they were
+    duplicate_clusters = find_duplicate_clusters(question_list)
+    assert duplicate_clusters == sorted(original_clusters + [[10, len(question_list) - 1]])
+
+    # only the first question of each cluster is kept
+    deduplicated_list = remove_duplicate_questions(question_list, duplicate_clusters)
+    assert question_list[10] in deduplicated_list
+    assert question_list[-1] not in deduplicated_list
+
+
+def test_distinct_questions_are_not_clustered() -> None:
+    question_list = [
+        {
+            "question_section": "REG",
+            "question_number": 1,
+            "question": "Which form reports wages paid to an employee?",
+            "choices": {"A": "W-2", "B": "1099-NEC", "C": "K-1", "D": "1040"},
+        },
+        {
+            "question_section": "AUD",
+            "question_number": 1,
+            "question": "An auditor obtains an engagement letter before planning the audit.",
+            "choices": {"A": "True", "B": "False"},
+        },
+        {
+            "question_section": "FAR",
+            "question_number": 1,
+            "question": "Goodwill acquired in a business combination is tested for impairment.",
+            "choices": {"A": "Annually", "B": "Never"},
+        },
+    ]
+    assert find_duplicate_clusters(question_list) == []
+    assert remove_duplicate_questions(question_list, []) == question_list
+
+
+def test_minhash_estimates_the_jaccard_similarity() -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")[:40]
+    question_list.append(get_reworded_copy(question_list[0], "FAR"))
+    shingle_hashes, offsets = get_shingle_hashes(question_list)
+    signatures = compute_minhash_signatures(shingle_hashes, offsets)
+    assert signatures.shape[0] == len(question_list)
+
+    exact_similarity = get_jaccard_similarity(
+        shingle_hashes[offsets[0] : offsets[1]], shingle_hashes[offsets[-2] : offsets[-1]]
+    )
+    estimated_similarity = numpy.mean(signatures[0] == signatures[-1])
+    assert 0.5 < exact_similarity < 1.0
+    assert abs(estimated_similarity - exact_similarity) < 0.2
@@ -0,0 +1,136 @@
+"""
+Check the circuit breaker's state machine and the sweep budget, including a budget seeded from
+the sessions of a previous run.
+"""
+
+# imports
+import time
+
+# packages
+import pytest
+
+# project imports
+from question_data import parse_question_source
+from request_guards import (
+    BudgetExceededError,
+    CircuitBreaker,
+    CircuitOpenError,
+    GuardedClient,
+    TokenBudget,
+    get_session_charged_tokens,
+)
+from request_metrics import get_usage_tokens
+from synthetic_data import DATA_PATH, generate_session
+
+
+class CountingClient:
+    """A client that answers every request with a fixed usage and counts the requests."""
+
+    def __init__(self, total_tokens: int = 100):
+        self.total_tokens = total_tokens
+        self.num_requests = 0
+
+    def create(self, model: str, prompt: str, **parameters) -> dict:
+        self.num_requests += 1
+        return {"choices": [{"text": "Choice: A"}], "usage": {"total_tokens": self.total_tokens}}
+
+
+def get_tripped_breaker(**kwargs) -> CircuitBreaker:
+    """Return a breaker tripped by two failures out of two requests."""
+    circuit_breaker = CircuitBreaker(error_window=2, error_threshold=0.5, min_requests=2, **kwargs)
+    for _ in range(2):
+        assert not circuit_breaker.before_request()
+        circuit_breaker.record_failure(False)
+    return circuit_breaker
+
+
+def test_breaker_opens_probes_and_closes() -> None:
+    circuit_breaker = get_tripped_breaker(open_seconds=0.05)
+    assert circuit_breaker.get_stats()["state"] == "open"
+    assert circuit_breaker.get_stats()["num_trips"] == 1
+
+    # the first request after the cooldown is the probe, and its success closes the breaker
+    start_time = time.monotonic()
+    assert circuit_breaker.before_request()
+    assert time.monotonic() - start_time >= 0.04
+    assert circuit_breaker.get_stats()["state"] == "half_open"
+    circuit_breaker.record_success(True)
+    assert circuit_breaker.get_stats()["state"] == "closed"
+    assert not circuit_breaker.before_request()
+
+
+def test_breaker_stays_closed_below_the_threshold() -> None:
+    circuit_breaker = CircuitBreaker(error_window=4, error_threshold=0.5, min_requests=4)
+    for failed in [True, False, False, False, True, False]:
+        circuit_breaker.before_request()
+        if failed:
+            circuit_breaker.record_failure(False)
+        else:
+            circuit_breaker.record_success(False)
+    assert circuit_breaker.get_stats()["state"] == "closed"
+
+
+def test_failed_probes_back_off_and_give_up() -> None:
+    circuit_breaker = get_tripped_breaker(
+        open_seconds=0.01, max_open_seconds=0.02, max_failed_probes=3
+    )
+    for num_failed_probes in range(1, 3):
+        assert circuit_breaker.before_request()
+        circuit_breaker.record_failure(True)
+        assert circuit_breaker.get_stats()["state"] == "open"
+        assert circuit_breaker.get_stats()["num_failed_probes"] == num_failed_probes
+    assert circuit_breaker.open_seconds == 0.02
+
+    assert circuit_breaker.before_request()
+    circuit_breaker.record_failure(True)
+    assert circuit_breaker.get_stats()["state"] == "failed"
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+
+
+def test_cancelled_probe_lets_another_request_probe() -> None:
+    circuit_breaker = get_tripped_breaker(open_seconds=0.0)
+    assert circuit_breaker.before_request()
+    circuit_breaker.record_cancelled(True)
+    assert circuit_breaker.get_stats()["state"] == "half_open"
+    assert circuit_breaker.before_request()
+
+
+def test_budget_stops_requests_once_used_up() -> None:
+    client = CountingClient(total_tokens=100)
+    guarded_client = GuardedClient(client, budget=TokenBudget(max_tokens=250))
+    for _ in range(3):
+        guarded_client.create(model="text-davinci-003", prompt="prompt")
+    with pytest.raises(BudgetExceededError):
+        guarded_client.create(model="text-davinci-003", prompt="prompt")
+    assert client.num_requests == 3
+
+
+def test_budget_cost_uses_the_model_price() -> None:
+    budget = TokenBudget(max_cost=0.05, model_prices={"text-davinci-003": 0.02})
+    budget.charge("text-davinci-003", 2000)
+    assert budget.get_stats()["cost"] == pytest.approx(0.04)
+    assert not budget.is_exceeded()
+    budget.charge("text-davinci-003", 500)
+    assert budget.is_exceeded()
+
+
+def test_resumed_sweep_is_stopped_by_the_tokens_of_saved_sessions() -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")
+    exam_data = generate_session(question_list, "generate_prompt_020", malformed_rate=0.0)
+
+    # a saved session is charged with the usage of its responses
+    session_tokens = get_session_charged_tokens(exam_data)
+    assert session_tokens == sum(
+        get_usage_tokens(question["model_response"])["prompt_tokens"]
+        + get_usage_tokens(question["model_response"])["completion_tokens"]
+        for question in exam_data["questions"]
+    )
+
+    # a budget the previous run already used up sends nothing more
+    budget = TokenBudget(max_tokens=session_tokens)
+    budget.charge(exam_data["model_name"], session_tokens)
+    client = CountingClient()
+    with pytest.raises(BudgetExceededError):
+        GuardedClient(client, budget=budget).create(model="text-davinci-003", prompt="prompt")
+    assert client.num_requests == 0
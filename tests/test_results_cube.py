@@ -0,0 +1,70 @@
+"""
+Check that the results cube built from the scored results CSV and the one aggregated in the
+warehouse give the same bootstrap question matrices, and that synthetic sessions ask their
+questions in the same positions.
+"""
+
+# imports
+import json
+from pathlib import Path
+
+# packages
+import numpy
+import pandas
+
+# project imports
+from bootstrap import get_question_matrices
+from question_data import parse_question_source
+from results_cube import cube_session_count, load_results_cube
+from results_warehouse import connect_warehouse, ingest_session, query_results_cube
+from score_exam import score_exam_records
+from synthetic_data import DATA_PATH, generate_session, write_synthetic_sweep
+
+
+def test_cube_sources_give_the_same_question_matrices(tmp_path: Path) -> None:
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")
+    connection = connect_warehouse(tmp_path / "exam_results.sqlite")
+
+    exam_record_list = []
+    for session_index, prompt_method_name in enumerate(
+        ["generate_prompt_018", "generate_prompt_019", "generate_prompt_020"] * 2
+    ):
+        exam_data = generate_session(question_list, prompt_method_name, seed=session_index)
+        exam_records = score_exam_records(exam_data)
+        with connection:
+            ingest_session(
+                connection, "sessions-001", f"cpa-exam-{session_index:03d}", exam_data, exam_records
+            )
+        for record in exam_records:
+            record["session_name"] = f"cpa-exam-{session_index:03d}"
+        exam_record_list.extend(exam_records)
+
+    results_csv_path = tmp_path / "exam_results.csv"
+    pandas.DataFrame(exam_record_list).to_csv(results_csv_path, index=False)
+    csv_cube = load_results_cube(results_csv_path)
+    warehouse_cube = query_results_cube(connection, session_group="sessions-001")
+    connection.close()
+
+    assert cube_session_count(csv_cube) == cube_session_count(warehouse_cube) == 6
+    for dimensions in [["prompt_method"], ["prompt_method", "temperature"], ["question_section"]]:
+        csv_index, csv_correct, csv_count = get_question_matrices(csv_cube, dimensions)
+        warehouse_index, warehouse_correct, warehouse_count = get_question_matrices(
+            warehouse_cube, dimensions
+        )
+        assert list(csv_index) == list(warehouse_index)
+        assert numpy.array_equal(csv_correct, warehouse_correct)
+        assert numpy.array_equal(csv_count, warehouse_count)
+
+    # every question is its own resampling unit, even with the same number in two sections
+    _, _, count = get_question_matrices(csv_cube, ["prompt_method"])
+    assert count.shape == (3, len(question_list))
+
+
+def test_synthetic_sessions_ask_the_same_questions_by_position(tmp_path: Path) -> None:
+    write_synthetic_sweep(tmp_path, num_questions=50, num_sessions=4, questions_per_session=20)
+    question_list = parse_question_source(tmp_path / "questions_synthetic.txt")
+    for exam_json_path in sorted((tmp_path / "sessions").glob("*/exam_data.json")):
+        exam_data = json.loads(exam_json_path.read_text())
+        assert [question["question_input"] for question in exam_data["questions"]] == (
+            question_list[:20]
+        )
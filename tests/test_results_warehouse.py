@@ -0,0 +1,116 @@
+"""
+Check that the warehouse re-ingests only the session directories and archives that changed, and
+removes the sessions deleted from the group directory.
+"""
+
+# imports
+import json
+import os
+import shutil
+from pathlib import Path
+
+# packages
+import pytest
+
+# project imports
+from question_data import parse_question_source
+from results_warehouse import connect_warehouse, ingest_sessions
+from session_archive import archive_session_group
+from synthetic_data import DATA_PATH, generate_session
+
+
+def write_session(session_group_path: Path, session_name: str, seed: int) -> Path:
+    """Write a synthetic session directory and return the path of its exam_data.json."""
+    question_list = parse_question_source(DATA_PATH / "questions_02.txt")[:20]
+    exam_data = generate_session(question_list, "generate_prompt_020", seed=seed)
+    exam_json_path = session_group_path / session_name / "exam_data.json"
+    exam_json_path.parent.mkdir(parents=True)
+    exam_json_path.write_text(json.dumps(exam_data))
+    return exam_json_path
+
+
+def get_warehouse_session_names(connection) -> list[str]:
+    """Return the names of the sessions in the warehouse."""
+    return [
+        row["session_name"]
+        for row in connection.execute("SELECT session_name FROM sessions ORDER BY session_name")
+    ]
+
+
+@pytest.fixture
+def session_group_path(tmp_path: Path) -> Path:
+    # two session directories and one session left only in the archive
+    session_group_path = tmp_path / "sessions-001"
+    for session_number in range(1, 4):
+        write_session(session_group_path, f"cpa-exam-{session_number:03d}", seed=session_number)
+    archive_session_group(session_group_path)
+    shutil.rmtree(session_group_path / "cpa-exam-003")
+    return session_group_path
+
+
+def test_unchanged_sessions_are_not_ingested_again(session_group_path: Path) -> None:
+    connection = connect_warehouse(session_group_path.parent / "exam_results.sqlite")
+    assert sorted(ingest_sessions(connection, session_group_path)) == [
+        "cpa-exam-001",
+        "cpa-exam-002",
+        "cpa-exam-003",
+    ]
+    assert ingest_sessions(connection, session_group_path) == []
+
+    # a changed directory is ingested again on its own
+    exam_json_path = session_group_path / "cpa-exam-002" / "exam_data.json"
+    os.utime(exam_json_path, (0, exam_json_path.stat().st_mtime + 10))
+    assert ingest_sessions(connection, session_group_path) == ["cpa-exam-002"]
+    connection.close()
+
+
+def test_changed_archive_with_another_sessions_mtime_is_ingested(
+    session_group_path: Path,
+) -> None:
+    connection = connect_warehouse(session_group_path.parent / "exam_results.sqlite")
+    ingest_sessions(connection, session_group_path)
+
+    # archive a new session and give the archive the modification time of a session directory
+    write_session(session_group_path, "cpa-exam-004", seed=4)
+    archive_path = archive_session_group(session_group_path)
+    shutil.rmtree(session_group_path / "cpa-exam-004")
+    directory_mtime = (session_group_path / "cpa-exam-001" / "exam_data.json").stat().st_mtime
+    os.utime(archive_path, (0, directory_mtime))
+
+    assert "cpa-exam-004" in ingest_sessions(connection, session_group_path)
+    assert get_warehouse_session_names(connection) == [
+        "cpa-exam-001",
+        "cpa-exam-002",
+        "cpa-exam-003",
+        "cpa-exam-004",
+    ]
+    connection.close()
+
+
+def test_deleted_sessions_are_removed(session_group_path: Path) -> None:
+    connection = connect_warehouse(session_group_path.parent / "exam_results.sqlite")
+    ingest_sessions(connection, session_group_path)
+
+    # a directory that is also archived is kept, and one that is not is removed
+    shutil.rmtree(session_group_path / "cpa-exam-001")
+    write_session(session_group_path, "cpa-exam-005", seed=5)
+    ingest_sessions(connection, session_group_path)
+    shutil.rmtree(session_group_path / "cpa-exam-005")
+    assert ingest_sessions(connection, session_group_path) == []
+    assert get_warehouse_session_names(connection) == [
+        "cpa-exam-001",
+        "cpa-exam-002",
+        "cpa-exam-003",
+    ]
+    assert connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 3 * 20
+    num_orphaned = connection.execute(
+        "SELECT COUNT(*) FROM response_search "
+        "WHERE rowid NOT IN (SELECT response_id FROM responses)"
+    ).fetchone()[0]
+    assert num_orphaned == 0
+
+    # removing the archive removes the sessions left only in it
+    next(session_group_path.glob("*.archive.json.gz")).unlink()
+    ingest_sessions(connection, session_group_path)
+    assert get_warehouse_session_names(connection) == ["cpa-exam-002"]
+    connection.close()
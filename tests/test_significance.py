@@ -0,0 +1,141 @@
+"""
+Check the sign test p-values against binomial probabilities computed by hand, and the Holm and
+Benjamini-Hochberg corrections against a direct implementation.
+"""
+
+# imports
+import math
+
+# packages
+import numpy
+import pytest
+
+# project imports
+from response_matrix import ResponseMatrix
+from significance import (
+    adjust_p_values,
+    get_binomial_cdf,
+    get_sign_test_counts,
+    get_sign_test_p_values,
+    paired_significance_matrices,
+)
+
+
+def get_exact_binomial_cdf(num_trials: int, num_successes: int) -> float:
+    """Return P(X <= k) for X ~ Binomial(n, 1/2) with exact integer arithmetic."""
+    return sum(math.comb(num_trials, index) for index in range(num_successes + 1)) / 2**num_trials
+
+
+def get_reference_adjusted_p_values(p_values: list[float], correction: str) -> list[float]:
+    """Adjust p-values one at a time from their definitions."""
+    num_tests = len(p_values)
+    order = sorted(range(num_tests), key=lambda index: p_values[index])
+    adjusted_p_values = [0.0] * num_tests
+    if correction == "holm":
+        running_max = 0.0
+        for rank, index in enumerate(order):
+            running_max = max(running_max, (num_tests - rank) * p_values[index])
+            adjusted_p_values[index] = min(running_max, 1.0)
+    else:
+        running_min = 1.0
+        for rank in reversed(range(num_tests)):
+            index = order[rank]
+            running_min = min(running_min, num_tests / (rank + 1) * p_values[index])
+            adjusted_p_values[index] = running_min
+    return adjusted_p_values
+
+
+def test_binomial_cdf_matches_exact_values() -> None:
+    cases = [(0, 0), (1, 0), (10, 2), (10, 5), (25, 7), (200, 80), (1000, 470)]
+    num_trials = numpy.array([trials for trials, _ in cases])
+    num_successes = numpy.array([successes for _, successes in cases])
+    assert get_binomial_cdf(num_trials, num_successes) == pytest.approx(
+        [get_exact_binomial_cdf(trials, successes) for trials, successes in cases], rel=1e-9
+    )
+
+
+def test_sign_test_p_values_match_hand_computed_values() -> None:
+    # 8 wins against 2 losses: p = 2 * P(X <= 2) = 2 * 56 / 1024
+    num_wins = numpy.array([[0, 8, 3], [2, 0, 0], [3, 0, 0]])
+    p_values = get_sign_test_p_values(num_wins)
+    assert p_values[0, 1] == p_values[1, 0] == pytest.approx(2 * 56 / 1024)
+    assert p_values[0, 2] == 1.0
+    assert p_values[1, 2] == 1.0
+
+
+def test_sign_test_counts_skip_questions_not_asked() -> None:
+    rates = numpy.array(
+        [
+            [1.0, 1.0, 0.0, numpy.nan],
+            [0.0, 1.0, 1.0, 1.0],
+        ]
+    )
+    num_wins = get_sign_test_counts(rates)
+    assert num_wins.tolist() == [[0, 1], [1, 0]]
+
+
+@pytest.mark.parametrize("correction", ["holm", "fdr_bh"])
+def test_corrections_match_their_definitions(correction: str) -> None:
+    rng = numpy.random.default_rng(0)
+    p_value_matrix = rng.uniform(0.0, 0.2, size=(12, 12))
+    p_value_matrix = numpy.triu(p_value_matrix, 1) + numpy.triu(p_value_matrix, 1).T
+    row_indexes, column_indexes = numpy.triu_indices(12, k=1)
+
+    adjusted_matrix = adjust_p_values(p_value_matrix, correction)
+    assert numpy.array_equal(adjusted_matrix, adjusted_matrix.T)
+    assert adjusted_matrix[row_indexes, column_indexes] == pytest.approx(
+        get_reference_adjusted_p_values(
+            p_value_matrix[row_indexes, column_indexes].tolist(), correction
+        )
+    )
+    assert numpy.array_equal(adjust_p_values(p_value_matrix, "none"), p_value_matrix)
+    with pytest.raises(ValueError):
+        adjust_p_values(p_value_matrix, "bonferroni")
+
+
+def test_paired_significance_matrices_compare_configurations() -> None:
+    # the first prompt is right on 10 questions the second gets wrong, and the two sessions of
+    # the third prompt agree with the second
+    num_questions = 30
+    better = numpy.ones(num_questions, dtype=numpy.int8)
+    worse = better.copy()
+    worse[:10] = 0
+    matrix = ResponseMatrix(
+        correct=numpy.array([better, worse, worse, worse]),
+        answers=numpy.zeros((4, num_questions), dtype=numpy.int8),
+        question_ids=numpy.array([f"REG-{number}" for number in range(num_questions)]),
+        correct_answers=numpy.zeros(num_questions, dtype=numpy.int8),
+        session_names=numpy.array([f"cpa-exam-{number:03d}" for number in range(1, 5)]),
+        model_names=numpy.array(["text-davinci-003"] * 4),
+        prompt_methods=numpy.array(
+            [
+                "generate_prompt_018",
+                "generate_prompt_019",
+                "generate_prompt_020",
+                "generate_prompt_020",
+            ]
+        ),
+        temperatures=numpy.zeros(4),
+        best_of=numpy.ones(4, dtype=numpy.int64),
+    )
+
+    difference_df, p_value_df = paired_significance_matrices(
+        matrix, ["prompt_methods"], correction="holm"
+    )
+    assert list(difference_df.index) == [
+        "generate_prompt_018",
+        "generate_prompt_019",
+        "generate_prompt_020",
+    ]
+    assert difference_df.loc["generate_prompt_018", "generate_prompt_019"] == pytest.approx(
+        10 / num_questions
+    )
+    assert difference_df.loc["generate_prompt_019", "generate_prompt_018"] == pytest.approx(
+        -10 / num_questions
+    )
+
+    # 10 wins and no losses: p = 2 / 2**10 before correction, times 3 pairs for Holm's first
+    assert p_value_df.loc["generate_prompt_018", "generate_prompt_019"] == pytest.approx(
+        3 * 2 / 2**10
+    )
+    assert p_value_df.loc["generate_prompt_019", "generate_prompt_020"] == 1.0